@@ -2,7 +2,10 @@
 from flask import Flask, jsonify, request
 import requests
 
+from server_timing import server_timing
+
 app = Flask(__name__)
+server_timing.init_app(app)  # Header Server-Timing com o tempo de cada fase
 
 # Banco de dados em memória para exemplo (será substituído pelo banco real depois)
 livros_memoria = []
@@ -21,7 +24,8 @@ def home():
 def get_users():
     # Captura o parâmetro ?page opcional
     page = request.args.get('page', 1)
-    response = requests.get(f'https://jsonplaceholder.typicode.com/users')
+    with server_timing.medir('externo'):
+        response = requests.get(f'https://jsonplaceholder.typicode.com/users')
     if response.status_code == 200:
         return jsonify(response.json()), 200
     return jsonify({'error': 'Erro ao acessar API externa'}), response.status_code
@@ -1,13 +1,17 @@
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, jsonify, request, make_response, Response, stream_with_context
 from flask_cors import CORS
 import json
 import jwt
 import datetime
-from functools import wraps
+from functools import wraps, lru_cache
 import logging
 
+from xml_serializer import iter_xml
+from server_timing import server_timing
+
 app = Flask(__name__)
 CORS(app)  # Habilita CORS para todas as rotas
+server_timing.init_app(app)  # Header Server-Timing com o tempo de cada fase
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
@@ -42,11 +46,11 @@ def validate_content_type():
     ]
 
     if request.headers.get('Content-Type') not in allowed_content_types:
-        return jsonify({
+        return responder({
             'title': 'Unsupported Media Type',
             'status': 415,
             'detail': 'Unsupported Media Type. Please use application/json or application/x-www-form-urlencoded'
-        }), 415
+        }, 415)
 
     return None
 
@@ -92,14 +96,15 @@ def token_required(f):
 
         auth_header = request.headers.get('Authorization')
         if not auth_header:
-            return jsonify({'message': 'Unauthorized'}), 401
+            return responder({'message': 'Unauthorized'}, 401)
 
         try:
-            token = auth_header.split(' ')[1]
-            decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            with server_timing.medir('auth'):
+                token = auth_header.split(' ')[1]
+                decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
             request.user_id = decoded['sub']
         except Exception as e:
-            return jsonify({'message': 'Unauthorized'}), 401
+            return responder({'message': 'Unauthorized'}, 401)
 
         return f(*args, **kwargs)
     return decorated
@@ -121,32 +126,94 @@ def get_best_response_format():
         return 'xml'
     return 'json'
 
+def responder(dados, status=200, raiz='resposta'):
+    """
+    Serializa a resposta no formato negociado com o cliente.
+    O XML é gerado em streaming, sem montar o documento inteiro em memória.
+    """
+    if get_best_response_format() == 'xml':
+        return Response(
+            stream_with_context(iter_xml(dados, raiz)),
+            status=status,
+            mimetype='application/xml'
+        )
+    return jsonify(dados), status
+
 # ==============================================
 # Implementação de HATEOAS (Hypermedia)
 # ==============================================
-def add_hal_links(data, resource_type):
+POR_PAGINA_PADRAO = 10
+POR_PAGINA_MAXIMO = 100
+
+# Singular usado como rel do link templated de item na coleção
+RELS_ITEM = {'livros': 'livro'}
+
+@lru_cache(maxsize=64)
+def link_templates(base_url, resource_type):
+    """
+    Pré-computa os links de um recurso uma única vez por host.
+    Evita reconstruir as mesmas strings a cada item/requisição.
+    """
+    colecao = f'{base_url}/{resource_type}'
+    return {
+        'colecao': colecao,
+        'item_prefixo': f'{colecao}/',
+        'pagina': colecao + '?pagina={pagina}&por_pagina={por_pagina}',
+        'item': {'href': colecao + '/{id}', 'templated': True},
+        'create': {'href': colecao, 'method': 'POST'}
+    }
+
+def get_paginacao():
+    """Lê pagina/por_pagina da query string, limitando o tamanho da página"""
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    por_pagina = request.args.get('por_pagina', POR_PAGINA_PADRAO, type=int)
+    por_pagina = min(max(por_pagina, 1), POR_PAGINA_MAXIMO)
+    return pagina, por_pagina
+
+def add_hal_links(data, resource_type, pagina=1, por_pagina=POR_PAGINA_PADRAO):
     """
     Adiciona links HATEOAS seguindo o padrão HAL (Hypertext Application Language)
+    Para listas, embute apenas a página solicitada e adiciona links de navegação.
     """
-    base_url = request.host_url.rstrip('/')
+    templates = link_templates(request.host_url.rstrip('/'), resource_type)
     
     if isinstance(data, list):
+        total_itens = len(data)
+        total_paginas = max((total_itens + por_pagina - 1) // por_pagina, 1)
+        inicio = (pagina - 1) * por_pagina
+        href_pagina = templates['pagina']
+
+        links = {
+            'self': {'href': href_pagina.format(pagina=pagina, por_pagina=por_pagina)},
+            'first': {'href': href_pagina.format(pagina=1, por_pagina=por_pagina)},
+            'last': {'href': href_pagina.format(pagina=total_paginas, por_pagina=por_pagina)},
+            RELS_ITEM.get(resource_type, 'item'): templates['item'],
+            'create': templates['create']
+        }
+        if pagina > 1:
+            links['prev'] = {'href': href_pagina.format(pagina=min(pagina - 1, total_paginas), por_pagina=por_pagina)}
+        if pagina < total_paginas:
+            links['next'] = {'href': href_pagina.format(pagina=pagina + 1, por_pagina=por_pagina)}
+
         return {
             '_embedded': {
-                resource_type: data
+                resource_type: data[inicio:inicio + por_pagina]
             },
-            '_links': {
-                'self': {'href': f'{base_url}/{resource_type}'},
-                'create': {'href': f'{base_url}/{resource_type}', 'method': 'POST'}
-            }
+            'pagina': pagina,
+            'por_pagina': por_pagina,
+            'total_itens': total_itens,
+            'total_paginas': total_paginas,
+            '_links': links
         }
     else:
+        href = templates['item_prefixo'] + str(data['id'])
         return {
             **data,
             '_links': {
-                'self': {'href': f'{base_url}/{resource_type}/{data["id"]}'},
-                'update': {'href': f'{base_url}/{resource_type}/{data["id"]}', 'method': 'PUT'},
-                'delete': {'href': f'{base_url}/{resource_type}/{data["id"]}', 'method': 'DELETE'}
+                'self': {'href': href},
+                'update': {'href': href, 'method': 'PUT'},
+                'delete': {'href': href, 'method': 'DELETE'},
+                'collection': {'href': templates['colecao']}
             }
         }
 
@@ -175,17 +242,13 @@ usuarios = [
 @app.before_request
 def before_request():
     """Middleware executado antes de cada requisição"""
-    log_request()
-    
-    # Validação de Content-Type
-    content_type_error = validate_content_type()
-    if content_type_error:
-        return content_type_error
-    
-    # Validação de Accept
-    accept_error = validate_accept_header()
-    if accept_error:
-        return accept_error
+    with server_timing.medir('middleware'):
+        log_request()
+        
+        # Validação de Content-Type e de Accept
+        erro = validate_content_type() or validate_accept_header()
+    if erro:
+        return erro
 
 @app.after_request
 def after_request(response):
@@ -195,42 +258,33 @@ def after_request(response):
 @app.route('/')
 def home():
     """Rota inicial que demonstra content negotiation"""
-    response_format = get_best_response_format()
-    
-    if response_format == 'json':
-        return jsonify({
-            'mensagem': 'API REST com HATEOAS',
-            '_links': {
-                'livros': {'href': '/livros'},
-                'login': {'href': '/login'}
-            }
-        }), 200
-    else:
-        return make_response(
-            '<root><mensagem>API REST com HATEOAS</mensagem></root>',
-            200,
-            {'Content-Type': 'application/xml'}
-        )
+    return responder({
+        'mensagem': 'API REST com HATEOAS',
+        '_links': {
+            'livros': {'href': '/livros'},
+            'login': {'href': '/login'}
+        }
+    }, 200, raiz='root')
 
 @app.route('/login', methods=['POST'])
 def login():
     """Rota de autenticação"""
     if not request.is_json:
-        return jsonify({
+        return responder({
             'title': 'Unsupported Media Type',
             'status': 415,
             'detail': 'Content-Type deve ser application/json'
-        }), 415
+        }, 415, raiz='problema')
 
     dados = request.get_json()
     usuario = next((u for u in usuarios if u['email'] == dados.get('email')), None)
     
     if not usuario or usuario['password'] != dados.get('password'):
-        return jsonify({
+        return responder({
             'title': 'Unauthorized',
             'status': 401,
             'detail': 'Credenciais inválidas'
-        }), 401
+        }, 401, raiz='problema')
 
     token = jwt.encode({
         'sub': usuario['id'],
@@ -238,53 +292,45 @@ def login():
         'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)
     }, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-    return jsonify({
+    return responder({
         'token': token,
         '_links': {
             'self': {'href': '/login', 'method': 'POST'}
         }
-    }), 200
+    }, 200)
 
 @app.route('/livros', methods=['GET', 'OPTIONS'])
 def listar_livros():
-    """Lista todos os livros com suporte a HATEOAS"""
+    """Lista os livros paginados com suporte a HATEOAS"""
     if request.method == 'OPTIONS':
         response = make_response()
         response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Accept, Authorization')
         return response
 
-    response_format = get_best_response_format()
-    livros_com_links = add_hal_links(livros, 'livros')
-    
-    if response_format == 'json':
-        return jsonify(livros_com_links), 200
-    else:
-        return make_response(
-            '<livros>' + ''.join(f'<livro><id>{l["id"]}</id><titulo>{l["titulo"]}</titulo><autor>{l["autor"]}</autor></livro>' for l in livros) + '</livros>',
-            200,
-            {'Content-Type': 'application/xml'}
-        )
+    pagina, por_pagina = get_paginacao()
+    livros_com_links = add_hal_links(livros, 'livros', pagina, por_pagina)
+    return responder(livros_com_links, 200, raiz='livros')
 
 @app.route('/livros', methods=['POST'])
 @token_required
 def criar_livro():
     """Cria um novo livro com validação e HATEOAS"""
     if not request.is_json:
-        return jsonify({
+        return responder({
             'title': 'Unsupported Media Type',
             'status': 415,
             'detail': 'Content-Type deve ser application/json'
-        }), 415
+        }, 415, raiz='problema')
 
     dados = request.get_json()
     
     if not dados.get('titulo'):
-        return jsonify({
+        return responder({
             'title': 'Bad Request',
             'status': 400,
             'detail': 'Título é obrigatório'
-        }), 400
+        }, 400, raiz='problema')
 
     novo_livro = {
         'id': len(livros) + 1,
@@ -295,7 +341,7 @@ def criar_livro():
     livros.append(novo_livro)
     livro_com_links = add_hal_links(novo_livro, 'livros')
     
-    return jsonify(livro_com_links), 201
+    return responder(livro_com_links, 201, raiz='livro')
 
 @app.route('/livros/<int:id>', methods=['GET', 'PUT', 'DELETE', 'OPTIONS'])
 @token_required
@@ -310,79 +356,79 @@ def gerenciar_livro(id):
     livro = next((l for l in livros if l['id'] == id), None)
     
     if not livro:
-        return jsonify({
+        return responder({
             'title': 'Not Found',
             'status': 404,
             'detail': 'Livro não encontrado',
             '_links': {
                 'listar': {'href': '/livros', 'method': 'GET'}
             }
-        }), 404
+        }, 404, raiz='problema')
 
     if request.method == 'GET':
         livro_com_links = add_hal_links(livro, 'livros')
-        return jsonify(livro_com_links), 200
+        return responder(livro_com_links, 200, raiz='livro')
 
     elif request.method == 'PUT':
         if not request.is_json:
-            return jsonify({
+            return responder({
                 'title': 'Unsupported Media Type',
                 'status': 415,
                 'detail': 'Content-Type deve ser application/json'
-            }), 415
+            }, 415, raiz='problema')
 
         dados = request.get_json()
         livro['titulo'] = dados.get('titulo', livro['titulo'])
         livro['autor'] = dados.get('autor', livro['autor'])
         
         livro_com_links = add_hal_links(livro, 'livros')
-        return jsonify(livro_com_links), 200
+        return responder(livro_com_links, 200, raiz='livro')
 
     elif request.method == 'DELETE':
         livros.remove(livro)
-        return jsonify({
+        return responder({
             'title': 'OK',
             'status': 200,
             'detail': 'Livro removido com sucesso',
             '_links': {
                 'listar': {'href': '/livros', 'method': 'GET'}
             }
-        }), 200
+        }, 200)
 
 # ==============================================
 # Error Handlers
 # ==============================================
 @app.errorhandler(400)
 def bad_request(error):
-    return jsonify({
+    return responder({
         'title': 'Bad Request',
         'status': 400,
         'detail': str(error)
-    }), 400
+    }, 400, raiz='problema')
 
 @app.errorhandler(401)
 def unauthorized(error):
-    return jsonify({
+    return responder({
         'title': 'Unauthorized',
         'status': 401,
         'detail': str(error)
-    }), 401
+    }, 401, raiz='problema')
 
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({
+    return responder({
         'title': 'Not Found',
         'status': 404,
         'detail': str(error)
-    }), 404
+    }, 404, raiz='problema')
 
 @app.errorhandler(500)
 def internal_server_error(error):
-    return jsonify({
+    return responder({
         'title': 'Internal Server Error',
         'status': 500,
         'detail': 'An unexpected error occurred'
-    }), 500
+    }, 500, raiz='problema')
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001) 
\ No newline at end of file
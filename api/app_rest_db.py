@@ -1,25 +1,77 @@
-from flask import Flask, jsonify, request, make_response
+from flask import Blueprint, jsonify, request, make_response, g, Response, current_app, send_file
+from werkzeug.exceptions import HTTPException
+from sqlalchemy.exc import IntegrityError
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from functools import wraps
+from io import BytesIO
 import logging
 import jwt
 import os
 
 # Importa os modelos e configuração do banco
-from models import db, User, Book, Category
-from database import create_app, init_database
+from models import db, User, Book, BookArquivado, Category, BookChange, Auditoria, normalizar_texto
+from database import create_app, init_database, schema_atualizado, aquecer
+from eventos import broadcaster
+from group_commit import group_committer, EscritaCancelada
+from profiler import profiler
+from consultas_lentas import consultas_lentas
+from server_timing import server_timing
+from facetas import parse_facetas, calcular_facetas
+from contagens import contador_estimado
+from arquivamento import arquivador, modelo_com_arquivo
+from sharding import shards, carregar_livros, PROFUNDIDADE_MAXIMA
+from outbox import outbox
+from idempotencia import idempotencia, idempotente
+from cache import cache_compartilhado, namespace_livro
+import schemas
+from sugestoes import indice_sugestoes, LIMITE_PADRAO as SUGESTOES_PADRAO, LIMITE_MAXIMO as SUGESTOES_MAXIMO
 
-# Cria a aplicação usando a factory function
-app = create_app()
+# As rotas ficam em um blueprint; a aplicação só é criada sob demanda
+api = Blueprint('api', __name__)
 
-# Configuração avançada do CORS
-CORS(app, 
-     origins=["http://localhost:3000", "http://127.0.0.1:3000"],  # URLs do frontend
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],         # Métodos permitidos
-     allow_headers=["Content-Type", "Authorization"],             # Headers permitidos
-     supports_credentials=True                                    # Permite cookies/credenciais
-)
+def create_api():
+    """Factory da API: cria a aplicação, registra as rotas e as extensões"""
+    app = create_app()
+    shards.init_app(app)  # Modo particionado (SHARDS=N)
+    
+    # Configuração avançada do CORS
+    CORS(app, 
+         origins=["http://localhost:3000", "http://127.0.0.1:3000"],  # URLs do frontend
+         methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],  # Métodos permitidos
+         allow_headers=["Content-Type", "Authorization", "X-Profile", "Idempotency-Key"],  # Headers permitidos
+         supports_credentials=True                                    # Permite cookies/credenciais
+    )
+    
+    # Registrados antes das rotas para medir também os middlewares
+    with app.app_context():
+        server_timing.init_app(app, db.engine)
+    profiler.init_app(app, autorizar=solicitante_admin)
+    app.register_blueprint(api)
+    broadcaster.init_app(app)
+    group_committer.init_app(app)
+    indice_sugestoes.init_app(app)
+    contador_estimado.init_app(app)
+    arquivador.init_app(app)
+    outbox.init_app(app)
+    idempotencia.init_app(app, identificar=solicitante_id)
+    cache_compartilhado.init_app(app)
+    return app
+
+_app = None
+
+def get_app():
+    """Retorna a aplicação do processo, criando-a no primeiro uso"""
+    global _app
+    if _app is None:
+        _app = create_api()
+    return _app
+
+def __getattr__(nome):
+    """Mantém `from app_rest_db import app` funcionando sem criar a app no import"""
+    if nome == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
@@ -59,8 +111,8 @@ def log_response(response):
     return response
 
 def validate_json():
-    """Middleware para validar JSON em requisições POST/PUT"""
-    if request.method in ['POST', 'PUT'] and not request.is_json:
+    """Middleware para validar JSON em requisições POST/PUT/PATCH"""
+    if request.method in ['POST', 'PUT', 'PATCH'] and not request.is_json:
         return jsonify({
             'erro': 'Tipo de conteúdo inválido',
             'status': 415,
@@ -68,26 +120,111 @@ def validate_json():
         }), 415
     return None
 
+def autenticar_token(auth_header):
+    """Valida o header Authorization e retorna (usuario, resposta_de_erro)"""
+    if not auth_header:
+        return None, (jsonify({'erro': 'Token de autorização necessário'}), 401)
+
+    try:
+        with server_timing.medir('auth'):
+            token = auth_header.split(' ')[1]
+            decoded = jwt.decode(token, get_jwt_secret(), algorithms=[JWT_ALGORITHM])
+            current_user = User.query.get(decoded['sub'])
+        if not current_user or not current_user.ativo:
+            return None, (jsonify({'erro': 'Usuário inválido ou inativo'}), 401)
+        return current_user, None
+    except Exception as e:
+        return None, (jsonify({'erro': 'Token inválido'}), 401)
+
 def token_required(f):
     """Decorator para proteger rotas que requerem autenticação"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header:
-            return jsonify({'erro': 'Token de autorização necessário'}), 401
+        # Dentro de um /batch o token já foi verificado uma única vez
+        if g.get('batch'):
+            current_user = g.batch_usuario
+            if not current_user:
+                return jsonify({'erro': 'Token de autorização necessário'}), 401
+        else:
+            current_user, erro = autenticar_token(request.headers.get('Authorization'))
+            if erro:
+                return erro
+
+        request.current_user = current_user
+        return f(*args, **kwargs)
+    return decorated
+
+def confirmar_transacao():
+    """Confirma a transação atual (em um batch transacional apenas envia ao banco)"""
+    if g.get('batch_transacional'):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+class ErroEscrita(Exception):
+    """Erro de negócio em uma mutação, convertido em resposta HTTP pela rota"""
+    def __init__(self, status, erro, detalhes):
+        super().__init__(detalhes)
+        self.status = status
+        self.erro = erro
+        self.detalhes = detalhes
 
+    def resposta(self):
+        return jsonify({
+            'erro': self.erro,
+            'status': self.status,
+            'detalhes': self.detalhes
+        }), self.status
+
+def executar_escrita(mutacao, book_id=None):
+    """
+    Executa mutacao(sessao) e confirma a transação. `sessao` é onde ficam a
+    tabela books e o log de alterações: a sessão principal ou, no modo
+    particionado, a do shard de book_id (o log é repassado ao banco principal
+    depois do commit, ver sharding.py).
+    A mutação usa apenas `sessao` e sessao_principal(sessao), nunca db.session.
+    Com GROUP_COMMIT ativo a mutação é aplicada pela thread escritora, na
+    sessão dela, junto com as demais do lote; dentro de um /batch roda na
+    sessão do batch.
+    """
+    if shards.ativo:
+        with shards.sessao(book_id) as sessao:
+            sessao.info['principal'] = db.session()
+            resultado = mutacao(sessao)
+            # Categorias criadas pela escrita são confirmadas antes do livro que as referencia
+            db.session.commit()
         try:
-            token = auth_header.split(' ')[1]
-            decoded = jwt.decode(token, get_jwt_secret(), algorithms=[JWT_ALGORITHM])
-            current_user = User.query.get(decoded['sub'])
-            if not current_user or not current_user.ativo:
-                return jsonify({'erro': 'Usuário inválido ou inativo'}), 401
-            request.current_user = current_user
+            shards.repassar([shards.indice(book_id)])
         except Exception as e:
-            return jsonify({'erro': 'Token inválido'}), 401
+            # O livro e o log já estão no shard: a thread de repasse tenta de novo
+            logger.warning(f"Repasse do log do shard adiado: {e}")
+        return resultado
 
-        return f(*args, **kwargs)
-    return decorated
+    if group_committer.ativo and not g.get('batch'):
+        # Devolve a conexão da requisição ao pool antes de esperar pelo lote
+        db.session.close()
+        try:
+            return group_committer.submeter(mutacao)
+        except EscritaCancelada as e:
+            raise ErroEscrita(503, 'Escrita não aplicada', str(e))
+
+    resultado = mutacao(db.session)
+    confirmar_transacao()
+    return resultado
+
+def sessao_principal(sessao):
+    """Sessão do banco principal (categorias, arquivo e índice de sugestões) de uma escrita"""
+    return sessao.info.get('principal', sessao)
+
+def solicitante_admin(req):
+    """Verifica se o token da requisição pertence a um admin (usado pelo profiler)"""
+    usuario, erro = autenticar_token(req.headers.get('Authorization'))
+    return usuario is not None and usuario.role == 'admin'
+
+def solicitante_id(req):
+    """Id do usuário do token da requisição (escopo das Idempotency-Key), ou None se inválido"""
+    usuario, erro = autenticar_token(req.headers.get('Authorization'))
+    return usuario.id if usuario is not None else None
 
 def admin_required(f):
     """Decorator para rotas que requerem privilégios de administrador"""
@@ -99,25 +236,56 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def validar_corpo(esquema, max_bytes, parcial=False):
+    """
+    Decorator que rejeita o corpo antes de chegar ao banco: 413 pelo
+    Content-Length (sem ler o corpo) e 400 pelo schema compilado. Os valores
+    validados ficam em request.dados. Aplicar antes do token_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.content_length is not None and request.content_length > max_bytes:
+                return jsonify({
+                    'erro': 'Corpo muito grande',
+                    'status': 413,
+                    'detalhes': f'O corpo desta rota deve ter no máximo {max_bytes} bytes'
+                }), 413
+
+            valores, erros = esquema.validar(request.get_json(silent=True), parcial)
+            if erros:
+                return jsonify({
+                    'erro': 'Dados inválidos',
+                    'status': 400,
+                    'detalhes': '; '.join(erros.values()),
+                    'campos': erros
+                }), 400
+
+            request.dados = valores
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
 # ==============================================
 # Rotas da API
 # ==============================================
-@app.before_request
+@api.before_app_request
 def before_request():
     """Middleware executado antes de cada requisição"""
-    log_request()
-    
-    # Validação de JSON para POST/PUT
-    json_error = validate_json()
+    with server_timing.medir('middleware'):
+        log_request()
+        
+        # Validação de JSON para POST/PUT
+        json_error = validate_json()
     if json_error:
         return json_error
 
-@app.after_request
+@api.after_app_request
 def after_request(response):
     """Middleware executado depois de cada requisição"""
     return log_response(response)
 
-@app.route('/')
+@api.route('/')
 def home():
     """Rota inicial da API"""
     return jsonify({
@@ -136,11 +304,12 @@ def home():
             'usuarios': '/usuarios',
             'categorias': '/categorias',
             'jwt_config': '/jwt/configure',
-            'jwt_info': '/jwt/info'
+            'jwt_info': '/jwt/info',
+            'batch': '/batch'
         }
     }), 200
 
-@app.route('/options-info')
+@api.route('/options-info')
 def options_info():
     """Explica como funciona o método OPTIONS"""
     return jsonify({
@@ -168,7 +337,7 @@ def options_info():
 # ==============================================
 # Rotas de Configuração JWT
 # ==============================================
-@app.route('/jwt/configure', methods=['POST'])
+@api.route('/jwt/configure', methods=['POST'])
 def configure_jwt():
     """Configura uma chave JWT personalizada"""
     dados = request.get_json()
@@ -201,7 +370,7 @@ def configure_jwt():
             'status': 500
         }), 500
 
-@app.route('/jwt/info', methods=['GET'])
+@api.route('/jwt/info', methods=['GET'])
 def jwt_info():
     """Retorna informações sobre a configuração JWT atual"""
     current_secret = get_jwt_secret()
@@ -220,17 +389,11 @@ def jwt_info():
 # ==============================================
 # Rotas de Autenticação
 # ==============================================
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
+@validar_corpo(schemas.LOGIN, max_bytes=2 * 1024)
 def login():
     """Rota de autenticação com banco de dados"""
-    dados = request.get_json()
-    
-    if not dados.get('email') or not dados.get('password'):
-        return jsonify({
-            'erro': 'Dados incompletos',
-            'status': 400,
-            'detalhes': 'Email e senha são obrigatórios'
-        }), 400
+    dados = request.dados
 
     usuario = User.query.filter_by(email=dados['email']).first()
     
@@ -260,20 +423,12 @@ def login():
         'usuario': usuario.to_dict()
     }), 200
 
-@app.route('/register', methods=['POST'])
+@api.route('/register', methods=['POST'])
+@idempotente
+@validar_corpo(schemas.USUARIO, max_bytes=4 * 1024)
 def register():
     """Registra um novo usuário"""
-    dados = request.get_json()
-    
-    # Validação dos campos obrigatórios
-    campos_obrigatorios = ['email', 'password', 'nome']
-    for campo in campos_obrigatorios:
-        if not dados.get(campo):
-            return jsonify({
-                'erro': 'Dados incompletos',
-                'status': 400,
-                'detalhes': f'Campo {campo} é obrigatório'
-            }), 400
+    dados = request.dados
     
     # Verifica se o email já existe
     if User.query.filter_by(email=dados['email']).first():
@@ -287,13 +442,13 @@ def register():
     novo_usuario = User(
         email=dados['email'],
         nome=dados['nome'],
-        role=dados.get('role', 'customer')
+        role=dados.get('role') or 'customer'
     )
     novo_usuario.set_password(dados['password'])
     
     try:
         db.session.add(novo_usuario)
-        db.session.commit()
+        confirmar_transacao()
         
         return jsonify({
             'mensagem': 'Usuário criado com sucesso',
@@ -310,46 +465,167 @@ def register():
 # ==============================================
 # Rotas de Livros
 # ==============================================
-@app.route('/livros', methods=['GET'])
+MODOS_MATCH = ('contains', 'prefix', 'exact')
+MODOS_TOTAL = ('exact', 'estimate', 'none')
+
+def json_livros(livros):
+    """Array JSON com o json_cache de cada livro, sem montar os dicionários"""
+    return b'[' + b','.join(livro.json_bytes() for livro in livros) + b']'
+
+def resposta_json(campos, status=200):
+    """
+    Resposta JSON montada por concatenação: valores em bytes (json_livros,
+    json_cache) entram no corpo como estão, os demais passam pelo provedor JSON.
+    """
+    partes = []
+    for chave, valor in campos.items():
+        if not isinstance(valor, bytes):
+            valor = current_app.json.dumps(valor).encode()
+        partes.append(current_app.json.dumps(chave).encode() + b':' + valor)
+    return current_app.response_class(b'{' + b','.join(partes) + b'}', status=status, mimetype='application/json')
+
+def filtro_texto(coluna_norm, valor, modo):
+    """
+    Condição sobre uma coluna normalizada (sem acentos e minúsculas).
+    prefix e exact viram buscas por faixa/igualdade no índice da coluna.
+    """
+    termo = normalizar_texto(valor)
+    if modo == 'exact':
+        return coluna_norm == termo
+    if modo == 'prefix':
+        # termo <= coluna < termo com o último caractere incrementado
+        return db.and_(coluna_norm >= termo, coluna_norm < termo[:-1] + chr(ord(termo[-1]) + 1))
+    return coluna_norm.contains(termo, autoescape=True)
+
+def filtros_livros(args):
+    """
+    Filtros de /livros lidos da query string (titulo, autor, genero, ano,
+    disponivel e match). Retorna (condicoes, disponivel, filtrada), em que
+    condicoes(modelo) monta as condições para books ou books_arquivo.
+    Levanta ValueError se match for inválido.
+    """
+    titulo = args.get('titulo')
+    autor = args.get('autor')
+    genero = args.get('genero')
+    ano = args.get('ano', type=int)
+    disponivel = args.get('disponivel')
+    match = args.get('match', 'contains')
+    
+    # Modo de comparação de titulo/autor (?match=prefix|exact|contains)
+    if match not in MODOS_MATCH:
+        raise ValueError(f"match deve ser um de: {', '.join(MODOS_MATCH)}")
+    
+    disponivel_bool = disponivel.lower() in ['true', '1', 'sim'] if disponivel is not None else None
+    categoria = Category.por_nome(genero) if genero else None
+    
+    def condicoes(modelo):
+        """Filtros aplicados a books (e a books_arquivo, com incluir_arquivados)"""
+        # titulo/autor sem diferenciar acentos e maiúsculas
+        filtros = []
+        if titulo and normalizar_texto(titulo):
+            filtros.append(filtro_texto(modelo.titulo_norm, titulo, match))
+        if autor and normalizar_texto(autor):
+            filtros.append(filtro_texto(modelo.autor_norm, autor, match))
+        if genero:
+            # Igualdade no índice de category_id (sem categoria, nenhum livro)
+            filtros.append(modelo.category_id == categoria.id if categoria else db.false())
+        if ano:
+            filtros.append(modelo.ano == ano)
+        if disponivel_bool is not None:
+            filtros.append(modelo.disponivel == disponivel_bool)
+        return filtros
+    
+    filtrada = any([titulo, autor, genero, ano, disponivel is not None])
+    return condicoes, disponivel_bool, filtrada
+
+@api.route('/livros', methods=['GET'])
 def listar_livros():
     """Lista todos os livros com paginação e filtros"""
     # Parâmetros de paginação
     pagina = request.args.get('pagina', 1, type=int)
     por_pagina = request.args.get('por_pagina', 10, type=int)
     
-    # Parâmetros de filtro
-    autor = request.args.get('autor')
-    genero = request.args.get('genero')
-    ano = request.args.get('ano', type=int)
-    disponivel = request.args.get('disponivel')
-    
-    # Query base
-    query = Book.query
-    
-    # Aplica filtros
-    if autor:
-        query = query.filter(Book.autor.ilike(f'%{autor}%'))
-    if genero:
-        query = query.filter(Book.genero.ilike(f'%{genero}%'))
-    if ano:
-        query = query.filter(Book.ano == ano)
-    if disponivel is not None:
-        disponivel_bool = disponivel.lower() in ['true', '1', 'sim']
-        query = query.filter(Book.disponivel == disponivel_bool)
+    total = request.args.get('total', 'exact')
+    
+    # Estratégia do total de itens (?total=exact|estimate|none)
+    if total not in MODOS_TOTAL:
+        return jsonify({
+            'erro': 'Parâmetro inválido',
+            'status': 400,
+            'detalhes': f"total deve ser um de: {', '.join(MODOS_TOTAL)}"
+        }), 400
+    
+    # Filtros (titulo, autor, genero, ano, disponivel e ?match=)
+    try:
+        condicoes, disponivel_bool, filtrada = filtros_livros(request.args)
+    except ValueError as e:
+        return jsonify({
+            'erro': 'Parâmetro inválido',
+            'status': 400,
+            'detalhes': str(e)
+        }), 400
+    
+    # Contagens por faceta (?facets=genero,ano,disponivel)
+    try:
+        facetas = parse_facetas(request.args.get('facets', ''))
+    except ValueError as e:
+        return jsonify({
+            'erro': 'Parâmetro inválido',
+            'status': 400,
+            'detalhes': str(e)
+        }), 400
+    
+    incluir_arquivados = request.args.get('incluir_arquivados', 'false').lower() in ['true', '1', 'sim']
+    
+    # Modo particionado: todos os shards em paralelo, com o total somado (sempre exato)
+    if shards.ativo:
+        if facetas or incluir_arquivados:
+            return jsonify({
+                'erro': 'Parâmetro indisponível',
+                'status': 400,
+                'detalhes': 'facets e incluir_arquivados não são suportados no modo particionado'
+            }), 400
+        pagina, por_pagina = max(pagina, 1), max(por_pagina, 1)
+        if pagina * por_pagina > PROFUNDIDADE_MAXIMA:
+            # Cada shard leria pagina * por_pagina linhas para montar uma única página
+            return jsonify({
+                'erro': 'Parâmetro inválido',
+                'status': 400,
+                'detalhes': f'No modo particionado pagina * por_pagina deve ser no máximo {PROFUNDIDADE_MAXIMA}; '
+                            'use filtros para restringir a listagem'
+            }), 400
+        livros, total_itens = shards.listar(condicoes(Book), pagina, por_pagina)
+        total_paginas = -(-total_itens // por_pagina)
+        return resposta_json({
+            'livros': json_livros(livros),
+            'paginacao': {
+                'pagina_atual': pagina,
+                'total_paginas': total_paginas,
+                'total_itens': total_itens,
+                'por_pagina': por_pagina,
+                'tem_proxima': pagina < total_paginas,
+                'tem_anterior': pagina > 1
+            }
+        })
+    
+    # Arquivados são sempre indisponíveis: com disponivel=true o arquivo nem é lido
+    Livro = modelo_com_arquivo(incluir_arquivados and disponivel_bool is not True, condicoes)
+    query = db.session.query(Livro)
+    if Livro is Book:
+        query = query.filter(*condicoes(Book))
     
     # Ordena por título
-    query = query.order_by(Book.titulo)
+    query = query.order_by(Livro.titulo)
     
     # Paginação
-    livros_paginados = query.paginate(
-        page=pagina, 
-        per_page=por_pagina, 
-        error_out=False
-    )
-    
-    return jsonify({
-        'livros': [livro.to_dict() for livro in livros_paginados.items],
-        'paginacao': {
+    if total == 'exact':
+        livros_paginados = query.paginate(
+            page=pagina, 
+            per_page=por_pagina, 
+            error_out=False
+        )
+        livros = livros_paginados.items
+        paginacao = {
             'pagina_atual': livros_paginados.page,
             'total_paginas': livros_paginados.pages,
             'total_itens': livros_paginados.total,
@@ -357,50 +633,97 @@ def listar_livros():
             'tem_proxima': livros_paginados.has_next,
             'tem_anterior': livros_paginados.has_prev
         }
-    }), 200
+    else:
+        # Sem COUNT(*) exato: uma linha a mais diz se existe próxima página
+        pagina = max(pagina, 1)
+        por_pagina = max(por_pagina, 1)
+        livros = query.offset((pagina - 1) * por_pagina).limit(por_pagina + 1).all()
+        tem_proxima = len(livros) > por_pagina
+        livros = livros[:por_pagina]
+        paginacao = {
+            'pagina_atual': pagina,
+            'total_paginas': None,
+            'total_itens': None,
+            'por_pagina': por_pagina,
+            'tem_proxima': tem_proxima,
+            'tem_anterior': pagina > 1
+        }
+        if total == 'estimate':
+            estimado = contador_estimado.contar(query)
+            paginacao['total_itens'] = estimado
+            paginacao['total_paginas'] = -(-estimado // por_pagina)
+            paginacao['total_estimado'] = True
+    
+    resposta = {
+        'livros': json_livros(livros),
+        'paginacao': paginacao
+    }
+    if facetas:
+        resposta['facetas'] = calcular_facetas(query, facetas, filtrada or Livro is not Book, Livro)
+    
+    return resposta_json(resposta)
+
+def isbn_arquivado(sessao, isbn):
+    """ISBN usado por um livro arquivado (o índice único de books não o enxerga)"""
+    return sessao_principal(sessao).scalar(db.select(BookArquivado.id).filter_by(isbn=isbn).limit(1)) is not None
+
+def isbn_em_uso(sessao, isbn):
+    """ISBN já usado por um livro ativo (em qualquer shard) ou arquivado"""
+    if isbn_arquivado(sessao, isbn):
+        return True
+    if shards.ativo:
+        return shards.isbn_em_uso(isbn)
+    return sessao.scalar(db.select(Book.id).filter_by(isbn=isbn).limit(1)) is not None
 
-@app.route('/livros', methods=['POST'])
+@api.route('/livros', methods=['POST'])
+@idempotente
+@validar_corpo(schemas.LIVRO, max_bytes=16 * 1024)
 @token_required
 def criar_livro():
     """Cria um novo livro"""
-    dados = request.get_json()
-    
-    # Validação dos campos obrigatórios
-    if not dados.get('titulo') or not dados.get('autor'):
-        return jsonify({
-            'erro': 'Dados inválidos',
-            'status': 400,
-            'detalhes': 'Título e autor são obrigatórios'
-        }), 400
-    
-    # Verifica se o ISBN já existe (se fornecido)
-    if dados.get('isbn'):
-        if Book.query.filter_by(isbn=dados['isbn']).first():
-            return jsonify({
-                'erro': 'ISBN já cadastrado',
-                'status': 409,
-                'detalhes': 'Este ISBN já está em uso'
-            }), 409
+    dados = request.dados
+    usuario_id = request.current_user.id
+    # No modo particionado o id é definido antes, para escolher o shard
+    book_id = shards.proximo_id() if shards.ativo else None
 
-    novo_livro = Book(
-        titulo=dados['titulo'],
-        autor=dados['autor'],
-        ano=dados.get('ano'),
-        genero=dados.get('genero'),
-        isbn=dados.get('isbn'),
-        descricao=dados.get('descricao'),
-        paginas=dados.get('paginas'),
-        criado_por=request.current_user.id
-    )
+    def mutacao(sessao):
+        principal = sessao_principal(sessao)
+        # Verifica se o ISBN já existe (se fornecido)
+        if dados.get('isbn'):
+            if isbn_em_uso(sessao, dados['isbn']):
+                raise ErroEscrita(409, 'ISBN já cadastrado', 'Este ISBN já está em uso')
+
+        categoria = Category.obter_ou_criar(dados.get('genero'), principal)
+        novo_livro = Book(
+            id=book_id,
+            titulo=dados['titulo'],
+            autor=dados['autor'],
+            ano=dados.get('ano'),
+            genero=categoria.nome if categoria else None,
+            category_id=categoria.id if categoria else None,
+            isbn=dados.get('isbn'),
+            descricao=dados.get('descricao'),
+            paginas=dados.get('paginas'),
+            criado_por=usuario_id
+        )
+        sessao.add(novo_livro)
+        sessao.flush()  # Gera o id para o registro de alteração
+        BookChange.registrar(novo_livro, 'create', usuario_id, sessao)
+        indice_sugestoes.agendar(novo_livro, 'create', principal)
+        return novo_livro.to_dict()
     
     try:
-        db.session.add(novo_livro)
-        db.session.commit()
+        livro = executar_escrita(mutacao, book_id)
         
-        return jsonify({
+        resposta = jsonify({
             'mensagem': 'Livro criado com sucesso',
-            'livro': novo_livro.to_dict()
-        }), 201
+            'livro': livro
+        })
+        resposta.set_etag(str(livro['versao']))
+        return resposta, 201
+    except ErroEscrita as e:
+        db.session.rollback()
+        return e.resposta()
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -409,67 +732,125 @@ def criar_livro():
             'detalhes': str(e)
         }), 500
 
-@app.route('/livros/<int:id>', methods=['GET'])
+@api.route('/livros/<int:id>', methods=['GET'])
 def obter_livro(id):
-    """Obtém um livro específico"""
-    livro = Book.query.get(id)
+    """
+    Obtém um livro específico (?incluir_arquivados=true procura também no arquivo).
+    Os livros ativos vêm do cache compartilhado entre os workers: b'<versao>:<json>'.
+    """
+    def carregar():
+        livro = shards.obter(id) if shards.ativo else Book.query.get(id)
+        return f'{livro.versao}:'.encode() + livro.json_bytes() if livro else None
+
+    valor = cache_compartilhado.obter_ou_calcular(namespace_livro(id), 'json', carregar)
+    if valor is None and request.args.get('incluir_arquivados', 'false').lower() in ['true', '1', 'sim']:
+        livro = BookArquivado.query.get(id)
+        valor = f'{livro.versao}:'.encode() + livro.json_bytes() if livro else None
     
-    if not livro:
+    if valor is None:
         return jsonify({
             'erro': 'Livro não encontrado',
             'status': 404,
             'detalhes': f'Livro com ID {id} não existe'
         }), 404
 
-    return jsonify({
-        'livro': livro.to_dict()
-    }), 200
+    versao, corpo = valor.split(b':', 1)
+    etag = versao.decode()
+    if request.if_none_match.contains(etag):
+        return '', 304
 
-@app.route('/livros/<int:id>', methods=['PUT'])
+    resposta = resposta_json({'livro': corpo})
+    resposta.set_etag(etag)
+    return resposta
+
+CAMPOS_EDITAVEIS_LIVRO = ['titulo', 'autor', 'ano', 'genero', 'isbn', 'descricao', 'paginas', 'disponivel']
+
+def versao_esperada():
+    """
+    Lê a versão exigida pelo header If-Match (ETag forte, ex.: "3").
+    Retorna None sem header (ou com *), e -1 se o valor não for uma versão válida.
+    """
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    versoes = [int(tag) for tag in if_match if tag.isdigit()]
+    return versoes[0] if versoes else -1
+
+@api.route('/livros/<int:id>', methods=['PUT'])
+@validar_corpo(schemas.LIVRO, max_bytes=16 * 1024, parcial=True)
 @token_required
 def atualizar_livro(id):
-    """Atualiza um livro específico"""
-    livro = Book.query.get(id)
-    
-    if not livro:
-        return jsonify({
-            'erro': 'Livro não encontrado',
-            'status': 404,
-            'detalhes': f'Livro com ID {id} não existe'
-        }), 404
-    
-    # Verifica se o usuário pode editar (admin ou criador)
-    if request.current_user.role != 'admin' and livro.criado_por != request.current_user.id:
-        return jsonify({
-            'erro': 'Acesso negado',
-            'status': 403,
-            'detalhes': 'Você só pode editar livros que criou'
-        }), 403
+    """
+    Atualiza um livro específico com um único UPDATE ... RETURNING.
+    Com If-Match a atualização só ocorre se a versão ainda for a informada.
+    """
+    dados = request.dados
+    usuario = request.current_user
+    usuario_id, usuario_admin = usuario.id, usuario.role == 'admin'
+    versao = versao_esperada()
 
-    dados = request.get_json()
-    
-    # Verifica ISBN duplicado (se alterado)
-    if dados.get('isbn') and dados['isbn'] != livro.isbn:
-        if Book.query.filter_by(isbn=dados['isbn']).first():
-            return jsonify({
-                'erro': 'ISBN já cadastrado',
-                'status': 409,
-                'detalhes': 'Este ISBN já está em uso'
-            }), 409
-    
-    # Atualiza os campos fornecidos
-    campos_editaveis = ['titulo', 'autor', 'ano', 'genero', 'isbn', 'descricao', 'paginas', 'disponivel']
-    for campo in campos_editaveis:
-        if campo in dados:
-            setattr(livro, campo, dados[campo])
+    def mutacao(sessao):
+        principal = sessao_principal(sessao)
+        # Atualiza os campos fornecidos e incrementa a versão
+        valores = {campo: dados[campo] for campo in CAMPOS_EDITAVEIS_LIVRO if campo in dados}
+        valores['versao'] = Book.versao + 1
+        valores.update(Book.valores_normalizados(valores))
+        # O índice único de books não enxerga os ISBNs arquivados nem os de outros shards
+        if valores.get('isbn') and (
+            isbn_arquivado(sessao, valores['isbn']) or
+            shards.ativo and shards.isbn_em_uso(valores['isbn'], exceto_id=id)
+        ):
+            raise ErroEscrita(409, 'ISBN já cadastrado', 'Este ISBN já está em uso')
+        if 'genero' in valores:
+            categoria = Category.obter_ou_criar(valores['genero'], principal)
+            valores['genero'] = categoria.nome if categoria else None
+            valores['category_id'] = categoria.id if categoria else None
+
+        # Permissão (admin ou criador) e versão fazem parte do próprio WHERE
+        condicoes = [Book.id == id]
+        if not usuario_admin:
+            condicoes.append(Book.criado_por == usuario_id)
+        if versao is not None:
+            condicoes.append(Book.versao == versao)
+
+        stmt = db.update(Book).where(*condicoes).values(**valores).returning(Book) \
+            .execution_options(synchronize_session=False, populate_existing=True)
+        try:
+            # O índice único de ISBN substitui a verificação prévia. O savepoint fica dentro
+            # da transação da escrita (BEGIN IMMEDIATE de configurar_engine): o RELEASE não
+            # confirma o UPDATE antes do log de alterações e do outbox
+            with sessao.begin_nested():
+                livro = sessao.execute(stmt).scalar_one_or_none()
+        except IntegrityError:
+            raise ErroEscrita(409, 'ISBN já cadastrado', 'Este ISBN já está em uso')
+
+        if livro is None:
+            # Só no caminho de falha: descobre qual condição não foi atendida
+            atual = sessao.get(Book, id)
+            if not atual:
+                raise ErroEscrita(404, 'Livro não encontrado', f'Livro com ID {id} não existe')
+            if not usuario_admin and atual.criado_por != usuario_id:
+                raise ErroEscrita(403, 'Acesso negado', 'Você só pode editar livros que criou')
+            raise ErroEscrita(412, 'Versão desatualizada',
+                              f'O livro foi alterado por outra requisição (versão atual: {atual.versao})')
+
+        Book.materializar_json(sessao, [livro])  # UPDATE direto no SQL: sem os eventos do ORM
+        BookChange.registrar(livro, 'update', usuario_id, sessao)
+        indice_sugestoes.agendar(livro, 'update', principal)
+        return livro.to_dict()
     
     try:
-        db.session.commit()
+        livro = executar_escrita(mutacao, id)
         
-        return jsonify({
+        resposta = jsonify({
             'mensagem': 'Livro atualizado com sucesso',
-            'livro': livro.to_dict()
-        }), 200
+            'livro': livro
+        })
+        resposta.set_etag(str(livro['versao']))
+        return resposta, 200
+    except ErroEscrita as e:
+        db.session.rollback()
+        return e.resposta()
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -478,35 +859,37 @@ def atualizar_livro(id):
             'detalhes': str(e)
         }), 500
 
-@app.route('/livros/<int:id>', methods=['DELETE'])
+@api.route('/livros/<int:id>', methods=['DELETE'])
 @token_required
 def deletar_livro(id):
     """Remove um livro específico"""
-    livro = Book.query.get(id)
-    
-    if not livro:
-        return jsonify({
-            'erro': 'Livro não encontrado',
-            'status': 404,
-            'detalhes': f'Livro com ID {id} não existe'
-        }), 404
-    
-    # Verifica se o usuário pode deletar (admin ou criador)
-    if request.current_user.role != 'admin' and livro.criado_por != request.current_user.id:
-        return jsonify({
-            'erro': 'Acesso negado',
-            'status': 403,
-            'detalhes': 'Você só pode deletar livros que criou'
-        }), 403
+    usuario = request.current_user
+    usuario_id, usuario_admin = usuario.id, usuario.role == 'admin'
+
+    def mutacao(sessao):
+        livro = sessao.get(Book, id)
+        
+        if not livro:
+            raise ErroEscrita(404, 'Livro não encontrado', f'Livro com ID {id} não existe')
+        
+        # Verifica se o usuário pode deletar (admin ou criador)
+        if not usuario_admin and livro.criado_por != usuario_id:
+            raise ErroEscrita(403, 'Acesso negado', 'Você só pode deletar livros que criou')
+
+        sessao.delete(livro)
+        BookChange.registrar(livro, 'delete', usuario_id, sessao)  # Tombstone para o feed de alterações
+        indice_sugestoes.agendar(livro, 'delete', sessao_principal(sessao))
 
     try:
-        db.session.delete(livro)
-        db.session.commit()
+        executar_escrita(mutacao, id)
         
         return jsonify({
             'mensagem': 'Livro removido com sucesso',
             'id': id
         }), 200
+    except ErroEscrita as e:
+        db.session.rollback()
+        return e.resposta()
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -515,7 +898,254 @@ def deletar_livro(id):
             'detalhes': str(e)
         }), 500
 
-@app.route('/livros/buscar', methods=['GET'])
+MAX_LINHAS_LOTE = 100            # Padrão de ?max_linhas nas operações em lote
+MAX_LINHAS_LOTE_LIMITE = 10000
+
+def parametros_lote():
+    """
+    Filtros e limites de PATCH/DELETE /livros: retorna (condicoes, dry_run, max_linhas).
+    Exige ao menos um filtro, para que um erro do cliente não altere o catálogo inteiro.
+    """
+    if shards.ativo:
+        raise ErroEscrita(400, 'Operação indisponível', 'Operações em lote não são suportadas no modo particionado')
+    try:
+        condicoes, _, filtrada = filtros_livros(request.args)
+    except ValueError as e:
+        raise ErroEscrita(400, 'Parâmetro inválido', str(e))
+    if not filtrada:
+        raise ErroEscrita(400, 'Filtro obrigatório',
+                          'Informe ao menos um filtro: titulo, autor, genero, ano ou disponivel')
+
+    max_linhas = request.args.get('max_linhas', MAX_LINHAS_LOTE, type=int)
+    if not 1 <= max_linhas <= MAX_LINHAS_LOTE_LIMITE:
+        raise ErroEscrita(400, 'Parâmetro inválido', f'max_linhas deve estar entre 1 e {MAX_LINHAS_LOTE_LIMITE}')
+    dry_run = request.args.get('dry_run', 'false').lower() in ['true', '1', 'sim']
+    return condicoes(Book), dry_run, max_linhas
+
+def simular_lote(condicoes, max_linhas):
+    """Resposta do dry_run: quantos livros seriam afetados e os primeiros ids"""
+    total = db.session.scalar(db.select(db.func.count()).select_from(Book).where(*condicoes))
+    ids = db.session.scalars(db.select(Book.id).where(*condicoes).order_by(Book.id).limit(max_linhas)).all()
+    return jsonify({
+        'dry_run': True,
+        'total': total,
+        'ids': ids,
+        'excede_limite': total > max_linhas,
+        'max_linhas': max_linhas
+    }), 200
+
+def limitar_lote(condicoes, max_linhas):
+    """Condições do UPDATE/DELETE em lote: no máximo max_linhas + 1 linhas são tocadas"""
+    return [*condicoes, Book.id.in_(db.select(Book.id).where(*condicoes).limit(max_linhas + 1))]
+
+def verificar_limite_lote(livros, max_linhas):
+    if len(livros) > max_linhas:
+        raise ErroEscrita(409, 'Limite de linhas excedido',
+                          f'Mais de {max_linhas} livros atendem aos filtros; '
+                          'refine os filtros, aumente max_linhas ou use dry_run=true')
+
+@api.route('/livros', methods=['PATCH'])
+@validar_corpo(schemas.LIVRO, max_bytes=16 * 1024, parcial=True)
+@admin_required
+def atualizar_livros_em_lote():
+    """
+    Atualiza todos os livros que atendem aos filtros de GET /livros com um único
+    UPDATE ... RETURNING (apenas admin). Com ?dry_run=true nada é alterado; com
+    mais de ?max_linhas (padrão 100) livros afetados, a operação é desfeita.
+    """
+    dados = request.dados
+    usuario_id = request.current_user.id
+
+    def mutacao(sessao):
+        valores = dict(dados)
+        valores['versao'] = Book.versao + 1
+        valores.update(Book.valores_normalizados(valores))
+        if 'genero' in valores:
+            categoria = Category.obter_ou_criar(valores['genero'], sessao)
+            valores['genero'] = categoria.nome if categoria else None
+            valores['category_id'] = categoria.id if categoria else None
+
+        stmt = db.update(Book).where(*limitar_lote(condicoes, max_linhas)).values(**valores).returning(Book) \
+            .execution_options(synchronize_session=False, populate_existing=True)
+        livros = sessao.execute(stmt).scalars().all()
+        verificar_limite_lote(livros, max_linhas)
+
+        Book.materializar_json(sessao, livros)  # UPDATE direto no SQL: sem os eventos do ORM
+        for livro in livros:
+            BookChange.registrar(livro, 'update', usuario_id, sessao)
+            indice_sugestoes.agendar(livro, 'update', sessao)
+        return sorted(livro.id for livro in livros)
+
+    try:
+        condicoes, dry_run, max_linhas = parametros_lote()
+        if not dados:
+            raise ErroEscrita(400, 'Dados inválidos', 'Informe ao menos um campo para atualizar')
+        if 'isbn' in dados:
+            raise ErroEscrita(400, 'Dados inválidos', 'O ISBN é único por livro e não pode ser alterado em lote')
+        if dry_run:
+            return simular_lote(condicoes, max_linhas)
+
+        ids = executar_escrita(mutacao)
+        return jsonify({
+            'mensagem': f'{len(ids)} livro(s) atualizado(s)',
+            'total': len(ids),
+            'ids': ids
+        }), 200
+    except ErroEscrita as e:
+        db.session.rollback()
+        return e.resposta()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'erro': 'Erro ao atualizar livros',
+            'status': 500,
+            'detalhes': str(e)
+        }), 500
+
+@api.route('/livros', methods=['DELETE'])
+@admin_required
+def deletar_livros_em_lote():
+    """
+    Remove todos os livros que atendem aos filtros de GET /livros com um único
+    DELETE ... RETURNING (apenas admin). Mesmos ?dry_run e ?max_linhas do PATCH.
+    """
+    usuario_id = request.current_user.id
+
+    def mutacao(sessao):
+        stmt = db.delete(Book).where(*limitar_lote(condicoes, max_linhas)).returning(Book) \
+            .execution_options(synchronize_session=False)
+        livros = sessao.execute(stmt).scalars().all()
+        verificar_limite_lote(livros, max_linhas)
+
+        for livro in livros:
+            BookChange.registrar(livro, 'delete', usuario_id, sessao)  # Tombstones para o feed de alterações
+            indice_sugestoes.agendar(livro, 'delete', sessao)
+        return sorted(livro.id for livro in livros)
+
+    try:
+        condicoes, dry_run, max_linhas = parametros_lote()
+        if dry_run:
+            return simular_lote(condicoes, max_linhas)
+
+        ids = executar_escrita(mutacao)
+        return jsonify({
+            'mensagem': f'{len(ids)} livro(s) removido(s)',
+            'total': len(ids),
+            'ids': ids
+        }), 200
+    except ErroEscrita as e:
+        db.session.rollback()
+        return e.resposta()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'erro': 'Erro ao deletar livros',
+            'status': 500,
+            'detalhes': str(e)
+        }), 500
+
+@api.route('/livros/changes', methods=['GET'])
+def alteracoes_livros():
+    """
+    Feed de sincronização incremental: retorna os livros criados/alterados
+    e os ids removidos desde o token informado (?since=), além do novo token.
+    """
+    since = request.args.get('since', 0, type=int)
+    limite = min(max(request.args.get('limite', 500, type=int), 1), 1000)
+
+    # O SQLite serializa as escritas, então a ordem dos ids é a ordem de commit
+    alteracoes = BookChange.query.filter(BookChange.id > since).order_by(BookChange.id).limit(limite + 1).all()
+    tem_mais = len(alteracoes) > limite
+    alteracoes = alteracoes[:limite]
+
+    # Mantém apenas a última operação de cada livro
+    ultimas = {}
+    for alteracao in alteracoes:
+        ultimas[alteracao.book_id] = alteracao.operacao
+
+    # Livros arquivados também saem da listagem padrão: vão em removidos
+    ids_alterados = [book_id for book_id, operacao in ultimas.items() if operacao not in BookChange.OPERACOES_REMOCAO]
+    removidos = [book_id for book_id, operacao in ultimas.items() if operacao in BookChange.OPERACOES_REMOCAO]
+    livros = carregar_livros(ids_alterados)
+
+    return resposta_json({
+        'livros': json_livros(livros),
+        'removidos': removidos,
+        'token': str(alteracoes[-1].id if alteracoes else since),
+        'tem_mais': tem_mais
+    })
+
+@api.route('/livros/eventos', methods=['GET'])
+def eventos_livros():
+    """
+    Stream SSE com as alterações confirmadas no catálogo.
+    Filtros opcionais: ?genero= e ?autor= (com ?match=, como em /livros).
+    Retomada via header Last-Event-ID.
+    """
+    match = request.args.get('match', 'contains')
+    if match not in MODOS_MATCH:
+        return jsonify({
+            'erro': 'Parâmetro inválido',
+            'status': 400,
+            'detalhes': f"match deve ser um de: {', '.join(MODOS_MATCH)}"
+        }), 400
+
+    # Só há replay com Last-Event-ID; sem ele o stream começa no evento atual
+    ultimo_id = request.headers.get('Last-Event-ID', '')
+    desde = int(ultimo_id) if ultimo_id.isdigit() else None
+    assinante = broadcaster.assinar(request.args.get('genero'), request.args.get('autor'), desde, match)
+    if assinante is None:
+        resposta = jsonify({
+            'erro': 'Limite de streams atingido',
+            'status': 503,
+            'detalhes': 'Este worker já atende o máximo de conexões SSE; tente novamente'
+        })
+        resposta.headers['Retry-After'] = '5'
+        return resposta, 503
+
+    pendentes = broadcaster.replay(desde) if desde is not None else []
+
+    resposta = Response(
+        broadcaster.corpo(assinante, pendentes, assinante.desde, request.environ),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Libera a vaga mesmo se o corpo nunca chegar a ser iterado
+    resposta.call_on_close(lambda: broadcaster.liberar(assinante))
+    return resposta
+
+@api.route('/livros/sugerir', methods=['GET'])
+def sugerir_livros():
+    """
+    Autocomplete de títulos e autores (?prefix=) a partir do índice em memória.
+    Opcional: ?campo=titulo|autor e ?limite= (máximo 50).
+    """
+    prefixo = request.args.get('prefix', '').strip()
+    limite = min(max(request.args.get('limite', SUGESTOES_PADRAO, type=int), 1), SUGESTOES_MAXIMO)
+    campo = request.args.get('campo')
+
+    if not prefixo:
+        return jsonify({
+            'erro': 'Prefixo necessário',
+            'status': 400,
+            'detalhes': 'Use o parâmetro "prefix" para obter sugestões'
+        }), 400
+    if campo not in (None, 'titulo', 'autor'):
+        return jsonify({
+            'erro': 'Parâmetro inválido',
+            'status': 400,
+            'detalhes': 'O campo deve ser "titulo" ou "autor"'
+        }), 400
+
+    indice_sugestoes.sincronizar()
+    sugestoes = indice_sugestoes.sugerir(prefixo, limite, (campo,) if campo else ('titulo', 'autor'))
+
+    return jsonify({
+        'sugestoes': sugestoes,
+        'prefixo': prefixo
+    }), 200
+
+@api.route('/livros/buscar', methods=['GET'])
 def buscar_livros():
     """Busca livros por título, autor ou descrição"""
     termo = request.args.get('q', '').strip()
@@ -527,25 +1157,34 @@ def buscar_livros():
             'detalhes': 'Use o parâmetro "q" para buscar'
         }), 400
     
-    # Busca por título, autor ou descrição
-    livros = Book.query.filter(
-        db.or_(
-            Book.titulo.ilike(f'%{termo}%'),
-            Book.autor.ilike(f'%{termo}%'),
-            Book.descricao.ilike(f'%{termo}%')
-        )
-    ).order_by(Book.titulo).all()
+    def condicoes(modelo):
+        # Busca por título, autor (sem diferenciar acentos) ou descrição
+        return [db.or_(
+            filtro_texto(modelo.titulo_norm, termo, 'contains'),
+            filtro_texto(modelo.autor_norm, termo, 'contains'),
+            modelo.descricao.ilike(f'%{termo}%')
+        )]
     
-    return jsonify({
-        'livros': [livro.to_dict() for livro in livros],
+    incluir_arquivados = request.args.get('incluir_arquivados', 'false').lower() in ['true', '1', 'sim']
+    if shards.ativo:
+        livros = shards.buscar(condicoes(Book))
+    else:
+        Livro = modelo_com_arquivo(incluir_arquivados, condicoes)
+        query = db.session.query(Livro)
+        if Livro is Book:
+            query = query.filter(*condicoes(Book))
+        livros = query.order_by(Livro.titulo).all()
+    
+    return resposta_json({
+        'livros': json_livros(livros),
         'total': len(livros),
         'termo_buscado': termo
-    }), 200
+    })
 
 # ==============================================
 # Rotas de Usuários (Admin)
 # ==============================================
-@app.route('/usuarios', methods=['GET'])
+@api.route('/usuarios', methods=['GET'])
 @admin_required
 def listar_usuarios():
     """Lista todos os usuários (apenas admin)"""
@@ -556,7 +1195,8 @@ def listar_usuarios():
         'total': len(usuarios)
     }), 200
 
-@app.route('/usuarios/<int:id>', methods=['PUT'])
+@api.route('/usuarios/<int:id>', methods=['PUT'])
+@validar_corpo(schemas.USUARIO, max_bytes=4 * 1024, parcial=True)
 @admin_required
 def atualizar_usuario(id):
     """Atualiza um usuário (apenas admin)"""
@@ -569,7 +1209,7 @@ def atualizar_usuario(id):
             'detalhes': f'Usuário com ID {id} não existe'
         }), 404
 
-    dados = request.get_json()
+    dados = request.dados
     
     # Atualiza os campos fornecidos
     campos_editaveis = ['nome', 'email', 'role', 'ativo']
@@ -582,7 +1222,7 @@ def atualizar_usuario(id):
         usuario.set_password(dados['password'])
     
     try:
-        db.session.commit()
+        confirmar_transacao()
         
         return jsonify({
             'mensagem': 'Usuário atualizado com sucesso',
@@ -599,28 +1239,27 @@ def atualizar_usuario(id):
 # ==============================================
 # Rotas de Categorias
 # ==============================================
-@app.route('/categorias', methods=['GET'])
+@api.route('/categorias', methods=['GET'])
 def listar_categorias():
-    """Lista todas as categorias"""
-    categorias = Category.query.filter_by(ativa=True).order_by(Category.nome).all()
-    
-    return jsonify({
-        'categorias': [categoria.to_dict() for categoria in categorias],
-        'total': len(categorias)
-    }), 200
+    """Lista todas as categorias (corpo guardado no cache compartilhado entre os workers)"""
+    def carregar():
+        categorias = Category.query.filter_by(ativa=True).order_by(Category.nome).all()
+        # Os mesmos bytes do jsonify (separadores e quebra de linha final)
+        return jsonify({
+            'categorias': [categoria.to_dict() for categoria in categorias],
+            'total': len(categorias)
+        }).get_data()
 
-@app.route('/categorias', methods=['POST'])
+    corpo = cache_compartilhado.obter_ou_calcular('categorias', 'ativas', carregar)
+    return current_app.response_class(corpo, status=200, mimetype='application/json')
+
+@api.route('/categorias', methods=['POST'])
+@idempotente
+@validar_corpo(schemas.CATEGORIA, max_bytes=4 * 1024)
 @admin_required
 def criar_categoria():
     """Cria uma nova categoria (apenas admin)"""
-    dados = request.get_json()
-    
-    if not dados.get('nome'):
-        return jsonify({
-            'erro': 'Dados inválidos',
-            'status': 400,
-            'detalhes': 'Nome é obrigatório'
-        }), 400
+    dados = request.dados
     
     # Verifica se a categoria já existe
     if Category.query.filter_by(nome=dados['nome']).first():
@@ -637,7 +1276,7 @@ def criar_categoria():
     
     try:
         db.session.add(nova_categoria)
-        db.session.commit()
+        confirmar_transacao()
         
         return jsonify({
             'mensagem': 'Categoria criada com sucesso',
@@ -651,36 +1290,280 @@ def criar_categoria():
             'detalhes': str(e)
         }), 500
 
+# ==============================================
+# Rota de Batch (várias operações em uma requisição)
+# ==============================================
+BATCH_MAX_OPERACOES = 50
+
+# Rotas aceitas em um batch: só o CRUD de livros e categorias (nada de streaming,
+# rotas administrativas ou operações em lote)
+BATCH_ENDPOINTS = {
+    'api.listar_livros', 'api.criar_livro', 'api.obter_livro', 'api.atualizar_livro', 'api.deletar_livro',
+    'api.listar_categorias', 'api.criar_categoria',
+}
+
+# Headers da requisição /batch que não se aplicam às operações individuais
+BATCH_HEADERS_IGNORADOS = ('HTTP_IDEMPOTENCY_KEY', 'HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_X_PROFILE')
+
+def ambiente_operacao(metodo, caminho, corpo):
+    """Environ WSGI da sub-requisição, derivado do environ do /batch"""
+    caminho, _, query = caminho.partition('?')
+    dados = current_app.json.dumps(corpo).encode() if corpo is not None else b''
+    environ = {chave: valor for chave, valor in request.environ.items()
+               if chave not in BATCH_HEADERS_IGNORADOS and not chave.startswith('werkzeug.')}
+    environ.update({
+        'REQUEST_METHOD': metodo,
+        'PATH_INFO': caminho,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/json' if corpo is not None else '',
+        'CONTENT_LENGTH': str(len(dados)),
+        'wsgi.input': BytesIO(dados),
+    })
+    return environ
+
+def executar_operacao(operacao):
+    """
+    Executa uma sub-requisição pelo pipeline completo do Flask (before_request,
+    rota, after_request e error handlers) e retorna (status, corpo). O app
+    context é o do /batch: mesmo g e mesma sessão do banco.
+    """
+    if not isinstance(operacao, dict):
+        return 400, {'erro': 'Operação inválida', 'status': 400, 'detalhes': 'Cada operação deve ser um objeto'}
+
+    metodo = str(operacao.get('method', 'GET')).upper()
+    caminho = operacao.get('path')
+    if not isinstance(caminho, str) or not caminho.startswith('/'):
+        return 400, {'erro': 'Operação inválida', 'status': 400, 'detalhes': 'Campo "path" inválido'}
+
+    corpo = operacao.get('body') if metodo in ['POST', 'PUT', 'PATCH'] else None
+
+    app = current_app._get_current_object()
+    with app.request_context(ambiente_operacao(metodo, caminho, corpo)):
+        if request.routing_exception is None and request.url_rule.endpoint not in BATCH_ENDPOINTS:
+            return 400, {
+                'erro': 'Operação não permitida',
+                'status': 400,
+                'detalhes': f'{metodo} {request.path} não pode ser usado em um batch'
+            }
+        resposta = app.full_dispatch_request()
+        return resposta.status_code, resposta.get_json(silent=True)
+
+@api.route('/batch', methods=['POST'])
+def batch():
+    """
+    Executa várias operações em uma única requisição.
+    Corpo: [{"method": "GET", "path": "/livros"}, {"method": "POST", "path": "/livros", "body": {...}}]
+    Use ?transacao=true para aplicar todas as operações em uma única transação.
+    """
+    operacoes = request.get_json()
+
+    if not isinstance(operacoes, list) or not operacoes:
+        return jsonify({
+            'erro': 'Dados inválidos',
+            'status': 400,
+            'detalhes': 'O corpo deve ser uma lista de operações {method, path, body}'
+        }), 400
+
+    if len(operacoes) > BATCH_MAX_OPERACOES:
+        return jsonify({
+            'erro': 'Batch muito grande',
+            'status': 413,
+            'detalhes': f'Máximo de {BATCH_MAX_OPERACOES} operações por batch'
+        }), 413
+
+    # Verificação única do token para todas as operações
+    usuario = None
+    if request.headers.get('Authorization'):
+        usuario, erro = autenticar_token(request.headers['Authorization'])
+        if erro:
+            return erro
+
+    transacional = request.args.get('transacao', 'false').lower() in ['true', '1', 'sim']
+    if transacional and shards.ativo:
+        # Cada shard é um arquivo: não há uma transação única para o lote
+        return jsonify({
+            'erro': 'Parâmetro indisponível',
+            'status': 400,
+            'detalhes': 'transacao=true não é suportado no modo particionado'
+        }), 400
+
+    # As operações rodam no app context do /batch: o token vale para todas
+    g.batch, g.batch_usuario, g.batch_transacional = True, usuario, transacional
+    try:
+        return executar_batch(operacoes, transacional)
+    finally:
+        for chave in ('batch', 'batch_usuario', 'batch_transacional'):
+            g.pop(chave, None)
+
+def executar_batch(operacoes, transacional):
+    """Executa as operações em sequência; no modo transacional a primeira falha reverte tudo"""
+    respostas = []
+    for indice, operacao in enumerate(operacoes):
+        try:
+            status, corpo = executar_operacao(operacao)
+        except Exception as e:
+            db.session.rollback()
+            status, corpo = 500, {'erro': 'Erro ao executar operação', 'status': 500, 'detalhes': str(e)}
+
+        respostas.append({'status': status, 'body': corpo})
+
+        if transacional and status >= 400:
+            db.session.rollback()
+            return jsonify({
+                'erro': 'Batch revertido',
+                'status': 409,
+                'detalhes': f'A operação {indice} falhou; nenhuma alteração foi aplicada',
+                'falhou_em': indice,
+                'respostas': respostas
+            }), 409
+
+    if transacional:
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({
+                'erro': 'Erro ao confirmar batch',
+                'status': 500,
+                'detalhes': str(e)
+            }), 500
+
+    return jsonify({
+        'respostas': respostas,
+        'total': len(respostas),
+        'transacional': transacional
+    }), 200
+
 # ==============================================
 # Rotas de Estatísticas
 # ==============================================
-@app.route('/stats', methods=['GET'])
+@api.route('/stats', methods=['GET'])
 @admin_required
 def estatisticas():
     """Retorna estatísticas do sistema (apenas admin)"""
     stats = {
-        'total_livros': Book.query.count(),
-        'livros_disponiveis': Book.query.filter_by(disponivel=True).count(),
         'total_usuarios': User.query.count(),
         'usuarios_ativos': User.query.filter_by(ativo=True).count(),
         'total_categorias': Category.query.filter_by(ativa=True).count(),
         'livros_por_genero': {}
     }
     
-    # Contagem por gênero
-    generos = db.session.query(Book.genero, db.func.count(Book.id)).filter(
-        Book.genero.isnot(None)
-    ).group_by(Book.genero).all()
+    if shards.ativo:
+        total, disponiveis, por_categoria = shards.estatisticas()
+        stats['total_livros'], stats['livros_disponiveis'] = total, disponiveis
+        if por_categoria:
+            for categoria in Category.query.filter(Category.id.in_(list(por_categoria))):
+                stats['livros_por_genero'][categoria.nome] = por_categoria[categoria.id]
+        return jsonify(stats), 200
+    
+    stats['total_livros'] = Book.query.count()
+    stats['livros_disponiveis'] = Book.query.filter_by(disponivel=True).count()
+    
+    # Contagem por gênero: GROUP BY no category_id, nomes das categorias depois
+    contagem = db.session.query(Book.category_id, db.func.count(Book.id).label('total')).filter(
+        Book.category_id.isnot(None)
+    ).group_by(Book.category_id).subquery()
+    generos = db.session.query(Category.nome, contagem.c.total).join(
+        contagem, contagem.c.category_id == Category.id
+    ).all()
     
     for genero, count in generos:
         stats['livros_por_genero'][genero] = count
     
     return jsonify(stats), 200
 
+# ==============================================
+# Rotas de Diagnóstico (Admin)
+# ==============================================
+@api.route('/admin/consultas-lentas', methods=['GET', 'DELETE'])
+@admin_required
+def listar_consultas_lentas():
+    """
+    Consultas acima de SLOW_QUERY_MS agregadas por formato, com plano de execução.
+    DELETE limpa o registro. Os dados são do processo (worker) que atendeu.
+    """
+    if request.method == 'DELETE':
+        consultas_lentas.limpar()
+        return jsonify({'mensagem': 'Registro de consultas lentas limpo'}), 200
+
+    limite = request.args.get('limite', 50, type=int)
+    consultas = consultas_lentas.relatorio(limite)
+    return jsonify({
+        'limite_ms': consultas_lentas.limite_ms,
+        'consultas': consultas,
+        'total': len(consultas),
+        'pid': os.getpid()
+    }), 200
+
+@api.route('/admin/perfis', methods=['GET'])
+@admin_required
+def listar_perfis():
+    """Lista os perfis gravados (?_profile=1, X-Profile: 1 ou amostragem)"""
+    perfis = profiler.listar()
+    return jsonify({
+        'perfis': [{'id': perfil_id, 'href': f'/admin/perfis/{perfil_id}'} for perfil_id in perfis],
+        'total': len(perfis)
+    }), 200
+
+@api.route('/admin/perfis/<perfil_id>', methods=['GET'])
+@admin_required
+def obter_perfil(perfil_id):
+    """Resumo de um perfil: tempo por categoria e funções mais custosas"""
+    caminho = profiler.caminho(perfil_id, '.json')
+    if not caminho:
+        return jsonify({
+            'erro': 'Perfil não encontrado',
+            'status': 404,
+            'detalhes': f'Perfil {perfil_id} não existe ou já foi descartado'
+        }), 404
+    return send_file(caminho, mimetype='application/json')
+
+@api.route('/admin/perfis/<perfil_id>/prof', methods=['GET'])
+@admin_required
+def baixar_perfil(perfil_id):
+    """Arquivo pstats completo (abrir com snakeviz, pstats, etc.)"""
+    caminho = profiler.caminho(perfil_id, '.prof')
+    if not caminho:
+        return jsonify({
+            'erro': 'Perfil não encontrado',
+            'status': 404,
+            'detalhes': f'Perfil {perfil_id} não existe ou já foi descartado'
+        }), 404
+    return send_file(caminho, mimetype='application/octet-stream', as_attachment=True)
+
+@api.route('/admin/outbox', methods=['GET'])
+@admin_required
+def situacao_outbox():
+    """Mensagens pendentes no outbox e as paradas após esgotar as tentativas"""
+    return jsonify(outbox.situacao()), 200
+
+@api.route('/admin/outbox/reprocessar', methods=['POST'])
+@admin_required
+def reprocessar_outbox():
+    """Devolve as mensagens paradas à fila"""
+    total = outbox.reprocessar_paradas()
+    db.session.commit()
+    return jsonify({'mensagem': f'{total} mensagem(ns) devolvida(s) à fila', 'total': total}), 200
+
+@api.route('/admin/auditoria', methods=['GET'])
+@admin_required
+def listar_auditoria():
+    """Trilha de auditoria das escritas em livros (?book_id=, ?limite=), mais recentes primeiro"""
+    limite = min(max(request.args.get('limite', 50, type=int), 1), 500)
+    query = Auditoria.query
+    book_id = request.args.get('book_id', type=int)
+    if book_id is not None:
+        query = query.filter(Auditoria.book_id == book_id)
+    registros = query.order_by(Auditoria.id.desc()).limit(limite).all()
+    return jsonify({
+        'auditoria': [registro.to_dict() for registro in registros],
+        'total': len(registros)
+    }), 200
+
 # ==============================================
 # Error Handlers
 # ==============================================
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     return jsonify({
         'erro': 'Requisição inválida',
@@ -688,7 +1571,7 @@ def bad_request(error):
         'detalhes': str(error)
     }), 400
 
-@app.errorhandler(401)
+@api.app_errorhandler(401)
 def unauthorized(error):
     return jsonify({
         'erro': 'Não autorizado',
@@ -696,7 +1579,7 @@ def unauthorized(error):
         'detalhes': str(error)
     }), 401
 
-@app.errorhandler(403)
+@api.app_errorhandler(403)
 def forbidden(error):
     return jsonify({
         'erro': 'Acesso proibido',
@@ -704,7 +1587,7 @@ def forbidden(error):
         'detalhes': str(error)
     }), 403
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     return jsonify({
         'erro': 'Não encontrado',
@@ -712,7 +1595,7 @@ def not_found(error):
         'detalhes': str(error)
     }), 404
 
-@app.errorhandler(409)
+@api.app_errorhandler(409)
 def conflict(error):
     return jsonify({
         'erro': 'Conflito',
@@ -720,7 +1603,15 @@ def conflict(error):
         'detalhes': str(error)
     }), 409
 
-@app.errorhandler(500)
+@api.app_errorhandler(413)
+def payload_too_large(error):
+    return jsonify({
+        'erro': 'Corpo muito grande',
+        'status': 413,
+        'detalhes': str(error)
+    }), 413
+
+@api.app_errorhandler(500)
 def internal_server_error(error):
     return jsonify({
         'erro': 'Erro interno do servidor',
@@ -732,9 +1623,15 @@ def internal_server_error(error):
 # Inicialização da aplicação
 # ==============================================
 if __name__ == '__main__':
-    # Inicializa o banco de dados
-    with app.app_context():
+    app = get_app()
+    
+    # Migração do schema só quando a versão do banco está desatualizada
+    if not schema_atualizado():
         init_database(app)
+    aquecer(app)
+    arquivador.iniciar()  # Arquivamento periódico (ARQUIVAMENTO_INTERVALO)
+    outbox.iniciar()      # Workers do outbox (OUTBOX_WORKERS)
+    shards.iniciar()      # Repasse periódico do log dos shards (SHARDS_REPASSE_INTERVALO)
     
     print("🚀 API REST com banco de dados iniciada!")
     print("📊 Banco: SQLite com SQLAlchemy")
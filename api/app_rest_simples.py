@@ -6,8 +6,11 @@ import datetime
 from functools import wraps
 import logging
 
+from server_timing import server_timing
+
 app = Flask(__name__)
 CORS(app)  # Habilita CORS para todas as rotas
+server_timing.init_app(app)  # Header Server-Timing com o tempo de cada fase
 
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
@@ -123,8 +126,9 @@ def token_required(f):
             return jsonify({'erro': 'Token de autorização necessário'}), 401
 
         try:
-            token = auth_header.split(' ')[1]
-            decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            with server_timing.medir('auth'):
+                token = auth_header.split(' ')[1]
+                decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
             request.user_id = decoded['sub']
         except Exception as e:
             return jsonify({'erro': 'Token inválido'}), 401
@@ -159,10 +163,11 @@ usuarios = [
 @app.before_request
 def before_request():
     """Middleware executado antes de cada requisição"""
-    log_request()
-    
-    # Validação de Content-Type
-    content_type_error = validate_content_type()
+    with server_timing.medir('middleware'):
+        log_request()
+        
+        # Validação de Content-Type
+        content_type_error = validate_content_type()
     if content_type_error:
         return content_type_error
 
@@ -0,0 +1,126 @@
+"""
+Particionamento quente/frio dos livros.
+
+Livros indisponíveis e sem alterações há mais de N dias saem da tabela books
+(quente) para books_arquivo (fria, mesmo formato), mantendo a tabela e os
+índices usados pelas listagens pequenos. Cada lote é movido em uma única
+transação, com um registro 'archive' no log de alterações para que o feed,
+o SSE e os caches de cada processo tirem o livro da listagem padrão, e uma
+mensagem no outbox para a auditoria.
+
+Leituras com ?incluir_arquivados=true unem as duas tabelas com UNION ALL.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from cache import cache_compartilhado, namespace_livro
+from models import db, Book, BookArquivado, BookChange, OutboxMensagem
+
+logger = logging.getLogger(__name__)
+
+DIAS_PADRAO = 30          # Dias sem alterações antes de um livro indisponível ser arquivado
+INTERVALO_PADRAO = 3600   # Segundos entre execuções do arquivador (0 = desligado)
+LOTE = 500                # Livros movidos por transação
+
+
+def arquivar_lote(conexao, limite_data, lote=LOTE):
+    """Move um lote de livros para books_arquivo; devolve os ids movidos"""
+    livros, arquivo = Book.__table__, BookArquivado.__table__
+    colunas = [coluna.name for coluna in livros.columns]
+
+    candidatos = db.select(*livros.columns).where(
+        livros.c.disponivel == db.false(),
+        livros.c.atualizado_em < limite_data
+    ).order_by(livros.c.id).limit(lote)
+
+    ids = list(conexao.execute(
+        db.insert(arquivo).from_select(colunas, candidatos).returning(arquivo.c.id)
+    ).scalars())
+    if not ids:
+        return ids
+
+    alteracoes = BookChange.__table__
+    conexao.execute(db.insert(alteracoes).from_select(
+        ['book_id', 'operacao', 'autor', 'genero', 'criado_em'],
+        db.select(arquivo.c.id, db.literal('archive'), arquivo.c.autor, arquivo.c.genero,
+                  db.literal(datetime.utcnow(), db.DateTime)).where(arquivo.c.id.in_(ids))
+    ))
+    outbox = OutboxMensagem.__table__
+    conexao.execute(db.insert(outbox).from_select(
+        ['tipo', 'payload', 'tentativas', 'disponivel_em', 'criado_em'],
+        db.select(db.literal('livro.alterado'),
+                  db.func.json_object('book_id', arquivo.c.id, 'operacao', 'archive',
+                                      'usuario_id', None, 'livro', None),
+                  db.literal(0), db.literal(datetime.utcnow(), db.DateTime),
+                  db.literal(datetime.utcnow(), db.DateTime)).where(arquivo.c.id.in_(ids))
+    ))
+    conexao.execute(db.delete(livros).where(livros.c.id.in_(ids)))
+    return ids
+
+
+def arquivar(dias=DIAS_PADRAO, lote=LOTE):
+    """Arquiva todos os livros elegíveis, um lote por transação (requer app context)"""
+    limite_data = datetime.utcnow() - timedelta(days=dias)
+    total = 0
+    while True:
+        with db.engine.begin() as conexao:
+            ids = arquivar_lote(conexao, limite_data, lote)
+        if ids:
+            # SQL direto, fora da sessão: invalida o cache explicitamente
+            cache_compartilhado.invalidar(*(namespace_livro(book_id) for book_id in ids))
+        total += len(ids)
+        if len(ids) < lote:
+            return total
+
+
+def modelo_com_arquivo(incluir_arquivados, condicoes):
+    """
+    Entidade para consultar livros: Book ou, com incluir_arquivados, um alias
+    de Book sobre o UNION ALL das duas tabelas. `condicoes(modelo)` devolve os
+    filtros para cada tabela, aplicados antes da união.
+    """
+    if not incluir_arquivados:
+        return Book
+    nomes = Book.__table__.columns.keys()
+    partes = [
+        db.select(*(modelo.__table__.c[nome] for nome in nomes)).where(*condicoes(modelo))
+        for modelo in (Book, BookArquivado)
+    ]
+    uniao = db.union_all(*partes).subquery('livros_todos')
+    return db.aliased(Book, uniao, adapt_on_names=True)
+
+
+class Arquivador:
+    """Thread que executa o arquivamento periodicamente"""
+
+    def __init__(self):
+        self.app = None
+        self.thread = None
+        self.parar = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.dias = app.config.get('ARQUIVAR_APOS_DIAS', DIAS_PADRAO)
+        self.intervalo = app.config.get('ARQUIVAMENTO_INTERVALO', INTERVALO_PADRAO)
+
+    def iniciar(self):
+        """Inicia a thread (uma vez por processo; sem efeito com intervalo 0)"""
+        if self.intervalo <= 0 or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._loop, name='arquivador', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        with self.app.app_context():
+            while not self.parar.wait(self.intervalo):
+                try:
+                    total = arquivar(self.dias)
+                    if total:
+                        logger.info(f"Arquivador: {total} livro(s) movidos para books_arquivo")
+                except Exception as e:
+                    # Outro worker pode estar arquivando ao mesmo tempo: tenta no próximo ciclo
+                    logger.warning(f"Arquivador: falha ao arquivar livros: {e}")
+
+
+arquivador = Arquivador()
@@ -0,0 +1,233 @@
+"""
+Cache compartilhado entre os workers para GET /livros/{id} e GET /categorias.
+
+Os valores (corpos JSON já codificados) ficam em um armazenamento que todos
+os processos enxergam: por padrão um arquivo SQLite local (cache.db, módulo
+sqlite3) ou, com CACHE_URL=redis://..., um servidor Redis (pacote opcional
+`redis`).
+
+A invalidação é por geração: cada namespace (um por livro, 'livro:<id>', e
+'categorias') tem uma geração no armazenamento e as chaves incluem a geração
+atual. Depois do commit de uma escrita a geração dos namespaces afetados é
+renovada, então nenhum worker volta a ler as entradas antigas, que expiram
+pelo TTL ou saem pelo LRU. Escrever um livro não invalida os demais.
+
+A geração é o instante da renovação (ns), não um contador: gerações sem
+renovação há mais de um TTL podem ser removidas, porque nenhuma entrada
+gravada antes delas (inclusive na geração 0) ainda está válida.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, has_app_context
+from sqlalchemy import event
+
+from models import db, BookChange, Category
+from server_timing import server_timing
+
+CAMINHO_PADRAO = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache.db')
+TTL_PADRAO = 300            # Segundos de validade de uma entrada (0 = cache desligado)
+MAX_ITENS_PADRAO = 5000     # Entradas no arquivo SQLite (as menos acessadas saem antes)
+LIMPEZA_A_CADA = 200        # Gravações entre limpezas do arquivo SQLite
+TOQUE_MINIMO = 1.0          # Segundos entre atualizações do último acesso de uma chave (LRU)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    chave TEXT PRIMARY KEY,
+    valor BLOB NOT NULL,
+    expira_em REAL NOT NULL,
+    acessado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_cache_acessado_em ON cache (acessado_em);
+CREATE TABLE IF NOT EXISTS geracoes (
+    nome TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+"""
+
+
+class ArmazemSQLite:
+    """Armazenamento em um arquivo SQLite local, com TTL e LRU aproximado"""
+
+    def __init__(self, caminho, max_itens):
+        self.caminho = caminho
+        self.max_itens = max_itens
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.gravacoes = 0
+        self.conexao().executescript(SCHEMA)
+
+    def conexao(self):
+        """Uma conexão por thread, em modo autocommit"""
+        conexao = getattr(self.local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=OFF')   # Só dados recalculáveis
+            self.local.conexao = conexao
+        return conexao
+
+    def obter(self, chave):
+        agora = time.time()
+        conexao = self.conexao()
+        linha = conexao.execute(
+            'SELECT valor, acessado_em FROM cache WHERE chave = ? AND expira_em > ?', (chave, agora)
+        ).fetchone()
+        if linha is None:
+            return None
+        # O último acesso é gravado no máximo uma vez por segundo: leituras quase sem escrita
+        if agora - linha[1] > TOQUE_MINIMO:
+            conexao.execute('UPDATE cache SET acessado_em = ? WHERE chave = ?', (agora, chave))
+        return linha[0]
+
+    def definir(self, chave, valor, ttl):
+        agora = time.time()
+        self.conexao().execute(
+            'INSERT OR REPLACE INTO cache (chave, valor, expira_em, acessado_em) VALUES (?, ?, ?, ?)',
+            (chave, valor, agora + ttl, agora)
+        )
+        self._limpar_periodicamente(ttl)
+
+    def geracao(self, nome):
+        linha = self.conexao().execute('SELECT valor FROM geracoes WHERE nome = ?', (nome,)).fetchone()
+        return linha[0] if linha else 0
+
+    def renovar(self, nomes, ttl):
+        agora = time.time_ns()
+        self.conexao().executemany('INSERT OR REPLACE INTO geracoes (nome, valor) VALUES (?, ?)',
+                                   [(nome, agora) for nome in nomes])
+        self._limpar_periodicamente(ttl)
+
+    def _limpar_periodicamente(self, ttl):
+        """Entradas expiradas ou excedentes e gerações sem renovação há mais de um TTL"""
+        with self.lock:
+            self.gravacoes += 1
+            if self.gravacoes % LIMPEZA_A_CADA:
+                return
+        agora = time.time()
+        conexao = self.conexao()
+        conexao.execute('DELETE FROM cache WHERE expira_em <= ?', (agora,))
+        conexao.execute(
+            'DELETE FROM cache WHERE chave IN ('
+            '  SELECT chave FROM cache ORDER BY acessado_em'
+            '  LIMIT max((SELECT count(*) FROM cache) - ?, 0))',
+            (self.max_itens,)
+        )
+        conexao.execute('DELETE FROM geracoes WHERE valor < ?', (int((agora - ttl) * 10**9),))
+
+
+class ArmazemRedis:
+    """Adaptador Redis (LRU pela política maxmemory-policy allkeys-lru do servidor)"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL aponta para o Redis, mas o pacote 'redis' não está instalado")
+        self.cliente = redis.Redis.from_url(url)
+
+    def obter(self, chave):
+        return self.cliente.get(chave)
+
+    def definir(self, chave, valor, ttl):
+        self.cliente.set(chave, valor, ex=ttl)
+
+    def geracao(self, nome):
+        return int(self.cliente.get(f'geracao:{nome}') or 0)
+
+    def renovar(self, nomes, ttl):
+        agora = time.time_ns()
+        with self.cliente.pipeline(transaction=False) as pipeline:
+            for nome in nomes:
+                pipeline.set(f'geracao:{nome}', agora, ex=ttl)
+            pipeline.execute()
+
+
+def namespace_livro(book_id):
+    """Namespace do cache de um livro: cada livro é invalidado separadamente"""
+    return f'livro:{book_id}'
+
+
+class CacheCompartilhado:
+    """Cache por namespace com invalidação por geração após o commit"""
+
+    def __init__(self):
+        self.armazem = None
+        self.ttl = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('CACHE_TTL', TTL_PADRAO)
+        if self.ttl <= 0:
+            return
+        url = app.config.get('CACHE_URL')
+        if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+            self.armazem = ArmazemRedis(url)
+        else:
+            self.armazem = ArmazemSQLite(app.config.get('CACHE_DB', CAMINHO_PADRAO),
+                                         app.config.get('CACHE_MAX_ITENS', MAX_ITENS_PADRAO))
+        event.listen(db.session, 'after_flush', self._marcar)
+        event.listen(db.session, 'after_commit', self._invalidar_marcados)
+        event.listen(db.session, 'after_rollback', lambda session: session.info.pop('cache_invalidar', None))
+
+    @property
+    def ativo(self):
+        return self.armazem is not None
+
+    def obter_ou_calcular(self, namespace, chave, calcular):
+        """
+        Valor da chave na geração atual do namespace; se ausente, calcular()
+        (bytes ou None, que não é guardado). A geração é lida antes do cálculo:
+        um valor calculado durante uma escrita fica na geração antiga. Com escritas
+        ainda sem commit na sessão o cache é ignorado: calcular() leria dados
+        que um rollback pode desfazer.
+        """
+        if not self.ativo or self._escritas_pendentes():
+            return calcular()
+        with server_timing.medir('cache'):
+            geracao = self.armazem.geracao(namespace)
+            chave = f'{namespace}:{geracao}:{chave}'
+            valor = self.armazem.obter(chave)
+        if valor is not None:
+            return valor
+
+        valor = calcular()
+        if valor is not None:
+            with server_timing.medir('cache'):
+                self.armazem.definir(chave, valor, self.ttl)
+        return valor
+
+    def invalidar(self, *namespaces):
+        """Nova geração para os namespaces (chamar depois do commit)"""
+        if not self.ativo or not namespaces:
+            return
+        self.armazem.renovar(namespaces, self.ttl)
+
+    def _escritas_pendentes(self):
+        """Batch transacional ou escritas na sessão atual ainda não confirmadas"""
+        if not has_app_context():
+            return False
+        if g.get('batch_transacional'):
+            return True
+        sessao = db.session
+        return bool(sessao.info.get('cache_invalidar') or sessao.new or sessao.dirty or sessao.deleted)
+
+    # ---- Invalidação automática pelas escritas da sessão ----
+
+    def _marcar(self, session, contexto):
+        """Escritas em livros passam por BookChange (invalida só o livro); categorias são criadas pelo ORM"""
+        marcados = session.info.setdefault('cache_invalidar', set())
+        for objeto in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(objeto, BookChange):
+                marcados.add(namespace_livro(objeto.book_id))
+            elif isinstance(objeto, Category):
+                marcados.add('categorias')
+
+    def _invalidar_marcados(self, session):
+        marcados = session.info.pop('cache_invalidar', None)
+        if marcados:
+            self.invalidar(*marcados)
+
+
+cache_compartilhado = CacheCompartilhado()
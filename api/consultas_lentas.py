@@ -0,0 +1,147 @@
+"""
+Log de consultas lentas com captura automática de EXPLAIN QUERY PLAN.
+
+Os eventos before/after_cursor_execute do engine medem cada statement.
+Os que passam do limite são agregados pelo formato normalizado (literais e
+listas IN colapsados), com a rota que os executou, os parâmetros redigidos
+(apenas tipos) e o plano de execução capturado na primeira ocorrência.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LIMITE_PADRAO_MS = 100
+MAX_FORMATOS = 500  # Formatos distintos guardados (protege a memória)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTA_IN = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_ESPACOS = re.compile(r'\s+')
+
+# Statements que não fazem sentido explicar
+_SEM_PLANO = ('PRAGMA', 'SAVEPOINT', 'RELEASE', 'ROLLBACK', 'COMMIT', 'BEGIN', 'EXPLAIN', 'CREATE', 'ALTER', 'DROP')
+
+
+def normalizar(statement):
+    """Formato do statement: sem literais, com listas IN colapsadas e espaços únicos"""
+    forma = _STRING.sub('?', statement)
+    forma = _NUMERO.sub('?', forma)
+    forma = _LISTA_IN.sub('IN (?)', forma)
+    return _ESPACOS.sub(' ', forma).strip()
+
+
+def redigir(parametros):
+    """Substitui os valores dos parâmetros pelos seus tipos"""
+    if isinstance(parametros, dict):
+        return {chave: type(valor).__name__ for chave, valor in parametros.items()}
+    if isinstance(parametros, (list, tuple)):
+        return [type(valor).__name__ for valor in parametros]
+    return type(parametros).__name__
+
+
+def rota_atual():
+    if has_request_context():
+        return f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+    return f'<{threading.current_thread().name}>'
+
+
+class ConsultasLentas:
+    """Agrega as consultas lentas do engine por formato normalizado"""
+
+    def __init__(self):
+        self.formatos = {}
+        self.lock = threading.Lock()
+        self.limite_ms = LIMITE_PADRAO_MS
+
+    def init_app(self, app, engine):
+        self.limite_ms = app.config.get('SLOW_QUERY_MS', LIMITE_PADRAO_MS)
+        event.listen(engine, 'before_cursor_execute', self.antes)
+        event.listen(engine, 'after_cursor_execute', self.depois)
+        event.listen(engine, 'handle_error', self.erro)
+
+    def antes(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('inicio_consultas', []).append(time.perf_counter())
+
+    def depois(self, conn, cursor, statement, parameters, context, executemany):
+        duracao_ms = (time.perf_counter() - conn.info['inicio_consultas'].pop()) * 1000
+        if duracao_ms >= self.limite_ms:
+            self.registrar(cursor, statement, parameters, executemany, duracao_ms)
+
+    def erro(self, contexto):
+        # Statement que falhou não chega ao after_cursor_execute
+        if contexto.connection is not None and contexto.connection.info.get('inicio_consultas'):
+            contexto.connection.info['inicio_consultas'].pop()
+
+    def explicar(self, cursor, statement, parameters, executemany):
+        """EXPLAIN QUERY PLAN direto no DBAPI (não dispara os eventos de novo)"""
+        if executemany or statement.lstrip().upper().startswith(_SEM_PLANO):
+            return None
+        try:
+            explain = cursor.connection.cursor()
+            try:
+                explain.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+                return [linha[-1] for linha in explain.fetchall()]
+            finally:
+                explain.close()
+        except Exception as e:
+            return [f'indisponível: {e}']
+
+    def registrar(self, cursor, statement, parameters, executemany, duracao_ms):
+        forma = normalizar(statement)
+        rota = rota_atual()
+        logger.warning(f"Consulta lenta ({duracao_ms:.1f} ms) em {rota}: {forma}")
+
+        with self.lock:
+            registro = self.formatos.get(forma)
+            if registro is None:
+                if len(self.formatos) >= MAX_FORMATOS:
+                    return
+                registro = self.formatos[forma] = {
+                    'sql': forma,
+                    'plano': None,
+                    'ocorrencias': 0,
+                    'tempo_total_ms': 0.0,
+                    'tempo_max_ms': 0.0,
+                    'rotas': Counter(),
+                    'primeira_vez': time.strftime('%Y-%m-%dT%H:%M:%S')
+                }
+                primeira = True
+            else:
+                primeira = False
+
+            registro['ocorrencias'] += 1
+            registro['tempo_total_ms'] += duracao_ms
+            registro['tempo_max_ms'] = max(registro['tempo_max_ms'], duracao_ms)
+            registro['rotas'][rota] += 1
+            registro['ultimos_parametros'] = redigir(parameters)
+
+        # Plano capturado só na primeira ocorrência, fora do lock
+        if primeira:
+            registro['plano'] = self.explicar(cursor, statement, parameters, executemany)
+
+    def relatorio(self, limite=50):
+        """Formatos ordenados pelo tempo total gasto"""
+        with self.lock:
+            registros = [{
+                **registro,
+                'tempo_total_ms': round(registro['tempo_total_ms'], 3),
+                'tempo_max_ms': round(registro['tempo_max_ms'], 3),
+                'tempo_medio_ms': round(registro['tempo_total_ms'] / registro['ocorrencias'], 3),
+                'rotas': dict(registro['rotas'].most_common(10))
+            } for registro in self.formatos.values()]
+        registros.sort(key=lambda registro: registro['tempo_total_ms'], reverse=True)
+        return registros[:limite]
+
+    def limpar(self):
+        with self.lock:
+            self.formatos.clear()
+
+
+consultas_lentas = ConsultasLentas()
@@ -0,0 +1,95 @@
+"""
+Contagem estimada para a paginação (?total=estimate).
+
+O COUNT(*) de cada conjunto de filtros é guardado por processo. Enquanto o
+valor estiver dentro do TTL ele é devolvido direto; depois disso ainda é
+devolvido, mas uma thread de fundo recalcula a contagem. Só a primeira
+requisição de um filtro paga a contagem exata.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+TTL_PADRAO = 30            # Segundos até uma contagem ser recalculada em segundo plano
+MAX_FILTROS_PADRAO = 256   # Conjuntos de filtros guardados (LRU)
+
+
+class ContadorEstimado:
+    """Cache LRU de contagens por filtro, atualizado por uma thread de fundo"""
+
+    def __init__(self):
+        self.app = None
+        self.contagens = OrderedDict()   # chave -> (total, calculado_em, stmt)
+        self.pendentes = set()
+        self.fila = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get('CONTAGEM_TTL', TTL_PADRAO)
+        self.max_filtros = app.config.get('CONTAGEM_MAX_FILTROS', MAX_FILTROS_PADRAO)
+
+    def contar(self, query):
+        """Total estimado para a query (sem ordenação nem paginação)"""
+        stmt = db.select(db.func.count()).select_from(query.order_by(None).subquery())
+        compilado = stmt.compile()
+        chave = (str(compilado), tuple(sorted((nome, repr(valor)) for nome, valor in compilado.params.items())))
+
+        with self.lock:
+            registro = self.contagens.get(chave)
+            if registro is not None:
+                self.contagens.move_to_end(chave)
+
+        if registro is None:
+            total = db.session.execute(stmt).scalar()
+            self._guardar(chave, total, stmt)
+            return total
+
+        total, calculado_em, _ = registro
+        if time.monotonic() - calculado_em > self.ttl:
+            self._agendar(chave)
+        return total
+
+    def _guardar(self, chave, total, stmt):
+        with self.lock:
+            self.contagens[chave] = (total, time.monotonic(), stmt)
+            self.contagens.move_to_end(chave)
+            while len(self.contagens) > self.max_filtros:
+                self.contagens.popitem(last=False)
+
+    def _agendar(self, chave):
+        with self.lock:
+            if chave in self.pendentes:
+                return
+            self.pendentes.add(chave)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name='contagens', daemon=True)
+                self.thread.start()
+        self.fila.put(chave)
+
+    def _loop(self):
+        with self.app.app_context():
+            while True:
+                chave = self.fila.get()
+                with self.lock:
+                    registro = self.contagens.get(chave)
+                try:
+                    if registro is not None:
+                        self._guardar(chave, db.session.execute(registro[2]).scalar(), registro[2])
+                except Exception as e:
+                    # Mantém o valor anterior; a próxima requisição agenda de novo
+                    logger.warning(f"Falha ao recalcular contagem: {e}")
+                finally:
+                    db.session.remove()
+                    with self.lock:
+                        self.pendentes.discard(chave)
+
+
+contador_estimado = ContadorEstimado()
@@ -1,37 +1,233 @@
 import os
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from models import db, User, Book, Category
+import sqlite3
+
+# Flask e SQLAlchemy são importados dentro das funções: os comandos
+# somente leitura do CLI usam apenas o módulo sqlite3 e iniciam rápido
+
+DB_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'biblioteca.db')
+
+# Incrementar sempre que uma migração for adicionada em migrar_schema
+SCHEMA_VERSAO = 8
 
 def create_app():
     """Factory para criar a aplicação Flask com configuração do banco"""
+    from flask import Flask
+    from models import db
+    
     app = Flask(__name__)
     
     # Configuração do banco de dados SQLite
-    basedir = os.path.abspath(os.path.dirname(__file__))
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(basedir, "biblioteca.db")}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SQLALCHEMY_ECHO'] = True  # Log das queries SQL
+    app.config['SQLALCHEMY_ECHO'] = os.environ.get('SQL_ECHO', '1') == '1'  # Log das queries SQL
+    
+    # Group commit (opcional): agrupa as escritas de livros em uma transação
+    app.config['GROUP_COMMIT'] = os.environ.get('GROUP_COMMIT', '0') == '1'
+    app.config['GROUP_COMMIT_INTERVALO_MS'] = int(os.environ.get('GROUP_COMMIT_INTERVALO_MS', 5))
+    app.config['GROUP_COMMIT_MAX_OPERACOES'] = int(os.environ.get('GROUP_COMMIT_MAX_OPERACOES', 64))
+    
+    # Consultas mais lentas que isso vão para o log de consultas lentas
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+    
+    # Profiling por amostragem: 1 a cada N requisições (0 = apenas sob demanda)
+    app.config['PROFILE_AMOSTRAGEM'] = int(os.environ.get('PROFILE_AMOSTRAGEM', 0))
+    
+    # Arquivamento de livros indisponíveis sem alterações há N dias (intervalo 0 = desligado)
+    app.config['ARQUIVAR_APOS_DIAS'] = int(os.environ.get('ARQUIVAR_APOS_DIAS', 30))
+    app.config['ARQUIVAMENTO_INTERVALO'] = int(os.environ.get('ARQUIVAMENTO_INTERVALO', 3600))
+    
+    # Workers do outbox por processo (0 = desligado) e mensagens por lote
+    app.config['OUTBOX_WORKERS'] = int(os.environ.get('OUTBOX_WORKERS', 2))
+    app.config['OUTBOX_LOTE'] = int(os.environ.get('OUTBOX_LOTE', 100))
+    
+    # Livros distribuídos em N arquivos SQLite (0 = tudo no banco principal)
+    app.config['SHARDS'] = int(os.environ.get('SHARDS', 0))
+    # Segundos entre os repasses do log de alterações dos shards ao banco principal (0 = desligado)
+    app.config['SHARDS_REPASSE_INTERVALO'] = int(os.environ.get('SHARDS_REPASSE_INTERVALO', 5))
+    
+    # Respostas guardadas para repetição com Idempotency-Key (segundos e quantidade)
+    app.config['IDEMPOTENCIA_TTL'] = int(os.environ.get('IDEMPOTENCIA_TTL', 24 * 3600))
+    app.config['IDEMPOTENCIA_MAX_CHAVES'] = int(os.environ.get('IDEMPOTENCIA_MAX_CHAVES', 10000))
+    
+    # Conexões SSE por worker (sem a variável: 100 com uma thread por conexão, 10000 no servidor.py)
+    app.config['SSE_MAX_ASSINANTES'] = int(os.environ['SSE_MAX_ASSINANTES']) if os.environ.get('SSE_MAX_ASSINANTES') else None
+    
+    # Cache compartilhado entre os workers (TTL 0 = desligado; CACHE_URL=redis://... usa o Redis)
+    app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 300))
+    app.config['CACHE_MAX_ITENS'] = int(os.environ.get('CACHE_MAX_ITENS', 5000))
+    app.config['CACHE_URL'] = os.environ.get('CACHE_URL')
+    
+    # Limite global do corpo das requisições (as rotas com schema têm limites menores)
+    app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 1024 * 1024))
+    
+    # Conexões abertas antecipadamente pelo aquecimento
+    app.config['WARMUP_CONEXOES'] = int(os.environ.get('WARMUP_CONEXOES', 2))
     
     # Inicializa o banco com a aplicação
     db.init_app(app)
     
+    # SQLite em modo WAL: leitores não bloqueiam o escritor (vários workers)
+    from consultas_lentas import consultas_lentas
+    with app.app_context():
+        configurar_engine(db.engine)
+        # Registro de consultas acima de SLOW_QUERY_MS (com EXPLAIN QUERY PLAN)
+        consultas_lentas.init_app(app, db.engine)
+    
     return app
 
+# Comandos antes dos quais a transação é aberta (leituras anteriores não tomam snapshot)
+COMANDOS_ESCRITA = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'SAVEPOINT')
+
+def configurar_engine(engine):
+    """
+    PRAGMAs em cada conexão e transações abertas explicitamente. Com o
+    controle de transações do pysqlite um SAVEPOINT sem BEGIN abre a transação
+    e o seu RELEASE já a confirma: as mutações do group commit e do /batch
+    transacional deixariam de ser atômicas.
+    """
+    from sqlalchemy import event
+    event.listen(engine, 'connect', configurar_sqlite)
+    event.listen(engine, 'before_cursor_execute', abrir_transacao)
+
+def abrir_transacao(conexao, cursor, sql, parametros, contexto, varias):
+    """
+    BEGIN IMMEDIATE antes da primeira escrita (ou SAVEPOINT) da transação do
+    SQLAlchemy. IMMEDIATE pede o lock de escrita já no início e respeita o
+    busy_timeout; um BEGIN comum na primeira leitura falharia com "database is
+    locked" ao promover o snapshot se outro escritor confirmasse antes.
+    """
+    dbapi = conexao.connection.dbapi_connection
+    if not dbapi.in_transaction and sql.lstrip()[:9].upper().startswith(COMANDOS_ESCRITA):
+        dbapi.execute('BEGIN IMMEDIATE')
+
+def configurar_sqlite(conexao_dbapi, registro):
+    """PRAGMAs aplicados a cada nova conexão SQLite"""
+    conexao_dbapi.isolation_level = None  # O BEGIN vem de abrir_transacao (configurar_engine)
+    cursor = conexao_dbapi.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')   # Seguro em WAL, evita fsync por commit
+    cursor.execute('PRAGMA busy_timeout=5000')    # Espera o lock de escrita de outro processo
+    cursor.close()
+
+def schema_atualizado(caminho=DB_PATH):
+    """Verifica via PRAGMA user_version se o banco já está migrado (sem SQLAlchemy)"""
+    if not os.path.exists(caminho):
+        return False
+    with sqlite3.connect(caminho) as conexao:
+        return conexao.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSAO
+
 def init_database(app):
-    """Inicializa o banco de dados e cria as tabelas"""
+    """
+    Migração única do banco: cria as tabelas, adiciona colunas novas e dados padrão.
+    Ao final grava SCHEMA_VERSAO em PRAGMA user_version, para que a API
+    não precise repetir essas verificações a cada inicialização.
+    """
+    from models import db, User, Book, BookChange
+    
     with app.app_context():
         # Cria todas as tabelas
         db.create_all()
+        migrar_schema()
+        inicializar_sequencias()
         
         # Verifica se já existem usuários
         if User.query.count() == 0:
             create_default_users()
         
+        # Bancos criados antes do feed de alterações: registra os livros existentes
+        if BookChange.query.count() == 0 and Book.query.count() > 0:
+            backfill_book_changes()
+        
+        # Livros com gênero em texto livre ainda sem categoria associada
+        migrar_generos()
+        
+        # Colunas normalizadas de título e autor ainda não preenchidas
+        preencher_normalizados()
+        
+        # JSON pré-serializado dos livros gravados antes de json_cache existir
+        preencher_json()
+        
+        with db.engine.begin() as conexao:
+            conexao.exec_driver_sql(f'PRAGMA user_version = {SCHEMA_VERSAO}')
+        
         print("✅ Banco de dados inicializado com sucesso!")
 
+def aquecer(app):
+    """
+    Aquecimento antes da primeira requisição: abre as conexões do pool e
+    executa uma vez as consultas mais frequentes, deixando o SQL compilado
+    no cache do SQLAlchemy.
+    """
+    from models import db, User, Book, Category
+    from sugestoes import indice_sugestoes
+    
+    with app.app_context():
+        conexoes = [db.engine.connect() for _ in range(app.config.get('WARMUP_CONEXOES', 2))]
+        for conexao in conexoes:
+            conexao.close()  # Devolve ao pool já aberta
+        
+        User.query.get(0)
+        User.query.filter_by(email='').first()
+        Book.query.get(0)
+        Book.query.order_by(Book.titulo).paginate(page=1, per_page=10, error_out=False)
+        Category.query.filter_by(ativa=True).order_by(Category.nome).all()
+        indice_sugestoes.construir()  # Índice de autocomplete do processo
+        db.session.remove()
+
+# Colunas adicionadas depois da criação original das tabelas
+# (db.create_all não altera tabelas que já existem)
+COLUNAS_ADICIONADAS = [
+    ('books', 'versao', 'INTEGER NOT NULL DEFAULT 1'),
+    ('books', 'category_id', 'INTEGER REFERENCES categories (id)'),
+    ('books', 'titulo_norm', 'VARCHAR(200)'),
+    ('books', 'autor_norm', 'VARCHAR(150)'),
+    ('books', 'json_cache', 'BLOB'),
+    ('books_arquivo', 'json_cache', 'BLOB'),
+    ('book_changes', 'origem', 'VARCHAR(32)'),
+    ('outbox', 'origem', 'VARCHAR(32)'),
+]
+
+# Índices de colunas adicionadas (db.create_all só os cria em tabelas novas)
+INDICES_ADICIONADOS = [
+    ('ix_books_category_id', 'books', 'category_id'),
+    ('ix_books_titulo_norm', 'books', 'titulo_norm'),
+    ('ix_books_autor_norm', 'books', 'autor_norm'),
+]
+
+# Índices únicos de colunas adicionadas
+INDICES_UNICOS_ADICIONADOS = [
+    ('ix_book_changes_origem', 'book_changes', 'origem'),
+    ('ix_outbox_origem', 'outbox', 'origem'),
+]
+
+def migrar_schema(engine=None):
+    """
+    Adiciona em bancos existentes as colunas que ainda não existem.
+    `engine` permite migrar outro arquivo (os shards só têm books e o log de alterações a repassar).
+    """
+    from models import db
+    
+    with (engine or db.engine).begin() as conexao:
+        tabelas = set()
+        for tabela, coluna, definicao in COLUNAS_ADICIONADAS:
+            existentes = {linha[1] for linha in conexao.exec_driver_sql(f'PRAGMA table_info({tabela})')}
+            if not existentes:
+                continue
+            tabelas.add(tabela)
+            if coluna not in existentes:
+                conexao.exec_driver_sql(f'ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}')
+                print(f"✅ Coluna {tabela}.{coluna} adicionada")
+        for indice, tabela, coluna in INDICES_ADICIONADOS:
+            if tabela in tabelas:
+                conexao.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {indice} ON {tabela} ({coluna})')
+        for indice, tabela, coluna in INDICES_UNICOS_ADICIONADOS:
+            if tabela in tabelas:
+                conexao.exec_driver_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS {indice} ON {tabela} ({coluna})')
+
 def create_default_users():
     """Cria usuários padrão para testes"""
+    from models import db, User, Book, Category, BookChange
+    
     # Usuário administrador
     admin = User(
         email='admin@biblioteca.com',
@@ -102,6 +298,10 @@ def create_default_users():
     for livro in livros_exemplo:
         db.session.add(livro)
     
+    db.session.flush()
+    for livro in livros_exemplo:
+        BookChange.registrar(livro, 'create')
+    
     # Salva no banco
     try:
         db.session.commit()
@@ -112,48 +312,144 @@ def create_default_users():
         db.session.rollback()
         print(f"❌ Erro ao criar dados padrão: {e}")
 
+def backfill_book_changes():
+    """Registra um 'create' para cada livro existente no feed de alterações"""
+    from models import db, Book, BookChange
+    
+    for livro in Book.query.order_by(Book.id).all():
+        BookChange.registrar(livro, 'create')
+    db.session.commit()
+    print("✅ Feed de alterações inicializado com os livros existentes!")
+
+def inicializar_sequencias():
+    """
+    Cria (ou avança) a sequência de ids de livros acima de qualquer id já usado,
+    inclusive os arquivados e os removidos que ainda aparecem no log de alterações.
+    """
+    from models import db
+    
+    with db.engine.begin() as conexao:
+        maior_id = conexao.exec_driver_sql(
+            'SELECT MAX(COALESCE((SELECT MAX(id) FROM books), 0), '
+            'COALESCE((SELECT MAX(id) FROM books_arquivo), 0), '
+            'COALESCE((SELECT MAX(book_id) FROM book_changes), 0))'
+        ).scalar()
+        conexao.exec_driver_sql(
+            "INSERT INTO sequencias (nome, valor) VALUES ('books', ?) "
+            'ON CONFLICT (nome) DO UPDATE SET valor = MAX(valor, excluded.valor)',
+            (maior_id,)
+        )
+
+def migrar_generos():
+    """Associa cada livro sem category_id à categoria do seu gênero, criando as que faltarem"""
+    from models import db, Book, Category
+    
+    generos = [genero for (genero,) in db.session.query(Book.genero).filter(
+        Book.category_id.is_(None), Book.genero.isnot(None)
+    ).distinct()]
+    
+    for genero in generos:
+        categoria = Category.obter_ou_criar(genero)
+        if categoria is None:
+            continue
+        # O texto passa a ser o nome da categoria ("romance" -> "Romance")
+        Book.query.filter(Book.category_id.is_(None), Book.genero == genero).update(
+            {'category_id': categoria.id, 'genero': categoria.nome, 'json_cache': None}, synchronize_session=False
+        )
+    db.session.commit()
+    if generos:
+        print(f"✅ {len(generos)} gênero(s) associados às categorias")
+
+def preencher_normalizados():
+    """Preenche titulo_norm/autor_norm dos livros gravados antes dessas colunas existirem"""
+    from models import db, Book, normalizar_texto
+    
+    pendentes = db.session.query(Book.id, Book.titulo, Book.autor).filter(
+        db.or_(Book.titulo_norm.is_(None), Book.autor_norm.is_(None))
+    ).all()
+    if not pendentes:
+        return
+    
+    # SQL direto: não altera atualizado_em (onupdate) nem a versão dos livros
+    db.session.connection().exec_driver_sql(
+        'UPDATE books SET titulo_norm = ?, autor_norm = ? WHERE id = ?',
+        [(normalizar_texto(titulo), normalizar_texto(autor), book_id) for book_id, titulo, autor in pendentes]
+    )
+    db.session.commit()
+    print(f"✅ Colunas normalizadas preenchidas em {len(pendentes)} livro(s)")
+
+def preencher_json():
+    """Materializa json_cache dos livros (ativos e arquivados) em que ainda está NULL"""
+    from models import db, Book, BookArquivado
+    
+    sessao = db.session
+    total = 0
+    for modelo in (Book, BookArquivado):
+        tabela = modelo.__tablename__
+        while True:
+            livros = sessao.query(modelo).filter(modelo.json_cache.is_(None)).limit(500).all()
+            if not livros:
+                break
+            # SQL direto: não altera atualizado_em (onupdate) nem a versão dos livros
+            sessao.connection().exec_driver_sql(
+                f'UPDATE {tabela} SET json_cache = ? WHERE id = ?',
+                [(livro.serializar(), livro.id) for livro in livros]
+            )
+            sessao.commit()
+            total += len(livros)
+    if total:
+        print(f"✅ JSON pré-serializado gerado para {total} livro(s)")
+
 def reset_database(app):
     """Reseta o banco de dados (apaga tudo e recria)"""
+    from models import db
+    
     with app.app_context():
         db.drop_all()
-        db.create_all()
-        create_default_users()
-        print("🔄 Banco de dados resetado com sucesso!")
+        db.engine.dispose()
+    init_database(app)
+    print("🔄 Banco de dados resetado com sucesso!")
 
-def get_database_info(app):
-    """Retorna informações sobre o banco de dados"""
-    with app.app_context():
-        info = {
-            'total_usuarios': User.query.count(),
-            'total_livros': Book.query.count(),
-            'total_categorias': Category.query.count(),
-            'usuarios_ativos': User.query.filter_by(ativo=True).count(),
-            'livros_disponiveis': Book.query.filter_by(disponivel=True).count()
-        }
-        return info
+def get_database_info(caminho=DB_PATH):
+    """Retorna informações sobre o banco de dados (somente leitura, via sqlite3)"""
+    consultas = {
+        'total_usuarios': 'SELECT COUNT(*) FROM users',
+        'total_livros': 'SELECT COUNT(*) FROM books',
+        'total_categorias': 'SELECT COUNT(*) FROM categories',
+        'usuarios_ativos': 'SELECT COUNT(*) FROM users WHERE ativo = 1',
+        'livros_disponiveis': 'SELECT COUNT(*) FROM books WHERE disponivel = 1'
+    }
+    with sqlite3.connect(f'file:{caminho}?mode=ro', uri=True) as conexao:
+        return {chave: conexao.execute(sql).fetchone()[0] for chave, sql in consultas.items()}
 
 # Utilitários para desenvolvimento
 if __name__ == '__main__':
-    app = create_app()
-    
     import sys
     
     if len(sys.argv) > 1:
         comando = sys.argv[1]
         
-        if comando == 'init':
-            init_database(app)
+        if comando in ['init', 'migrate']:
+            init_database(create_app())
         elif comando == 'reset':
-            reset_database(app)
+            reset_database(create_app())
+        elif comando == 'arquivar':
+            from arquivamento import arquivar
+            app = create_app()
+            dias = int(sys.argv[2]) if len(sys.argv) > 2 else app.config['ARQUIVAR_APOS_DIAS']
+            with app.app_context():
+                print(f"📦 {arquivar(dias)} livro(s) arquivados")
         elif comando == 'info':
-            info = get_database_info(app)
+            info = get_database_info()
             print("📊 Informações do Banco de Dados:")
             for chave, valor in info.items():
                 print(f"   {chave}: {valor}")
         else:
             print("Comandos disponíveis:")
-            print("  python database.py init  - Inicializa o banco")
-            print("  python database.py reset - Reseta o banco")
-            print("  python database.py info  - Mostra informações")
+            print("  python database.py init    - Inicializa/migra o banco")
+            print("  python database.py migrate - Alias de init")
+            print("  python database.py reset   - Reseta o banco")
+            print("  python database.py arquivar [dias] - Move livros indisponíveis antigos para o arquivo")
+            print("  python database.py info    - Mostra informações")
     else:
-        print("Uso: python database.py [init|reset|info]")
+        print("Uso: python database.py [init|migrate|reset|arquivar|info]")
@@ -0,0 +1,456 @@
+"""
+Push de alterações do catálogo via Server-Sent Events (SSE).
+
+Uma única thread por processo acompanha a tabela book_changes e distribui
+os eventos para os assinantes, cada um com um buffer limitado e um Event;
+quem não consome a tempo é desconectado e pode retomar com o header
+Last-Event-ID.
+
+Com o servidor de desenvolvimento cada conexão aberta ocupa uma thread de
+requisição (bloqueada em Event.wait) enquanto durar, por isso o número de
+assinantes por worker é limitado a SSE_MAX_ASSINANTES (padrão 100); acima
+disso o stream responde 503 e o cliente tenta de novo (ou em outro worker).
+
+No servidor.py os streams são atendidos pelo HubSSE: a thread da requisição
+envia os headers e o replay e entrega o socket ao hub, que escreve em todas
+as conexões do worker a partir de uma única thread (selectors).
+"""
+import json
+import logging
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+from models import db, BookChange, Category, normalizar_texto
+from sharding import carregar_livros
+
+logger = logging.getLogger(__name__)
+
+CAPACIDADE_PADRAO = 256     # Eventos pendentes por assinante antes de desconectá-lo
+INTERVALO_PADRAO = 1.0      # Segundos entre verificações quando não há commits locais
+HEARTBEAT = 15              # Segundos entre comentários keep-alive
+MAX_REPLAY = 1000           # Eventos reenviados ao retomar com Last-Event-ID
+MAX_ASSINANTES_PADRAO = 100 # Conexões SSE simultâneas por worker (uma thread cada)
+MAX_ASSINANTES_HUB = 10000  # Conexões SSE por worker no HubSSE (limitadas por descritores)
+TIMEOUT_ESCRITA = 60        # Segundos sem conseguir escrever antes de fechar a conexão no hub
+
+
+def comparar_texto(valor, termo, modo):
+    """Comparação de titulo/autor de /livros (?match=) aplicada a um valor já normalizado"""
+    if modo == 'exact':
+        return valor == termo
+    if modo == 'prefix':
+        return valor.startswith(termo)
+    return termo in valor
+
+
+def formatar_evento(evento):
+    """Formata um evento no protocolo text/event-stream"""
+    dados = json.dumps(evento, ensure_ascii=False)
+    return f"id: {evento['seq']}\nevent: {evento['operacao']}\ndata: {dados}\n\n"
+
+
+def montar_eventos(alteracoes):
+    """Converte registros BookChange em eventos, carregando os livros em uma única query"""
+    ids = {a.book_id for a in alteracoes if a.operacao not in BookChange.OPERACOES_REMOCAO}
+    livros = {livro.id: livro.to_dict() for livro in carregar_livros(list(ids))}
+
+    return [{
+        'seq': a.id,
+        'operacao': a.operacao,
+        'book_id': a.book_id,
+        'autor': a.autor,
+        'genero': a.genero,
+        'livro': livros.get(a.book_id)
+    } for a in alteracoes]
+
+
+class Assinante:
+    """Conexão SSE com filtros e buffer limitado"""
+
+    def __init__(self, genero=None, autor=None, capacidade=CAPACIDADE_PADRAO, desde=0, match='contains',
+                 sinal=None):
+        # genero: igualdade com o nome da categoria; autor: sem acentos, conforme ?match=
+        self.genero = Category.chave_nome(genero) if genero else None
+        self.autor = normalizar_texto(autor) or None
+        self.match = match
+        self.capacidade = capacidade
+        # Só recebe ao vivo eventos posteriores (anteriores vêm do replay via Last-Event-ID)
+        self.desde = desde
+        self.fila = deque()
+        # Event do stream com thread própria; no HubSSE, o próprio hub (acordado com set())
+        self.sinal = sinal if sinal is not None else threading.Event()
+        self.no_hub = False
+        self.desconectado = False
+        self.encerrado = False
+
+    def aceita(self, evento):
+        """Verifica os filtros (mesma semântica dos filtros de /livros)"""
+        # O genero do livro é o nome da sua categoria; genero em branco não casa com nenhum livro
+        if self.genero is not None and (not self.genero or Category.chave_nome(evento['genero']) != self.genero):
+            return False
+        if self.autor and not comparar_texto(normalizar_texto(evento['autor']), self.autor, self.match):
+            return False
+        return True
+
+    def entregar(self, evento):
+        """Enfileira um evento; consumidores lentos são desconectados"""
+        if len(self.fila) >= self.capacidade:
+            self.desconectado = True
+        else:
+            self.fila.append(evento)
+        self.sinal.set()
+
+    def encerrar(self):
+        """Termina o stream (desligamento do worker)"""
+        self.encerrado = True
+        self.sinal.set()
+
+    def aguardar(self, timeout):
+        """Espera por eventos e retorna os pendentes (lista vazia no timeout)"""
+        self.sinal.wait(timeout)
+        self.sinal.clear()
+        return self.retirar()
+
+    def retirar(self):
+        """Retorna e remove os eventos pendentes"""
+        eventos = []
+        while self.fila:
+            eventos.append(self.fila.popleft())
+        return eventos
+
+
+class ConexaoSSE:
+    """Socket de um stream atendido pelo HubSSE e o que falta escrever nele"""
+
+    def __init__(self, sock, assinante, ultimo_seq):
+        self.sock = sock
+        self.assinante = assinante
+        self.ultimo_seq = ultimo_seq
+        self.saida = bytearray()
+        self.ultimo_envio = time.monotonic()
+        self.interesse = selectors.EVENT_READ
+        self.fechar_apos_envio = False
+        self.fechada = False
+
+
+class HubSSE:
+    """
+    Atende todos os streams SSE do worker em uma única thread, sem ocupar uma
+    thread de requisição por conexão. O servidor envia os headers e o início do
+    stream e entrega o socket com adicionar(); o hub escreve os eventos, os
+    keep-alives e fecha as conexões (cliente desconectado, overflow, encerramento).
+    """
+
+    def __init__(self, remover):
+        self.remover = remover
+        self.seletor = selectors.DefaultSelector()
+        # Par de sockets para acordar o select() a partir de outras threads
+        self.despertador, self.aviso = socket.socketpair()
+        self.despertador.setblocking(False)
+        self.aviso.setblocking(False)
+        self.seletor.register(self.despertador, selectors.EVENT_READ)
+        self.novas = deque()
+        self.conexoes = set()
+        self.thread = threading.Thread(target=self._loop, name='sse-hub', daemon=True)
+        self.thread.start()
+
+    def set(self):
+        """Acorda o hub (faz o papel do Event dos assinantes)"""
+        try:
+            self.aviso.send(b'\0')
+        except OSError:
+            pass  # Buffer cheio: o hub já tem avisos pendentes
+
+    def adicionar(self, sock, assinante, ultimo_seq):
+        """Assume o socket de um stream cujo início já foi enviado"""
+        self.novas.append(ConexaoSSE(sock, assinante, ultimo_seq))
+        self.set()
+
+    def _loop(self):
+        while True:
+            try:
+                for chave, mascara in self.seletor.select(timeout=1.0):
+                    if chave.fileobj is self.despertador:
+                        self._esvaziar_avisos()
+                    elif mascara & selectors.EVENT_READ:
+                        self._ler(chave.data)
+                    # Sockets prontos para escrita são atendidos no passo abaixo
+
+                while self.novas:
+                    conexao = self.novas.popleft()
+                    conexao.sock.setblocking(False)
+                    self.seletor.register(conexao.sock, selectors.EVENT_READ, conexao)
+                    self.conexoes.add(conexao)
+
+                agora = time.monotonic()
+                for conexao in list(self.conexoes):
+                    self._atualizar(conexao, agora)
+            except Exception:
+                logger.exception("Erro no hub SSE")
+
+    def _esvaziar_avisos(self):
+        try:
+            while self.despertador.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _ler(self, conexao):
+        """O cliente não envia nada: dados lidos são descartados e EOF fecha a conexão"""
+        try:
+            dados = conexao.sock.recv(1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            dados = b''
+        if not dados:
+            self._fechar(conexao)
+
+    def _atualizar(self, conexao, agora):
+        """Move os eventos pendentes do assinante para o socket"""
+        if conexao.fechada:
+            return
+        assinante = conexao.assinante
+        if assinante.encerrado:
+            self._fechar(conexao)
+            return
+
+        # Só busca novos eventos quando o cliente já recebeu os anteriores: quem
+        # não lê acumula na fila do assinante e cai no overflow
+        if not conexao.saida:
+            if assinante.desconectado:
+                conexao.saida += b'event: overflow\ndata: {}\n\n'
+                conexao.fechar_apos_envio = True
+            else:
+                for evento in assinante.retirar():
+                    if evento['seq'] > conexao.ultimo_seq:
+                        conexao.ultimo_seq = evento['seq']
+                        conexao.saida += formatar_evento(evento).encode()
+                if not conexao.saida and agora - conexao.ultimo_envio >= HEARTBEAT:
+                    conexao.saida += b': keep-alive\n\n'
+        elif agora - conexao.ultimo_envio >= TIMEOUT_ESCRITA:
+            self._fechar(conexao)
+            return
+
+        if conexao.saida:
+            self._enviar(conexao, agora)
+
+    def _enviar(self, conexao, agora):
+        try:
+            enviados = conexao.sock.send(conexao.saida)
+        except BlockingIOError:
+            enviados = 0
+        except OSError:
+            self._fechar(conexao)
+            return
+        if enviados:
+            del conexao.saida[:enviados]
+            conexao.ultimo_envio = agora
+
+        if not conexao.saida and conexao.fechar_apos_envio:
+            self._fechar(conexao)
+            return
+        # Espera o socket liberar espaço só enquanto houver o que escrever
+        interesse = selectors.EVENT_READ | (selectors.EVENT_WRITE if conexao.saida else 0)
+        if interesse != conexao.interesse:
+            conexao.interesse = interesse
+            self.seletor.modify(conexao.sock, interesse, conexao)
+
+    def _fechar(self, conexao):
+        conexao.fechada = True
+        self.conexoes.discard(conexao)
+        try:
+            self.seletor.unregister(conexao.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conexao.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        conexao.sock.close()
+        self.remover(conexao.assinante)
+
+
+class Broadcaster:
+    """Distribui as alterações confirmadas no banco para todos os assinantes"""
+
+    def __init__(self):
+        self.app = None
+        self.assinantes = set()
+        self.lock = threading.Lock()
+        self.acordar = threading.Event()
+        self.thread = None
+        self.ultimo_seq = 0
+        self.encerrando = False
+        self.hub = None
+
+    def init_app(self, app):
+        self.app = app
+        self.intervalo = app.config.get('SSE_INTERVALO', INTERVALO_PADRAO)
+        self.capacidade = app.config.get('SSE_BUFFER', CAPACIDADE_PADRAO)
+        self.max_assinantes = self.limite_assinantes(MAX_ASSINANTES_PADRAO)
+
+        # Commits deste processo acordam o distribuidor imediatamente;
+        # commits de outros processos são vistos na próxima verificação
+        event.listen(db.session, 'after_commit', lambda session: self.acordar.set())
+
+    def ativar_hub(self):
+        """
+        Passa a atender os streams pelo HubSSE (servidor.py, que entrega o socket
+        ao hub depois do início do stream). Sem SSE_MAX_ASSINANTES no ambiente, o
+        limite por worker sobe para MAX_ASSINANTES_HUB.
+        """
+        self.hub = HubSSE(self.remover)
+        self.max_assinantes = self.limite_assinantes(MAX_ASSINANTES_HUB)
+
+    def limite_assinantes(self, padrao):
+        """SSE_MAX_ASSINANTES, ou o padrão do modo de atendimento se não configurado"""
+        configurado = self.app.config.get('SSE_MAX_ASSINANTES')
+        return padrao if configurado is None else configurado
+
+    def assinar(self, genero=None, autor=None, desde=None, match='contains'):
+        """
+        Registra um novo assinante (inicia o distribuidor sob demanda).
+        Sem `desde` (Last-Event-ID) o assinante começa no último evento já gravado.
+        Retorna None se o worker já atingiu SSE_MAX_ASSINANTES ou está encerrando.
+        """
+        if desde is None:
+            desde = self.seq_atual()
+        assinante = Assinante(genero, autor, self.capacidade, desde, match, self.hub)
+        with self.lock:
+            if self.encerrando or len(self.assinantes) >= self.max_assinantes:
+                return None
+            self.assinantes.add(assinante)
+            if self.thread is None:
+                self.ultimo_seq = self.seq_atual()
+                self.thread = threading.Thread(target=self._loop, name='sse-broadcaster', daemon=True)
+                self.thread.start()
+        return assinante
+
+    def seq_atual(self):
+        """Id do último registro em book_changes (0 se vazio)"""
+        return db.session.query(db.func.max(BookChange.id)).scalar() or 0
+
+    def encerrar(self):
+        """Encerra todos os streams e recusa novos (desligamento gracioso do worker)"""
+        with self.lock:
+            self.encerrando = True
+            assinantes = list(self.assinantes)
+        for assinante in assinantes:
+            assinante.encerrar()
+
+    def remover(self, assinante):
+        with self.lock:
+            self.assinantes.discard(assinante)
+
+    def liberar(self, assinante):
+        """Fim da resposta: remove o assinante, exceto se o stream seguiu no HubSSE"""
+        if not assinante.no_hub:
+            self.remover(assinante)
+
+    def publicar(self, evento):
+        with self.lock:
+            assinantes = list(self.assinantes)
+        for assinante in assinantes:
+            if evento['seq'] > assinante.desde and assinante.aceita(evento):
+                assinante.entregar(evento)
+
+    def _loop(self):
+        with self.app.app_context():
+            while True:
+                self.acordar.wait(self.intervalo)
+                self.acordar.clear()
+                if not self.assinantes:
+                    # Ocioso: acompanha o log para não entregar o acumulado ao próximo assinante
+                    try:
+                        self.ultimo_seq = max(self.ultimo_seq, self.seq_atual())
+                    finally:
+                        db.session.remove()
+                    continue
+                try:
+                    alteracoes = BookChange.query.filter(BookChange.id > self.ultimo_seq) \
+                        .order_by(BookChange.id).limit(500).all()
+                    eventos = montar_eventos(alteracoes) if alteracoes else []
+                finally:
+                    db.session.remove()
+
+                for evento in eventos:
+                    self.publicar(evento)
+                    self.ultimo_seq = evento['seq']
+
+                if len(eventos) == 500:
+                    self.acordar.set()
+
+    def replay(self, desde):
+        """
+        Eventos após o id informado (retomada via Last-Event-ID).
+        Retorna None se houver mais que MAX_REPLAY: o cliente deve ressincronizar.
+        """
+        alteracoes = BookChange.query.filter(BookChange.id > desde) \
+            .order_by(BookChange.id).limit(MAX_REPLAY + 1).all()
+        if len(alteracoes) > MAX_REPLAY:
+            return None
+        return montar_eventos(alteracoes)
+
+    def corpo(self, assinante, pendentes, ultimo_seq, environ):
+        """Corpo da resposta do stream: no HubSSE com o hub ativo, senão em um gerador com thread própria"""
+        if self.hub is not None:
+            return self.stream_hub(assinante, pendentes, ultimo_seq, environ)
+        return self.stream(assinante, pendentes, ultimo_seq)
+
+    def abertura(self, assinante, pendentes, ultimo_seq):
+        """
+        Início do stream (retry e replay) e o último seq coberto por ele.
+        Com pendentes=None o cliente recebe 'reset' e deve ressincronizar via /livros/changes.
+        """
+        partes = ['retry: 3000\n\n']
+        if pendentes is None:
+            partes.append('event: reset\ndata: {}\n\n')
+            pendentes = []
+        for evento in pendentes:
+            ultimo_seq = max(ultimo_seq, evento['seq'])
+            if assinante.aceita(evento):
+                partes.append(formatar_evento(evento))
+        return ''.join(partes), ultimo_seq
+
+    def stream_hub(self, assinante, pendentes, ultimo_seq, environ):
+        """
+        Envia só o início do stream; depois que ele foi escrito, marca no environ
+        (eventos.desanexar) que o servidor deve entregar o socket ao HubSSE em
+        vez de fechá-lo, liberando a thread da requisição.
+        """
+        texto, ultimo_seq = self.abertura(assinante, pendentes, ultimo_seq)
+        yield texto
+        assinante.no_hub = True
+        environ['eventos.desanexar'] = lambda sock: self.hub.adicionar(sock, assinante, ultimo_seq)
+
+    def stream(self, assinante, pendentes, ultimo_seq):
+        """Gerador do corpo text/event-stream de um assinante (ocupa a thread da requisição)"""
+        try:
+            texto, ultimo_seq = self.abertura(assinante, pendentes, ultimo_seq)
+            yield texto
+
+            while True:
+                eventos = assinante.aguardar(HEARTBEAT)
+                if assinante.encerrado:
+                    return
+                if assinante.desconectado:
+                    yield 'event: overflow\ndata: {}\n\n'
+                    return
+                if not eventos:
+                    yield ': keep-alive\n\n'
+                    continue
+                for evento in eventos:
+                    if evento['seq'] > ultimo_seq:
+                        ultimo_seq = evento['seq']
+                        yield formatar_evento(evento)
+        finally:
+            self.remover(assinante)
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,98 @@
+"""
+Contagens por faceta (genero, ano por década, disponivel) para a listagem de livros.
+
+Todas as facetas pedidas saem de uma única consulta agregada (UNION ALL de
+GROUP BYs sobre os livros filtrados). O gênero é agrupado por category_id e
+rotulado com o nome da categoria, não pelo texto livre de Book.genero. Para o catálogo sem filtros o resultado
+fica em cache, válido enquanto o último id de book_changes não mudar, o que
+também vale para alterações feitas por outros processos.
+"""
+import threading
+
+from sqlalchemy import func, literal, select, union_all
+
+from models import db, Book, BookChange, Category
+
+FACETAS = ('genero', 'ano', 'disponivel')
+TAMANHO_DECADA = 10
+
+
+def parse_facetas(valor):
+    """'genero,ano' -> ['genero', 'ano']; levanta ValueError para facetas desconhecidas"""
+    nomes = [nome.strip() for nome in valor.split(',') if nome.strip()]
+    invalidas = [nome for nome in nomes if nome not in FACETAS]
+    if invalidas:
+        raise ValueError(f"Facetas inválidas: {', '.join(invalidas)}. Use: {', '.join(FACETAS)}")
+    return list(dict.fromkeys(nomes))
+
+
+def consultar(query, nomes, entidade=Book):
+    """
+    Executa a consulta agregada e devolve {faceta: [{'valor': ..., 'total': ...}]}.
+    `entidade` é a usada pela query (Book ou o alias com os livros arquivados).
+    """
+    filtrados = query.with_entities(entidade.category_id, entidade.ano, entidade.disponivel).order_by(None).cte('filtrados')
+    decada = filtrados.c.ano // TAMANHO_DECADA * TAMANHO_DECADA
+    partes = {
+        'genero': select(literal('genero').label('faceta'), Category.nome.label('valor'), func.count().label('total'))
+        .select_from(filtrados.outerjoin(Category, Category.id == filtrados.c.category_id))
+        .group_by(filtrados.c.category_id, Category.nome),
+        'ano': select(literal('ano').label('faceta'), decada.label('valor'), func.count().label('total'))
+        .select_from(filtrados)
+        .group_by(decada),
+        'disponivel': select(literal('disponivel').label('faceta'), filtrados.c.disponivel.label('valor'), func.count().label('total'))
+        .select_from(filtrados)
+        .group_by(filtrados.c.disponivel),
+    }
+
+    facetas = {nome: [] for nome in nomes}
+    for faceta, valor, total in db.session.execute(union_all(*(partes[nome] for nome in nomes))):
+        facetas[faceta].append(formatar(faceta, valor, total))
+
+    for nome, valores in facetas.items():
+        if nome == 'genero':
+            valores.sort(key=lambda item: (-item['total'], item['valor'] or ''))
+        else:
+            valores.sort(key=lambda item: (item['valor'] is None, item['valor'] or 0))
+    return facetas
+
+
+def formatar(faceta, valor, total):
+    if faceta == 'ano' and valor is not None:
+        return {'valor': valor, 'ate': valor + TAMANHO_DECADA - 1, 'total': total}
+    if faceta == 'disponivel' and valor is not None:
+        return {'valor': bool(valor), 'total': total}
+    return {'valor': valor, 'total': total}
+
+
+class IndiceFacetas:
+    """Cache das facetas do catálogo inteiro, invalidado pelo log de alterações"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = None
+        self.facetas = None
+
+    def obter(self, nomes):
+        seq = db.session.query(func.max(BookChange.id)).scalar() or 0
+        with self.lock:
+            if self.seq != seq:
+                self.facetas = None
+            facetas = self.facetas
+
+        if facetas is None:
+            facetas = consultar(Book.query, FACETAS)
+            with self.lock:
+                self.seq, self.facetas = seq, facetas
+
+        return {nome: facetas[nome] for nome in nomes}
+
+
+indice_facetas = IndiceFacetas()
+
+
+def calcular_facetas(query, nomes, filtrada, entidade=Book):
+    """Facetas da listagem atual: do cache se não houver filtros, senão uma consulta agregada"""
+    if not filtrada:
+        return indice_facetas.obter(nomes)
+    return consultar(query, nomes, entidade)
@@ -0,0 +1,121 @@
+"""
+Group commit: uma única thread escritora aplica as mutações pendentes
+em uma só transação a cada poucos milissegundos (ou a cada N operações).
+
+Cada mutação roda em um SAVEPOINT próprio, então uma linha com erro é
+desfeita sozinha sem contaminar o restante do lote, e cada requisição
+recebe o seu próprio resultado ou exceção. O primeiro SAVEPOINT abre a
+transação do lote com BEGIN IMMEDIATE (database.configurar_engine): o
+RELEASE não confirma nada, e o lote só fica visível no commit final.
+
+A thread escritora usa uma sessão própria, que é passada às mutações: elas
+não devem usar db.session nem Model.query. Quem submete deve liberar antes a
+conexão da requisição, para que as requisições à espera do lote não ocupem
+todo o pool de que a thread escritora precisa.
+"""
+import concurrent.futures
+import queue
+import threading
+import time
+
+from models import db
+
+INTERVALO_PADRAO_MS = 5
+MAX_OPERACOES_PADRAO = 64
+TIMEOUT_PADRAO = 30  # Segundos que uma requisição espera pelo lote
+
+
+class EscritaCancelada(Exception):
+    """O prazo acabou antes de a mutação começar: ela foi descartada e nada foi gravado"""
+
+
+class GroupCommitter:
+    """Fila de mutações drenada por uma thread escritora"""
+
+    def __init__(self):
+        self.app = None
+        self.ativo = False
+        self.fila = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.ativo = app.config.get('GROUP_COMMIT', False)
+        self.intervalo = app.config.get('GROUP_COMMIT_INTERVALO_MS', INTERVALO_PADRAO_MS) / 1000
+        self.max_operacoes = app.config.get('GROUP_COMMIT_MAX_OPERACOES', MAX_OPERACOES_PADRAO)
+
+    def submeter(self, mutacao, timeout=TIMEOUT_PADRAO):
+        """
+        Enfileira mutacao(sessao) e bloqueia até o commit do lote.
+        Retorna o valor devolvido pela mutação ou relança a sua exceção. Se o
+        prazo acabar antes de a mutação começar, ela é cancelada (EscritaCancelada);
+        se já começou, espera o resultado real em vez de relatar uma falha.
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name='group-commit', daemon=True)
+                self.thread.start()
+
+        futuro = concurrent.futures.Future()
+        self.fila.put((mutacao, futuro))
+        try:
+            return futuro.result(timeout)
+        except concurrent.futures.TimeoutError:
+            if futuro.cancel():
+                raise EscritaCancelada(f'A escrita não foi aplicada em {timeout} s; tente novamente')
+            return futuro.result()
+
+    def _proximo_lote(self):
+        """Espera a primeira mutação e agrupa as que chegarem dentro do intervalo"""
+        lote = [self.fila.get()]
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.max_operacoes:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _loop(self):
+        with self.app.app_context():
+            while True:
+                self._aplicar(self._proximo_lote())
+
+    def _aplicar(self, lote):
+        # Mesma fábrica de db.session: os listeners de commit (SSE, cache, sugestões) valem aqui
+        sessao = db.session.session_factory()
+        resultados = []
+        try:
+            for mutacao, futuro in lote:
+                # Mutações canceladas pelo prazo não são aplicadas
+                if not futuro.set_running_or_notify_cancel():
+                    continue
+                savepoint = sessao.begin_nested()
+                try:
+                    resultado = mutacao(sessao)
+                    savepoint.commit()
+                    resultados.append((futuro, resultado))
+                except Exception as e:
+                    savepoint.rollback()
+                    futuro.set_exception(e)
+
+            sessao.commit()
+        except Exception as e:
+            # Falha no commit do lote: nenhuma mutação pendente foi aplicada
+            sessao.rollback()
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        finally:
+            sessao.close()
+
+        for futuro, resultado in resultados:
+            futuro.set_result(resultado)
+
+
+group_committer = GroupCommitter()
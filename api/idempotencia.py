@@ -0,0 +1,275 @@
+"""
+Suporte ao header Idempotency-Key nas rotas POST.
+
+A primeira requisição com uma chave reserva a chave e executa a rota; a
+resposta final fica gravada junto com o hash do corpo. Repetições com o mesmo
+corpo recebem a resposta gravada (header Idempotent-Replayed: true) sem
+executar nada; com outro corpo, 422. Duplicatas concorrentes esperam a
+requisição em andamento em vez de executar de novo, consultando a chave
+com SELECTs simples (o lock de escrita só é pedido para reservar).
+
+As chaves valem por rota e por usuário autenticado (id do token, não o
+header Authorization em si). A reserva expira após RESERVA segundos e é
+renovada por uma thread de cada processo enquanto a requisição executa:
+só a de um worker que morreu chega a expirar.
+
+O armazenamento é um arquivo SQLite próprio (idempotencia.db, módulo
+sqlite3), compartilhado pelos workers e separado do banco principal para
+não disputar o seu lock de escrita. As chaves expiram após IDEMPOTENCIA_TTL
+e o total é limitado a IDEMPOTENCIA_MAX_CHAVES (as mais antigas saem antes).
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+CAMINHO_PADRAO = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'idempotencia.db')
+TTL_PADRAO = 24 * 3600        # Segundos que uma resposta fica disponível para repetição
+MAX_CHAVES_PADRAO = 10000     # Chaves guardadas (as mais antigas são removidas)
+RESERVA = 60                  # Segundos até a reserva de um worker que morreu expirar
+RENOVAR_A_CADA = 20           # Segundos entre renovações das reservas em andamento no processo
+ESPERA_MAXIMA = 30            # Segundos que uma duplicata espera pela requisição em andamento
+INTERVALO_ESPERA = 0.05       # Segundos entre verificações de uma reserva de outro processo
+TAMANHO_MAXIMO_CHAVE = 255
+LIMPEZA_A_CADA = 100          # Reservas entre limpezas das chaves expiradas/excedentes
+
+# Headers da resposta original reenviados na repetição
+HEADERS_GUARDADOS = ('Content-Type', 'ETag', 'Location')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotencia (
+    chave TEXT PRIMARY KEY,
+    hash_requisicao TEXT NOT NULL,
+    concluida INTEGER NOT NULL DEFAULT 0,
+    status INTEGER,
+    corpo BLOB,
+    headers TEXT,
+    criado_em REAL NOT NULL,
+    expira_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_idempotencia_expira_em ON idempotencia (expira_em);
+"""
+
+
+class Idempotencia:
+    """Armazém de chaves e respostas em SQLite, com espera pelas requisições em andamento"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sinais = {}     # chave -> Event das requisições em andamento neste processo
+        self.reservas = 0
+        self.identificar = None
+        self.renovador = None
+
+    def init_app(self, app, identificar=None):
+        """
+        identificar(request) deve retornar o id do usuário autenticado pelo
+        header Authorization, ou None se o token for inválido.
+        """
+        self.identificar = identificar
+        self.caminho = app.config.get('IDEMPOTENCIA_DB', CAMINHO_PADRAO)
+        self.ttl = app.config.get('IDEMPOTENCIA_TTL', TTL_PADRAO)
+        self.max_chaves = app.config.get('IDEMPOTENCIA_MAX_CHAVES', MAX_CHAVES_PADRAO)
+        self.conexao().executescript(SCHEMA)
+
+    def conexao(self):
+        """Uma conexão por thread, em modo autocommit (as transações são explícitas)"""
+        conexao = getattr(self.local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            self.local.conexao = conexao
+        return conexao
+
+    def escopo(self, req):
+        """'usuario:<id>', 'anonimo' sem Authorization, ou None se o token não identificar um usuário"""
+        if not req.headers.get('Authorization'):
+            return 'anonimo'
+        usuario_id = self.identificar(req) if self.identificar else None
+        return None if usuario_id is None else f'usuario:{usuario_id}'
+
+    # ---- Ciclo de uma chave ----
+
+    def _ler(self, conexao, chave):
+        return conexao.execute(
+            'SELECT hash_requisicao, concluida, status, corpo, headers, expira_em '
+            'FROM idempotencia WHERE chave = ?', (chave,)
+        ).fetchone()
+
+    def reservar(self, chave, hash_requisicao):
+        """
+        Retorna ('executar', None), ('repetir', linha), ('conflito', None) ou
+        ('em_andamento', None) se a espera passar de ESPERA_MAXIMA.
+        """
+        limite = time.monotonic() + ESPERA_MAXIMA
+        conexao = self.conexao()
+        while True:
+            agora = time.time()
+            linha = self._ler(conexao, chave)
+            if linha is None or linha[5] < agora:
+                # Chave nova, expirada ou reserva de um worker que morreu: confirma sob o lock de escrita
+                conexao.execute('BEGIN IMMEDIATE')
+                try:
+                    linha = self._ler(conexao, chave)
+                    if linha is None or linha[5] < agora:
+                        conexao.execute(
+                            'INSERT OR REPLACE INTO idempotencia (chave, hash_requisicao, criado_em, expira_em) '
+                            'VALUES (?, ?, ?, ?)', (chave, hash_requisicao, agora, agora + RESERVA)
+                        )
+                        conexao.execute('COMMIT')
+                        with self.lock:
+                            self.sinais[chave] = threading.Event()
+                            self._iniciar_renovador()
+                        self._limpar_periodicamente()
+                        return 'executar', None
+                    conexao.execute('COMMIT')
+                except Exception:
+                    conexao.execute('ROLLBACK')
+                    raise
+
+            if linha[0] != hash_requisicao:
+                return 'conflito', None
+            if linha[1]:
+                return 'repetir', linha
+            if time.monotonic() > limite:
+                return 'em_andamento', None
+
+            # Em andamento: no mesmo processo espera o Event, em outro consulta de novo
+            with self.lock:
+                sinal = self.sinais.get(chave)
+            if sinal is not None:
+                sinal.wait(max(limite - time.monotonic(), 0))
+            else:
+                time.sleep(INTERVALO_ESPERA)
+
+    def concluir(self, chave, resposta):
+        """Grava a resposta final da chave"""
+        headers = {nome: resposta.headers[nome] for nome in HEADERS_GUARDADOS if nome in resposta.headers}
+        self.conexao().execute(
+            'UPDATE idempotencia SET concluida = 1, status = ?, corpo = ?, headers = ?, expira_em = ? '
+            'WHERE chave = ?',
+            (resposta.status_code, resposta.get_data(), json.dumps(headers), time.time() + self.ttl, chave)
+        )
+        self._liberar(chave)
+
+    def descartar(self, chave):
+        """Remove a reserva (erro 5xx ou exceção): uma nova tentativa executa de novo"""
+        self.conexao().execute('DELETE FROM idempotencia WHERE chave = ?', (chave,))
+        self._liberar(chave)
+
+    def _iniciar_renovador(self):
+        """Inicia a thread de renovação na primeira reserva do processo (chamar com self.lock)"""
+        if self.renovador is None:
+            self.renovador = threading.Thread(target=self._renovar, name='idempotencia', daemon=True)
+            self.renovador.start()
+
+    def _renovar(self):
+        """Estende periodicamente as reservas das requisições em andamento neste processo"""
+        while True:
+            time.sleep(RENOVAR_A_CADA)
+            with self.lock:
+                chaves = list(self.sinais)
+            if not chaves:
+                continue
+            try:
+                self.conexao().execute(
+                    f"UPDATE idempotencia SET expira_em = ? "
+                    f"WHERE concluida = 0 AND chave IN ({', '.join('?' * len(chaves))})",
+                    (time.time() + RESERVA, *chaves)
+                )
+            except sqlite3.Error as e:
+                # A reserva ainda vale RESERVA segundos: tenta de novo no próximo ciclo
+                logger.warning(f"Idempotência: falha ao renovar reservas: {e}")
+
+    def _liberar(self, chave):
+        with self.lock:
+            sinal = self.sinais.pop(chave, None)
+        if sinal is not None:
+            sinal.set()
+
+    def _limpar_periodicamente(self):
+        with self.lock:
+            self.reservas += 1
+            if self.reservas % LIMPEZA_A_CADA:
+                return
+        conexao = self.conexao()
+        conexao.execute('DELETE FROM idempotencia WHERE expira_em < ?', (time.time(),))
+        conexao.execute(
+            'DELETE FROM idempotencia WHERE concluida = 1 AND chave IN ('
+            '  SELECT chave FROM idempotencia WHERE concluida = 1 ORDER BY expira_em'
+            '  LIMIT max((SELECT count(*) FROM idempotencia) - ?, 0))',
+            (self.max_chaves,)
+        )
+
+
+idempotencia = Idempotencia()
+
+
+def idempotente(f):
+    """
+    Decorator para rotas POST: honra o header Idempotency-Key. Aplicar logo
+    abaixo do @api.route, antes da validação e da autenticação, para que as
+    repetições não executem nenhum trabalho.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        chave_cliente = request.headers.get('Idempotency-Key')
+        if not chave_cliente:
+            return f(*args, **kwargs)
+
+        if len(chave_cliente) > TAMANHO_MAXIMO_CHAVE:
+            return jsonify({
+                'erro': 'Idempotency-Key inválida',
+                'status': 400,
+                'detalhes': f'A chave deve ter no máximo {TAMANHO_MAXIMO_CHAVE} caracteres'
+            }), 400
+
+        # A chave vale por rota e por usuário: clientes diferentes não colidem
+        usuario = idempotencia.escopo(request)
+        if usuario is None:
+            # Token inválido: a rota responde 401 sem reservar a chave
+            return f(*args, **kwargs)
+        escopo = '\n'.join([request.method, request.path, usuario, chave_cliente])
+        chave = hashlib.sha256(escopo.encode()).hexdigest()
+        hash_requisicao = hashlib.sha256(request.get_data(cache=True)).hexdigest()
+
+        acao, linha = idempotencia.reservar(chave, hash_requisicao)
+        if acao == 'conflito':
+            return jsonify({
+                'erro': 'Idempotency-Key reutilizada',
+                'status': 422,
+                'detalhes': 'Esta chave já foi usada com um corpo de requisição diferente'
+            }), 422
+        if acao == 'em_andamento':
+            return jsonify({
+                'erro': 'Requisição em andamento',
+                'status': 409,
+                'detalhes': 'Uma requisição com esta Idempotency-Key ainda está sendo processada'
+            }), 409
+        if acao == 'repetir':
+            _, _, status, corpo, headers, _ = linha
+            resposta = current_app.response_class(corpo, status=status, headers=json.loads(headers))
+            resposta.headers['Idempotent-Replayed'] = 'true'
+            return resposta
+
+        try:
+            resposta = current_app.make_response(f(*args, **kwargs))
+        except Exception:
+            idempotencia.descartar(chave)
+            raise
+        if resposta.status_code >= 500:
+            idempotencia.descartar(chave)
+        else:
+            idempotencia.concluir(chave, resposta)
+        return resposta
+    return decorated
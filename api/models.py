@@ -1,9 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
+import unicodedata
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
+from server_timing import server_timing
 
 db = SQLAlchemy()
 
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos e com espaços simples (chave de busca)"""
+    if not texto:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', texto)
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.lower().split())
+
 class User(db.Model):
     """Modelo para usuários do sistema"""
     __tablename__ = 'users'
@@ -24,6 +39,7 @@ class User(db.Model):
         """Verifica se a senha está correta"""
         return check_password_hash(self.password_hash, password)
     
+    @server_timing.cronometrar('serialize')
     def to_dict(self):
         """Converte o objeto para dicionário"""
         return {
@@ -38,11 +54,29 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.email}>'
 
-class Book(db.Model):
-    """Modelo para livros"""
-    __tablename__ = 'books'
+class Sequencia(db.Model):
+    """Contadores globais de ids: ids de livros removidos ou arquivados nunca são reutilizados"""
+    __tablename__ = 'sequencias'
+    
+    nome = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+    
+    @classmethod
+    def proximo(cls, conexao, nome):
+        """Incrementa e devolve o contador (na transação da conexão informada)"""
+        tabela = cls.__table__
+        return conexao.execute(
+            db.update(tabela).where(tabela.c.nome == nome)
+            .values(valor=tabela.c.valor + 1).returning(tabela.c.valor)
+        ).scalar_one()
+
+def proximo_id_livro(contexto):
+    """Default do id de Book: próximo valor da sequência 'books'"""
+    return Sequencia.proximo(contexto.connection, 'books')
+
+class ColunasLivro:
+    """Colunas comuns a books e books_arquivo (mesmo formato nas duas tabelas)"""
     
-    id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(200), nullable=False)
     autor = db.Column(db.String(150), nullable=False)
     ano = db.Column(db.Integer, nullable=True)
@@ -53,11 +87,18 @@ class Book(db.Model):
     disponivel = db.Column(db.Boolean, default=True)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    
-    # Relacionamento com usuário que criou o livro
+    # Incrementada a cada alteração; exposta como ETag para controle de concorrência
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Categoria do gênero (genero guarda o nome da categoria, mantido nas respostas)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True, index=True)
+    # Cópias normalizadas (minúsculas, sem acentos) para filtros que usam índice
+    titulo_norm = db.Column(db.String(200), nullable=True, index=True)
+    autor_norm = db.Column(db.String(150), nullable=True, index=True)
     criado_por = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    criador = db.relationship('User', backref=db.backref('livros_criados', lazy=True))
+    # to_dict() já codificado em JSON, regravado a cada escrita (NULL = ainda não materializado)
+    json_cache = db.Column(db.LargeBinary, nullable=True)
     
+    @server_timing.cronometrar('serialize')
     def to_dict(self):
         """Converte o objeto para dicionário"""
         return {
@@ -72,12 +113,84 @@ class Book(db.Model):
             'disponivel': self.disponivel,
             'criado_em': self.criado_em.isoformat() if self.criado_em else None,
             'atualizado_em': self.atualizado_em.isoformat() if self.atualizado_em else None,
-            'criado_por': self.criado_por
+            'criado_por': self.criado_por,
+            'categoria_id': self.category_id,
+            'versao': self.versao
         }
     
+    def serializar(self):
+        """to_dict() codificado em JSON (conteúdo de json_cache)"""
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode()
+    
+    def json_bytes(self):
+        """JSON do livro: o materializado ou, se ainda não existir, serializado agora"""
+        return self.json_cache or self.serializar()
+
+class Book(ColunasLivro, db.Model):
+    """Modelo para livros (tabela quente: livros disponíveis ou alterados recentemente)"""
+    __tablename__ = 'books'
+    
+    id = db.Column(db.Integer, primary_key=True, default=proximo_id_livro)
+    
+    categoria = db.relationship('Category', backref=db.backref('livros', lazy=True))
+    # Relacionamento com usuário que criou o livro
+    criador = db.relationship('User', backref=db.backref('livros_criados', lazy=True))
+    
+    # Campos com cópia normalizada: titulo -> titulo_norm, autor -> autor_norm
+    CAMPOS_NORMALIZADOS = ('titulo', 'autor')
+    
+    @validates(*CAMPOS_NORMALIZADOS)
+    def _normalizar(self, campo, valor):
+        """Mantém as colunas *_norm em dia nas alterações feitas pelo ORM"""
+        setattr(self, f'{campo}_norm', normalizar_texto(valor))
+        return valor
+    
+    @classmethod
+    def valores_normalizados(cls, valores):
+        """Colunas *_norm para UPDATEs feitos direto no SQL (sem passar pelo @validates)"""
+        return {
+            f'{campo}_norm': normalizar_texto(valores[campo])
+            for campo in cls.CAMPOS_NORMALIZADOS if campo in valores
+        }
+    
+    @classmethod
+    def materializar_json(cls, conexao, livros):
+        """
+        Regrava json_cache dos livros na transação de `conexao` (sessão ou conexão).
+        Usado pelos eventos do ORM e pelos UPDATEs feitos direto no SQL.
+        """
+        tabela = cls.__table__
+        valores = []
+        for livro in livros:
+            blob = livro.serializar()
+            valores.append({'livro_id': livro.id, 'blob': blob})
+            set_committed_value(livro, 'json_cache', blob)
+        if valores:
+            # atualizado_em explícito: sem o onupdate, a data é a da escrita original
+            conexao.execute(
+                tabela.update().where(tabela.c.id == db.bindparam('livro_id'))
+                .values(json_cache=db.bindparam('blob'), atualizado_em=tabela.c.atualizado_em),
+                valores
+            )
+    
     def __repr__(self):
         return f'<Book {self.titulo}>'
 
+@event.listens_for(Book, 'after_insert')
+@event.listens_for(Book, 'after_update')
+def _materializar_json(mapper, conexao, livro):
+    """Mantém json_cache em dia nas escritas feitas pelo ORM (valores já gerados pelo flush)"""
+    Book.materializar_json(conexao, [livro])
+
+class BookArquivado(ColunasLivro, db.Model):
+    """Livros indisponíveis e sem alterações há muito tempo (tabela fria, somente leitura)"""
+    __tablename__ = 'books_arquivo'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    
+    def __repr__(self):
+        return f'<BookArquivado {self.titulo}>'
+
 class Category(db.Model):
     """Modelo para categorias de livros"""
     __tablename__ = 'categories'
@@ -88,6 +201,7 @@ class Category(db.Model):
     ativa = db.Column(db.Boolean, default=True)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @server_timing.cronometrar('serialize')
     def to_dict(self):
         """Converte o objeto para dicionário"""
         return {
@@ -98,5 +212,165 @@ class Category(db.Model):
             'criado_em': self.criado_em.isoformat() if self.criado_em else None
         }
     
+    @staticmethod
+    def chave_nome(nome):
+        """Nome usado na comparação: espaços simples e minúsculas"""
+        return ' '.join((nome or '').split()).lower()
+    
+    @classmethod
+    def por_nome(cls, nome, sessao=None):
+        """Categoria pelo nome, sem diferenciar maiúsculas (None se não existir)"""
+        chave = cls.chave_nome(nome)
+        if not chave:
+            return None
+        sessao = db.session if sessao is None else sessao
+        return sessao.scalars(db.select(cls).where(db.func.lower(cls.nome) == chave).limit(1)).first()
+    
+    @classmethod
+    def obter_ou_criar(cls, nome, sessao=None):
+        """Categoria do gênero informado, criada na hora (na sessão informada) se ainda não existir"""
+        nome = ' '.join((nome or '').split())
+        if not nome:
+            return None
+        sessao = db.session if sessao is None else sessao
+        categoria = cls.por_nome(nome, sessao)
+        if categoria:
+            return categoria
+        try:
+            # Savepoint: outra requisição pode criar a mesma categoria ao mesmo tempo
+            with sessao.begin_nested():
+                categoria = cls(nome=nome)
+                sessao.add(categoria)
+        except IntegrityError:
+            categoria = cls.por_nome(nome, sessao)
+        return categoria
+    
     def __repr__(self):
         return f'<Category {self.nome}>'
+
+
+class BookChange(db.Model):
+    """Registro de alterações nos livros, usado pelo feed de sincronização"""
+    __tablename__ = 'book_changes'
+    # AUTOINCREMENT garante que o id (token de sincronização) nunca é reutilizado
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, nullable=False, index=True)
+    operacao = db.Column(db.String(10), nullable=False)  # create, update, delete ou archive
+    # Cópia dos campos filtráveis: o livro pode já ter sido removido
+    autor = db.Column(db.String(150), nullable=True)
+    genero = db.Column(db.String(100), nullable=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    # Identificador do registro gravado em um shard e repassado ao banco principal
+    origem = db.Column(db.String(32), unique=True, index=True, nullable=True)
+    
+    # Operações após as quais o livro sai da tabela books
+    OPERACOES_REMOCAO = ('delete', 'archive')
+    
+    @classmethod
+    def registrar(cls, livro, operacao, usuario_id=None, sessao=None):
+        """
+        Adiciona à sessão (por padrão a atual) o registro de uma alteração no
+        livro e a mensagem 'livro.alterado' no outbox (mesma transação da mutação)
+        """
+        sessao = db.session if sessao is None else sessao
+        alteracao = cls(
+            book_id=livro.id,
+            operacao=operacao,
+            autor=livro.autor,
+            genero=livro.genero
+        )
+        sessao.add(alteracao)
+        OutboxMensagem.publicar('livro.alterado', {
+            'book_id': livro.id,
+            'operacao': operacao,
+            'usuario_id': usuario_id,
+            'livro': livro.to_dict() if operacao not in cls.OPERACOES_REMOCAO else None
+        }, sessao)
+        return alteracao
+    
+    @server_timing.cronometrar('serialize')
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'seq': self.id,
+            'book_id': self.book_id,
+            'operacao': self.operacao,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None
+        }
+    
+    def __repr__(self):
+        return f'<BookChange {self.id} {self.operacao} {self.book_id}>'
+
+
+class OutboxMensagem(db.Model):
+    """
+    Efeitos colaterais de uma escrita, gravados na mesma transação e
+    processados depois do commit pelos workers do outbox (outbox.py)
+    """
+    __tablename__ = 'outbox'
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    # Próxima tentativa; NULL depois de esgotadas as tentativas
+    disponivel_em = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, index=True)
+    erro = db.Column(db.Text, nullable=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    # Identificador da mensagem gravada em um shard e repassada ao banco principal
+    origem = db.Column(db.String(32), unique=True, index=True, nullable=True)
+    
+    @classmethod
+    def publicar(cls, tipo, dados, sessao=None):
+        """Adiciona uma mensagem à sessão informada (por padrão a atual)"""
+        mensagem = cls(tipo=tipo, payload=json.dumps(dados, ensure_ascii=False))
+        (db.session if sessao is None else sessao).add(mensagem)
+        return mensagem
+    
+    @server_timing.cronometrar('serialize')
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'payload': json.loads(self.payload),
+            'tentativas': self.tentativas,
+            'disponivel_em': self.disponivel_em.isoformat() if self.disponivel_em else None,
+            'erro': self.erro,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None
+        }
+    
+    def __repr__(self):
+        return f'<OutboxMensagem {self.id} {self.tipo}>'
+
+
+class Auditoria(db.Model):
+    """Trilha de auditoria das escritas em livros, gravada pelo outbox"""
+    __tablename__ = 'auditoria'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Id da mensagem de origem: a entrega é at-least-once, a gravação é idempotente
+    mensagem_id = db.Column(db.Integer, unique=True, nullable=False)
+    book_id = db.Column(db.Integer, nullable=False, index=True)
+    operacao = db.Column(db.String(10), nullable=False)
+    usuario_id = db.Column(db.Integer, nullable=True)
+    dados = db.Column(db.Text, nullable=True)  # JSON do livro após a alteração
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @server_timing.cronometrar('serialize')
+    def to_dict(self):
+        """Converte o objeto para dicionário"""
+        return {
+            'id': self.id,
+            'book_id': self.book_id,
+            'operacao': self.operacao,
+            'usuario_id': self.usuario_id,
+            'livro': json.loads(self.dados) if self.dados else None,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None
+        }
+    
+    def __repr__(self):
+        return f'<Auditoria {self.operacao} {self.book_id}>'
@@ -0,0 +1,175 @@
+"""
+Outbox transacional: efeitos colaterais das escritas fora do caminho da requisição.
+
+As rotas gravam uma mensagem na tabela outbox na mesma transação da mutação
+(BookChange.registrar), então a mensagem existe se e somente se a escrita foi
+confirmada. Threads de fundo reservam lotes de mensagens com um único
+UPDATE ... RETURNING (seguro entre threads e processos), chamam o manipulador
+registrado para o tipo e removem as processadas.
+
+A entrega é at-least-once: uma mensagem reservada por um worker que morreu
+volta a ficar disponível após RESERVA segundos, e um manipulador que falha é
+tentado de novo com backoff exponencial. Manipuladores devem ser idempotentes.
+"""
+import json
+import logging
+import random
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from models import db, Auditoria, OutboxMensagem
+
+logger = logging.getLogger(__name__)
+
+WORKERS_PADRAO = 2       # Threads por processo (0 = desligado)
+LOTE_PADRAO = 100        # Mensagens reservadas por vez
+INTERVALO_PADRAO = 1.0   # Segundos entre verificações quando não há commits locais
+RESERVA = 60             # Segundos até uma mensagem reservada voltar a ficar disponível
+MAX_TENTATIVAS = 10      # Depois disso a mensagem fica parada (disponivel_em NULL)
+BACKOFF_MAXIMO = 300     # Segundos
+
+
+def backoff(tentativas):
+    """Espera antes da próxima tentativa: exponencial com jitter, limitada"""
+    return min(2 ** tentativas, BACKOFF_MAXIMO) * random.uniform(0.5, 1.0)
+
+
+class Outbox:
+    """Registro de manipuladores por tipo e pool de workers que drenam a tabela outbox"""
+
+    def __init__(self):
+        self.app = None
+        self.manipuladores = {}
+        self.threads = []
+        self.sinal = threading.Event()
+        self.parar = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('OUTBOX_WORKERS', WORKERS_PADRAO)
+        self.lote = app.config.get('OUTBOX_LOTE', LOTE_PADRAO)
+        self.intervalo = app.config.get('OUTBOX_INTERVALO', INTERVALO_PADRAO)
+        # Commits locais acordam os workers; os de outros processos são vistos no intervalo
+        event.listen(db.session, 'after_commit', lambda session: self.sinal.set())
+
+    def manipulador(self, tipo):
+        """Decorator: registra funcao(mensagens) para o tipo; mensagens = [(id, payload)]"""
+        def registrar(funcao):
+            self.manipuladores[tipo] = funcao
+            return funcao
+        return registrar
+
+    def iniciar(self):
+        """Inicia os workers (uma vez por processo; sem efeito com OUTBOX_WORKERS=0)"""
+        if self.workers <= 0 or self.threads:
+            return
+        for indice in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f'outbox-{indice}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _loop(self):
+        with self.app.app_context():
+            while not self.parar.is_set():
+                try:
+                    processadas = self.processar()
+                except Exception as e:
+                    logger.warning(f"Outbox: falha ao processar mensagens: {e}")
+                    processadas = 0
+                finally:
+                    db.session.remove()
+                if processadas < self.lote:
+                    self.sinal.wait(self.intervalo)
+                    self.sinal.clear()
+
+    # ---- Processamento ----
+
+    def reservar(self):
+        """Reserva um lote de mensagens disponíveis; devolve [(id, tipo, payload, tentativas)]"""
+        outbox = OutboxMensagem.__table__
+        agora = datetime.utcnow()
+        disponiveis = db.select(outbox.c.id).where(outbox.c.disponivel_em <= agora) \
+            .order_by(outbox.c.id).limit(self.lote).scalar_subquery()
+        with db.engine.begin() as conexao:
+            linhas = conexao.execute(
+                db.update(outbox).where(outbox.c.id.in_(disponiveis))
+                .values(disponivel_em=agora + timedelta(seconds=RESERVA), tentativas=outbox.c.tentativas + 1)
+                .returning(outbox.c.id, outbox.c.tipo, outbox.c.payload, outbox.c.tentativas)
+            ).all()
+        return sorted(linhas)
+
+    def processar(self):
+        """Processa um lote (um manipulador por tipo); devolve quantas mensagens foram reservadas"""
+        linhas = self.reservar()
+        por_tipo = {}
+        for mensagem_id, tipo, payload, tentativas in linhas:
+            por_tipo.setdefault(tipo, []).append((mensagem_id, json.loads(payload), tentativas))
+
+        for tipo, mensagens in por_tipo.items():
+            manipulador = self.manipuladores.get(tipo)
+            try:
+                if manipulador is None:
+                    raise LookupError(f"Nenhum manipulador registrado para '{tipo}'")
+                manipulador([(mensagem_id, payload) for mensagem_id, payload, _ in mensagens])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Outbox: falha em {len(mensagens)} mensagem(ns) '{tipo}': {e}")
+                self._reagendar(mensagens, str(e))
+            else:
+                self._confirmar([mensagem_id for mensagem_id, _, _ in mensagens])
+        return len(linhas)
+
+    def _confirmar(self, ids):
+        outbox = OutboxMensagem.__table__
+        with db.engine.begin() as conexao:
+            conexao.execute(db.delete(outbox).where(outbox.c.id.in_(ids)))
+
+    def _reagendar(self, mensagens, erro):
+        outbox = OutboxMensagem.__table__
+        agora = datetime.utcnow()
+        with db.engine.begin() as conexao:
+            for mensagem_id, _, tentativas in mensagens:
+                proxima = None if tentativas >= MAX_TENTATIVAS else agora + timedelta(seconds=backoff(tentativas))
+                conexao.execute(
+                    db.update(outbox).where(outbox.c.id == mensagem_id).values(disponivel_em=proxima, erro=erro)
+                )
+
+    def situacao(self):
+        """Mensagens pendentes e paradas (tentativas esgotadas)"""
+        pendentes = OutboxMensagem.query.filter(OutboxMensagem.disponivel_em.isnot(None)).count()
+        paradas = OutboxMensagem.query.filter(OutboxMensagem.disponivel_em.is_(None)) \
+            .order_by(OutboxMensagem.id).limit(100).all()
+        return {
+            'pendentes': pendentes,
+            'paradas': [mensagem.to_dict() for mensagem in paradas],
+            'workers': len(self.threads)
+        }
+
+    def reprocessar_paradas(self):
+        """Devolve as mensagens paradas à fila, zerando as tentativas"""
+        return OutboxMensagem.query.filter(OutboxMensagem.disponivel_em.is_(None)).update(
+            {'disponivel_em': datetime.utcnow(), 'tentativas': 0}, synchronize_session=False
+        )
+
+
+outbox = Outbox()
+
+
+# ==============================================
+# Manipuladores
+# ==============================================
+@outbox.manipulador('livro.alterado')
+def auditar_livros(mensagens):
+    """Grava a trilha de auditoria; INSERT OR IGNORE pelo id da mensagem torna a reentrega inofensiva"""
+    auditoria = Auditoria.__table__
+    db.session.execute(auditoria.insert().prefix_with('OR IGNORE'), [{
+        'mensagem_id': mensagem_id,
+        'book_id': payload['book_id'],
+        'operacao': payload['operacao'],
+        'usuario_id': payload.get('usuario_id'),
+        'dados': json.dumps(payload['livro'], ensure_ascii=False) if payload.get('livro') else None,
+        'criado_em': datetime.utcnow()
+    } for mensagem_id, payload in mensagens])
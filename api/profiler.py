@@ -0,0 +1,201 @@
+"""
+Profiler por requisição (cProfile) sob demanda.
+
+Um admin ativa o profiling de uma requisição com ?_profile=1 ou com o header
+X-Profile: 1; opcionalmente, 1 a cada N requisições é amostrada. O resultado
+é gravado em um diretório rotativo (.prof + resumo .json) e a resposta traz
+o id e o link para o resumo, com o tempo dividido em SQL, serialização,
+JWT e hashing de senha.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import time
+
+from flask import g, request
+
+DIR_PADRAO = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'perfis')
+MAX_ARQUIVOS_PADRAO = 200   # Perfis mantidos em disco (os mais antigos são apagados)
+TOP_FUNCOES = 30
+
+# Categoria de cada função a partir do arquivo/nome (ordem importa: uma função
+# chamada a partir de uma categoria anterior conta para ela, ver distribuir())
+CATEGORIAS = [
+    ('sql', ('sqlalchemy', 'flask_sqlalchemy', 'sqlite3')),
+    ('jwt', ('/jwt/',)),
+    ('hashing', ('werkzeug/security', 'hashlib', 'hmac', '_hashlib')),
+    ('serializacao', ('/json/', 'flask/json', 'to_dict')),
+]
+
+
+def categoria(arquivo, funcao):
+    alvo = f'{arquivo.replace(os.sep, "/")}:{funcao}'
+    for nome, marcadores in CATEGORIAS:
+        if any(marcador in alvo for marcador in marcadores):
+            return nome
+    return 'outros'
+
+
+def distribuir(estatisticas):
+    """
+    Fração do tempo próprio de cada função por categoria. Uma função de uma
+    categoria chamada a partir de outra que vem antes em CATEGORIAS conta para
+    a que chama, na proporção do tempo gasto a partir de cada chamador: o HMAC
+    do PyJWT (hmac.py, _hashlib) é 'jwt', e o hashing de senha continua 'hashing'.
+    """
+    ordem = {nome: i for i, (nome, _) in enumerate(CATEGORIAS)}
+    fracoes = {}
+
+    def origem(chave, visitando):
+        if chave in fracoes:
+            return fracoes[chave]
+        arquivo, _, funcao = chave
+        propria = categoria(arquivo, funcao)
+        chamadores = estatisticas.stats[chave][4] if chave in estatisticas.stats else {}
+        total = sum(tempos[2] for tempos in chamadores.values())
+        # 'outros' não herda: o código da aplicação fica com o próprio tempo
+        if propria == 'outros' or not total or chave in visitando:
+            return {propria: 1.0}
+
+        resultado = {}
+        for chamador, tempos in chamadores.items():
+            for nome, fracao in origem(chamador, visitando | {chave}).items():
+                destino = nome if ordem.get(nome, len(ordem)) < ordem[propria] else propria
+                resultado[destino] = resultado.get(destino, 0.0) + tempos[2] / total * fracao
+        fracoes[chave] = resultado
+        return resultado
+
+    return {chave: origem(chave, frozenset()) for chave in estatisticas.stats}
+
+
+def resumir(perfil, duracao):
+    """Monta o resumo: tempo próprio por categoria e as funções mais custosas"""
+    estatisticas = pstats.Stats(perfil)
+    por_categoria = {nome: 0.0 for nome, _ in CATEGORIAS}
+    por_categoria['outros'] = 0.0
+    funcoes = []
+    fracoes = distribuir(estatisticas)
+
+    for (arquivo, linha, funcao), (_, chamadas, proprio, acumulado, chamadores) in estatisticas.stats.items():
+        for nome, fracao in fracoes[(arquivo, linha, funcao)].items():
+            por_categoria[nome] += proprio * fracao
+        funcoes.append({
+            'funcao': f'{funcao} ({os.path.basename(arquivo)}:{linha})',
+            'chamadas': chamadas,
+            'tempo_proprio_ms': round(proprio * 1000, 3),
+            'tempo_acumulado_ms': round(acumulado * 1000, 3),
+            'chamado_por': sorted(
+                f'{f} ({os.path.basename(a)}:{l})' for a, l, f in chamadores
+            )[:5]
+        })
+
+    funcoes.sort(key=lambda item: item['tempo_acumulado_ms'], reverse=True)
+    return {
+        'duracao_ms': round(duracao * 1000, 3),
+        'por_categoria_ms': {nome: round(tempo * 1000, 3) for nome, tempo in por_categoria.items()},
+        'funcoes': funcoes[:TOP_FUNCOES]
+    }
+
+
+class Profiler:
+    """Integra o cProfile ao ciclo before/after request da aplicação"""
+
+    def __init__(self):
+        self.autorizar = None
+
+    def init_app(self, app, autorizar):
+        """
+        autorizar(request) deve retornar True se o solicitante for admin.
+        Registrar antes das rotas para que o profiling cubra os demais middlewares.
+        """
+        self.autorizar = autorizar
+        self.diretorio = app.config.get('PROFILE_DIR', DIR_PADRAO)
+        self.max_arquivos = app.config.get('PROFILE_MAX_ARQUIVOS', MAX_ARQUIVOS_PADRAO)
+        self.amostragem = app.config.get('PROFILE_AMOSTRAGEM', 0)  # 1 a cada N (0 = desligado)
+        app.before_request(self.iniciar)
+        app.after_request(self.finalizar)
+
+    def solicitado(self):
+        pedido = request.args.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+        return pedido and self.autorizar(request)
+
+    def amostrado(self):
+        return self.amostragem > 0 and random.randrange(self.amostragem) == 0
+
+    def iniciar(self):
+        # Sub-requisições de um /batch compartilham o g: ficam no perfil do batch
+        if 'perfil' in g:
+            return
+        solicitado = self.solicitado()
+        if solicitado or self.amostrado():
+            g.perfil_requisicao = request._get_current_object()
+            # Amostras de quem não é admin são gravadas, mas sem id/link na resposta
+            g.perfil_visivel = solicitado or self.autorizar(request)
+            g.perfil = cProfile.Profile()
+            g.perfil_inicio = time.perf_counter()
+            g.perfil.enable()
+
+    def finalizar(self, response):
+        if g.get('perfil_requisicao') is not request._get_current_object():
+            return response
+        g.pop('perfil_requisicao')
+        visivel = g.pop('perfil_visivel')
+        perfil = g.pop('perfil')
+        perfil.disable()
+
+        # Em respostas em streaming o corpo é gerado depois daqui: não há o que medir
+        if response.is_streamed:
+            return response
+
+        duracao = time.perf_counter() - g.pop('perfil_inicio')
+        perfil_id = self.salvar(perfil, duracao, response.status_code)
+        if visivel:
+            response.headers['X-Profile-Id'] = perfil_id
+            response.headers['Link'] = f'</admin/perfis/{perfil_id}>; rel="profile"'
+        return response
+
+    def salvar(self, perfil, duracao, status):
+        os.makedirs(self.diretorio, exist_ok=True)
+        perfil_id = f'{time.time_ns():x}-{os.getpid()}'
+
+        resumo = {
+            'id': perfil_id,
+            'metodo': request.method,
+            'caminho': request.full_path.rstrip('?'),
+            'status': status,
+            'criado_em': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            **resumir(perfil, duracao)
+        }
+        perfil.dump_stats(os.path.join(self.diretorio, f'{perfil_id}.prof'))
+        with open(os.path.join(self.diretorio, f'{perfil_id}.json'), 'w', encoding='utf-8') as arquivo:
+            json.dump(resumo, arquivo, ensure_ascii=False)
+
+        self.rotacionar()
+        return perfil_id
+
+    def rotacionar(self):
+        """Mantém apenas os max_arquivos perfis mais recentes"""
+        resumos = sorted(nome for nome in os.listdir(self.diretorio) if nome.endswith('.json'))
+        for nome in resumos[:-self.max_arquivos]:
+            for extensao in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(self.diretorio, nome[:-5] + extensao))
+                except FileNotFoundError:
+                    pass
+
+    def listar(self):
+        if not os.path.isdir(self.diretorio):
+            return []
+        return sorted((nome[:-5] for nome in os.listdir(self.diretorio) if nome.endswith('.json')), reverse=True)
+
+    def caminho(self, perfil_id, extensao):
+        """Caminho do arquivo de um perfil (None se o id for inválido ou inexistente)"""
+        if not all(c in '0123456789abcdef-' for c in perfil_id):
+            return None
+        caminho = os.path.join(self.diretorio, perfil_id + extensao)
+        return caminho if os.path.exists(caminho) else None
+
+
+profiler = Profiler()
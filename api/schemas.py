@@ -0,0 +1,138 @@
+"""
+Schemas declarativos dos corpos de requisição (livros, usuários e categorias).
+
+Cada Schema é compilado uma única vez, na importação, em uma lista de
+verificações por campo (tipo, tamanho, faixa e opções), então validar um
+corpo é só um laço sobre funções já prontas, sem consultar o banco.
+Campos desconhecidos são ignorados; os valores validados voltam em um novo
+dicionário apenas com os campos do schema.
+"""
+import re
+
+EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+NOMES_TIPOS = {str: 'texto', int: 'inteiro', bool: 'booleano'}
+
+
+class Campo:
+    """Declaração de um campo: tipo, obrigatoriedade e restrições"""
+
+    def __init__(self, tipo, obrigatorio=False, minimo=None, maximo=None, tamanho_max=None,
+                 tamanho_min=None, opcoes=None, formato=None, rotulo=None, nulo=None):
+        self.tipo = tipo
+        self.obrigatorio = obrigatorio
+        # Por padrão campos opcionais aceitam null (limpa o valor)
+        self.nulo = not obrigatorio if nulo is None else nulo
+        self.minimo = minimo
+        self.maximo = maximo
+        self.tamanho_max = tamanho_max
+        self.tamanho_min = tamanho_min
+        self.opcoes = opcoes
+        self.formato = formato
+        self.rotulo = rotulo
+
+    def compilar(self, nome):
+        """Gera a função valor -> mensagem de erro (ou None) só com as verificações declaradas"""
+        rotulo = self.rotulo or nome
+        verificacoes = []
+
+        if self.tipo is int:
+            # bool é subclasse de int no Python, mas não é um inteiro válido aqui
+            verificacoes.append(lambda v: None if type(v) is int else f'{rotulo} deve ser um inteiro')
+        else:
+            nome_tipo = NOMES_TIPOS[self.tipo]
+            verificacoes.append(lambda v, t=self.tipo: None if isinstance(v, t) else f'{rotulo} deve ser {nome_tipo}')
+
+        if self.tipo is str and self.obrigatorio:
+            verificacoes.append(lambda v: None if v.strip() else f'Campo {rotulo} não pode ser vazio')
+        if self.tamanho_min is not None:
+            verificacoes.append(lambda v, n=self.tamanho_min:
+                                None if len(v) >= n else f'{rotulo} deve ter pelo menos {n} caracteres')
+        if self.tamanho_max is not None:
+            verificacoes.append(lambda v, n=self.tamanho_max:
+                                None if len(v) <= n else f'{rotulo} deve ter no máximo {n} caracteres')
+        if self.minimo is not None:
+            verificacoes.append(lambda v, n=self.minimo: None if v >= n else f'{rotulo} deve ser no mínimo {n}')
+        if self.maximo is not None:
+            verificacoes.append(lambda v, n=self.maximo: None if v <= n else f'{rotulo} deve ser no máximo {n}')
+        if self.opcoes is not None:
+            opcoes = frozenset(self.opcoes)
+            verificacoes.append(lambda v: None if v in opcoes else
+                                f"{rotulo} deve ser um de: {', '.join(sorted(opcoes))}")
+        if self.formato is not None:
+            verificacoes.append(lambda v, r=self.formato: None if r.match(v) else f'{rotulo} inválido')
+
+        aceita_nulo = self.nulo
+
+        def verificar(valor):
+            if valor is None:
+                return None if aceita_nulo else f'Campo {rotulo} não pode ser nulo'
+            for verificacao in verificacoes:
+                erro = verificacao(valor)
+                if erro:
+                    return erro
+            return None
+
+        return verificar
+
+
+class Schema:
+    """Conjunto de campos compilado em um validador"""
+
+    def __init__(self, **campos):
+        self.campos = campos
+        self.verificadores = tuple(
+            (nome, campo.obrigatorio, campo.rotulo or nome, campo.compilar(nome))
+            for nome, campo in campos.items()
+        )
+
+    def validar(self, dados, parcial=False):
+        """
+        Retorna (valores, erros). Com parcial=True (atualizações) os campos
+        obrigatórios podem faltar, mas se enviados seguem as mesmas regras.
+        """
+        if not isinstance(dados, dict):
+            return None, {'': 'O corpo deve ser um objeto JSON'}
+
+        valores, erros = {}, {}
+        for nome, obrigatorio, rotulo, verificar in self.verificadores:
+            if nome not in dados:
+                if obrigatorio and not parcial:
+                    erros[nome] = f'Campo {rotulo} é obrigatório'
+                continue
+            erro = verificar(dados[nome])
+            if erro:
+                erros[nome] = erro
+            else:
+                valores[nome] = dados[nome]
+        return valores, erros
+
+
+LIVRO = Schema(
+    titulo=Campo(str, obrigatorio=True, tamanho_max=200, rotulo='Título'),
+    autor=Campo(str, obrigatorio=True, tamanho_max=150, rotulo='Autor'),
+    ano=Campo(int, minimo=-3000, maximo=2100, rotulo='Ano'),
+    genero=Campo(str, tamanho_max=100, rotulo='Gênero'),
+    isbn=Campo(str, tamanho_max=20, rotulo='ISBN'),
+    descricao=Campo(str, tamanho_max=5000, rotulo='Descrição'),
+    paginas=Campo(int, minimo=1, maximo=100000, rotulo='Páginas'),
+    disponivel=Campo(bool, nulo=False, rotulo='Disponível'),
+)
+
+USUARIO = Schema(
+    email=Campo(str, obrigatorio=True, tamanho_max=120, formato=EMAIL, rotulo='Email'),
+    password=Campo(str, obrigatorio=True, tamanho_min=6, tamanho_max=128, rotulo='Senha'),
+    nome=Campo(str, obrigatorio=True, tamanho_max=100, rotulo='Nome'),
+    role=Campo(str, opcoes=('customer', 'admin'), nulo=False, rotulo='Role'),
+    ativo=Campo(bool, nulo=False, rotulo='Ativo'),
+)
+
+LOGIN = Schema(
+    email=Campo(str, obrigatorio=True, tamanho_max=120, rotulo='Email'),
+    password=Campo(str, obrigatorio=True, tamanho_max=128, rotulo='Senha'),
+)
+
+CATEGORIA = Schema(
+    nome=Campo(str, obrigatorio=True, tamanho_max=100, rotulo='Nome'),
+    descricao=Campo(str, tamanho_max=2000, rotulo='Descrição'),
+)
@@ -0,0 +1,126 @@
+"""
+Header Server-Timing com a duração de cada fase da requisição.
+
+As fases são acumuladas em g durante a requisição e enviadas ao final,
+por exemplo:
+
+    Server-Timing: middleware;dur=0.31, auth;dur=1.92, db;dur=2.40, serialize;dur=0.55, total;dur=6.10
+
+As fases são exclusivas: o tempo de uma fase medida dentro de outra (por
+exemplo a consulta do usuário, em db, dentro de auth) conta só para a mais
+interna, então a soma das fases nunca passa do total.
+
+Fora de uma requisição (threads de background) as medições são ignoradas.
+"""
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+DESCRICOES = {
+    'middleware': 'before_request',
+    'auth': 'JWT e usuário',
+    'db': 'consultas SQL',
+    'serialize': 'to_dict e JSON',
+    'cache': 'cache compartilhado',
+    'externo': 'API externa',
+}
+
+
+class ProvedorJSONCronometrado(DefaultJSONProvider):
+    """Provedor JSON do Flask que contabiliza a codificação em 'serialize'"""
+
+    def dumps(self, obj, **kwargs):
+        with server_timing.medir('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+class ServerTiming:
+    """Acumula as durações por fase e escreve o header Server-Timing"""
+
+    def init_app(self, app, engine=None):
+        """Registrar antes das rotas para que o total cubra os demais middlewares"""
+        app.json = ProvedorJSONCronometrado(app)
+        app.before_request(self.iniciar)
+        app.after_request(self.finalizar)
+        if engine is not None:
+            from sqlalchemy import event
+            event.listen(engine, 'before_cursor_execute', self.antes_consulta)
+            event.listen(engine, 'after_cursor_execute', self.depois_consulta)
+            event.listen(engine, 'handle_error', self.erro_consulta)
+
+    def acumular(self, fase, segundos):
+        """Soma a duração à fase e a desconta da fase que a envolve (se houver)"""
+        if has_request_context():
+            fases = g.setdefault('server_timing', {})
+            fases[fase] = fases.get(fase, 0.0) + segundos
+            pilha = g.get('server_timing_pilha')
+            if pilha:
+                pilha[-1][0] += segundos
+
+    @contextmanager
+    def medir(self, fase):
+        if not has_request_context():
+            yield
+            return
+        # Cada fase aberta acumula o tempo das fases aninhadas, descontado ao final
+        pilha = g.setdefault('server_timing_pilha', [])
+        aninhadas = [0.0]
+        pilha.append(aninhadas)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            duracao = time.perf_counter() - inicio
+            pilha.pop()
+            self.acumular(fase, duracao - aninhadas[0])
+            if pilha:
+                # A fase envolvente desconta a duração inteira, não só a parte exclusiva
+                pilha[-1][0] += aninhadas[0]
+
+    def cronometrar(self, fase):
+        """Decorator equivalente a medir(fase) em volta da função"""
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                with self.medir(fase):
+                    return f(*args, **kwargs)
+            return decorated
+        return decorator
+
+    def antes_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('inicio_timing', []).append(time.perf_counter())
+
+    def depois_consulta(self, conn, cursor, statement, parameters, context, executemany):
+        self.acumular('db', time.perf_counter() - conn.info['inicio_timing'].pop())
+
+    def erro_consulta(self, contexto):
+        if contexto.connection is not None and contexto.connection.info.get('inicio_timing'):
+            contexto.connection.info['inicio_timing'].pop()
+
+    def iniciar(self):
+        # Sub-requisições de um /batch compartilham o g: as fases entram no total do batch
+        g.setdefault('server_timing_inicio', time.perf_counter())
+
+    def finalizar(self, response):
+        inicio = g.get('server_timing_inicio')
+        if inicio is None:
+            return response
+
+        fases = g.get('server_timing', {})
+        metricas = []
+        for fase, segundos in fases.items():
+            descricao = DESCRICOES.get(fase)
+            metrica = f'{fase};dur={segundos * 1000:.2f}'
+            metricas.append(f'{metrica};desc="{descricao}"' if descricao else metrica)
+        metricas.append(f'total;dur={(time.perf_counter() - inicio) * 1000:.2f}')
+
+        response.headers['Server-Timing'] = ', '.join(metricas)
+        # Permite que o navegador exponha os tempos para origens diferentes (frontend)
+        response.headers['Timing-Allow-Origin'] = '*'
+        return response
+
+
+server_timing = ServerTiming()
@@ -0,0 +1,349 @@
+"""
+Servidor de produção pre-fork para a API com banco (app_rest_db.py).
+
+O processo mestre abre o socket, executa a migração do banco (se necessária)
+em um processo filho e cria N workers com fork. Cada worker cria a aplicação
+e o engine do SQLAlchemy *depois* do fork e aceita conexões no mesmo socket.
+
+Cada worker atende com um pool fixo de --threads threads (o parser HTTP é o
+do werkzeug). Streams SSE ocupam uma thread só até o envio do início do
+stream: depois o socket passa ao HubSSE do worker (eventos.py), que atende
+todos os streams em uma única thread. Em produção exposta, coloque um proxy
+reverso (nginx) na frente.
+
+Sinais no mestre:
+    SIGHUP          recarrega os workers um a um (novo código é importado)
+    SIGTERM/SIGINT  para de aceitar conexões e aguarda os workers terminarem
+
+Uso:
+    python servidor.py --workers 4 --threads 8 --port 5003
+"""
+import argparse
+import os
+import random
+import resource
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import schema_atualizado
+
+TIMEOUT_DRENAGEM = 30  # Segundos para os workers terminarem antes do SIGKILL
+TIMEOUT_PRONTO = 60    # Segundos para um worker novo ficar pronto na recarga (SIGHUP)
+
+
+# ==============================================
+# Worker
+# ==============================================
+def criar_servidor(sock, app, threads):
+    """Servidor WSGI do worker com um pool de exatamente `threads` threads"""
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class Manipulador(WSGIRequestHandler):
+        # Sem chunked: o HubSSE continua o corpo do stream escrevendo direto no socket
+        protocol_version = 'HTTP/1.0'
+
+    class ServidorPool(BaseWSGIServer):
+        def __init__(self):
+            super().__init__(sock.getsockname()[0], sock.getsockname()[1], app,
+                             handler=Manipulador, fd=sock.fileno())
+            self.vagas = threading.BoundedSemaphore(threads)
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+
+        def handle_request(self):
+            """
+            Reserva uma thread livre *antes* do accept(): com o pool cheio o worker
+            não tira conexões da fila do socket e os outros workers as recebem.
+            """
+            if not self.vagas.acquire(timeout=self.timeout):
+                return
+            self.reservada = True
+            try:
+                super().handle_request()
+            finally:
+                # Sem conexão (timeout ou aceita por outro worker): devolve a vaga
+                if self.reservada:
+                    self.vagas.release()
+
+        def process_request(self, request, client_address):
+            self.reservada = False
+            self.pool.submit(self.atender, request, client_address)
+
+        def finish_request(self, request, client_address):
+            return self.RequestHandlerClass(request, client_address, self)
+
+        def atender(self, request, client_address):
+            desanexar = None
+            try:
+                manipulador = self.finish_request(request, client_address)
+                desanexar = getattr(manipulador, 'environ', {}).get('eventos.desanexar')
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                # Stream SSE: o socket continua aberto com o HubSSE e a thread volta ao pool
+                if desanexar is not None:
+                    desanexar(request)
+                else:
+                    self.shutdown_request(request)
+                self.vagas.release()
+
+        def fechar(self):
+            """Fecha o socket e espera as requisições em andamento terminarem"""
+            self.server_close()
+            self.pool.shutdown(wait=True)
+
+    return ServidorPool()
+
+
+def liberar_descritores():
+    """Eleva o limite de descritores abertos ao máximo permitido (streams SSE no hub)"""
+    _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+    except (ValueError, OSError):
+        pass
+
+
+def executar_worker(sock, max_requisicoes, threads, pronto=None):
+    """
+    Loop de um worker: atende até max_requisicoes e sai para ser reciclado.
+    `pronto` é o pipe em que o worker avisa o mestre que já aceita conexões.
+    """
+    parar = False
+    encerrar_streams = None
+
+    def ao_terminar(signum, frame):
+        nonlocal parar
+        parar = True
+        # Streams SSE não terminam sozinhos: encerra-os já (os clientes reconectam em
+        # outro worker com Last-Event-ID), inclusive se o pool inteiro estiver com eles
+        if encerrar_streams is not None:
+            encerrar_streams()
+
+    signal.signal(signal.SIGTERM, ao_terminar)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # O mestre coordena o Ctrl+C
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # Em produção o log de cada query fica desligado (exceto se SQL_ECHO=1)
+    os.environ.setdefault('SQL_ECHO', '0')
+
+    # Importações pesadas só depois do fork: cada worker tem o seu engine
+    from app_rest_db import get_app
+    from database import aquecer
+    from arquivamento import arquivador
+    from eventos import broadcaster
+    from outbox import outbox
+    from sharding import shards
+
+    app = get_app()
+    encerrar_streams = broadcaster.encerrar
+    aquecer(app)
+    # Streams SSE no hub: não ocupam threads do pool, só descritores de arquivo
+    broadcaster.ativar_hub()
+    liberar_descritores()
+    # Cada worker tem o seu arquivador; os lotes são transacionais, então
+    # execuções simultâneas não movem o mesmo livro duas vezes
+    arquivador.iniciar()
+    # Workers do outbox: a reserva por UPDATE ... RETURNING não entrega a mesma mensagem a dois
+    outbox.iniciar()
+    # Repasse do log gravado nos shards: a origem única evita duplicar entre workers
+    shards.iniciar()
+
+    atendidas = 0
+
+    def contar(environ, start_response):
+        nonlocal atendidas
+        atendidas += 1
+        return app(environ, start_response)
+
+    servidor = criar_servidor(sock, contar, threads)
+    servidor.timeout = 1.0  # Verifica o sinal de parada ao menos uma vez por segundo
+
+    if pronto is not None:
+        try:
+            os.write(pronto, b'1')
+        except OSError:
+            pass  # O mestre não está esperando o aviso
+        os.close(pronto)
+
+    # Variação aleatória evita que todos os workers reiniciem ao mesmo tempo
+    limite = max_requisicoes + random.randint(0, max_requisicoes // 10) if max_requisicoes else None
+
+    while not parar and (limite is None or atendidas < limite):
+        servidor.handle_request()
+
+    # Também na reciclagem por max_requisicoes: fechar() espera as requisições
+    broadcaster.encerrar()
+    servidor.fechar()
+    os._exit(0)
+
+
+# ==============================================
+# Mestre
+# ==============================================
+class Mestre:
+    """Mantém N workers vivos, recarrega com SIGHUP e drena com SIGTERM"""
+
+    def __init__(self, host, port, workers, max_requisicoes, threads):
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.max_requisicoes = max_requisicoes
+        self.threads = threads
+        self.workers = set()
+        self.parando = False
+        self.recarregar = False
+
+    def abrir_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        # Não bloqueante: se outro worker aceitar a conexão primeiro, accept() retorna na hora
+        sock.setblocking(False)
+        return sock
+
+    def migrar_banco(self):
+        """Roda a migração em um processo filho para o mestre não importar o SQLAlchemy"""
+        if schema_atualizado():
+            return
+        pid = os.fork()
+        if pid == 0:
+            from database import create_app, init_database
+            init_database(create_app())
+            os._exit(0)
+        _, status = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0:
+            sys.exit("❌ Falha na migração do banco de dados")
+
+    def criar_worker(self, aguardar=False):
+        """
+        Cria um worker. Com aguardar=True espera o aviso de que ele já aceita
+        conexões e retorna se o aviso chegou dentro de TIMEOUT_PRONTO.
+        """
+        leitura, escrita = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(leitura)
+            try:
+                executar_worker(self.sock, self.max_requisicoes, self.threads, escrita)
+            finally:
+                os._exit(1)
+        os.close(escrita)
+        self.workers.add(pid)
+        try:
+            if not aguardar:
+                return True
+            prontos, _, _ = select.select([leitura], [], [], TIMEOUT_PRONTO)
+            # EOF sem o aviso: o worker morreu durante a inicialização
+            if prontos and os.read(leitura, 1) == b'1':
+                return True
+            self.sinalizar(pid, signal.SIGKILL)
+            return False
+        finally:
+            os.close(leitura)
+
+    def coletar_workers(self):
+        """Remove os workers que terminaram e devolve quantos foram coletados"""
+        coletados = 0
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            self.workers.discard(pid)
+            coletados += 1
+        return coletados
+
+    def sinalizar(self, pid, sinal):
+        try:
+            os.kill(pid, sinal)
+        except ProcessLookupError:
+            self.workers.discard(pid)
+
+    def recarregar_workers(self):
+        """
+        Troca os workers um a um: o antigo só recebe SIGTERM depois que o novo
+        avisa que está pronto, então a capacidade nunca cai nem dobra de uma vez.
+        """
+        for pid in list(self.workers):
+            if self.parando:
+                return
+            if not self.criar_worker(aguardar=True):
+                print("❌ Novo worker não ficou pronto; recarga interrompida (workers antigos mantidos)")
+                return
+            self.sinalizar(pid, signal.SIGTERM)
+            self.coletar_workers()
+        print(f"🔄 Workers recarregados ({self.num_workers})")
+
+    def drenar(self):
+        for pid in list(self.workers):
+            self.sinalizar(pid, signal.SIGTERM)
+        limite = time.monotonic() + TIMEOUT_DRENAGEM
+        while self.workers and time.monotonic() < limite:
+            self.coletar_workers()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            self.sinalizar(pid, signal.SIGKILL)
+        self.coletar_workers()
+
+    def executar(self):
+        self.sock = self.abrir_socket()
+        self.migrar_banco()
+
+        def ao_terminar(signum, frame):
+            self.parando = True
+
+        def ao_recarregar(signum, frame):
+            self.recarregar = True
+
+        signal.signal(signal.SIGTERM, ao_terminar)
+        signal.signal(signal.SIGINT, ao_terminar)
+        signal.signal(signal.SIGHUP, ao_recarregar)
+
+        for _ in range(self.num_workers):
+            self.criar_worker()
+
+        print(f"🚀 Servidor pre-fork em http://{self.host}:{self.port} "
+              f"(mestre {os.getpid()}, {self.num_workers} workers)")
+
+        while not self.parando:
+            if self.recarregar:
+                self.recarregar = False
+                self.recarregar_workers()
+
+            self.coletar_workers()
+            # Repõe workers reciclados (max_requisicoes) ou que falharam
+            while len(self.workers) < self.num_workers and not self.parando:
+                self.criar_worker()
+            time.sleep(0.5)
+
+        print("🛑 Encerrando: aguardando os workers terminarem as requisições em andamento")
+        self.drenar()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor pre-fork da API com banco')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5003)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('THREADS', 1)),
+                        help='tamanho do pool de threads de cada worker (streams SSE não ocupam o pool)')
+    parser.add_argument('--max-requisicoes', type=int, default=int(os.environ.get('MAX_REQUISICOES', 10000)),
+                        help='recicla o worker após N requisições (0 = sem limite)')
+    args = parser.parse_args()
+    if args.threads < 1:
+        parser.error('--threads deve ser pelo menos 1')
+
+    Mestre(args.host, args.port, args.workers, args.max_requisicoes, args.threads).executar()
+
+
+if __name__ == '__main__':
+    main()
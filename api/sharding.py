@@ -0,0 +1,446 @@
+"""
+Modo particionado (opcional): livros distribuídos em N arquivos SQLite.
+
+Com SHARDS=N a tabela books de cada livro fica em biblioteca_shard<i>.db,
+escolhido por um hash do id, e cada arquivo tem o seu próprio escritor.
+Usuários, categorias, o log de alterações e a sequência de ids continuam
+no banco principal (biblioteca.db). Os ids vêm da sequência global em
+blocos reservados por processo, então nunca colidem entre shards.
+
+Cada escrita grava o registro de book_changes e a mensagem do outbox no
+próprio shard, na mesma transação do livro. Depois do commit eles são
+repassados ao banco principal e removidos do shard. A coluna origem, única
+no banco principal, torna o repasse idempotente. Um repasse interrompido
+(falha do processo entre os dois commits) é refeito pela thread de repasse
+de cada processo, a cada SHARDS_REPASSE_INTERVALO segundos.
+
+Rotas por id acessam um único shard; listagens e buscas consultam todos
+em paralelo e intercalam os resultados por título. A listagem paginada lê
+pagina * por_pagina linhas de cada shard, limitadas a PROFUNDIDADE_MAXIMA.
+
+Uso da ferramenta de rebalanceamento (com a API parada):
+    python sharding.py rebalancear 4   # divide o banco atual (ou os shards) em 4
+    python sharding.py rebalancear 0   # volta todos os livros para o banco principal
+    python sharding.py info
+"""
+import glob
+import heapq
+import itertools
+import logging
+import os
+import re
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, delete, event, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import DB_PATH, configurar_engine, migrar_schema
+from models import db, Book, BookChange, OutboxMensagem, Sequencia
+
+logger = logging.getLogger(__name__)
+
+DIRETORIO = os.path.dirname(DB_PATH)
+BLOCO_IDS = 100                # Ids reservados por vez na sequência global
+LOTE = 500                     # Livros movidos (ou registros repassados) por transação
+PROFUNDIDADE_MAXIMA = 10000    # pagina * por_pagina máximo da listagem (linhas lidas por shard)
+REPASSE_INTERVALO_PADRAO = 5   # Segundos entre os repasses periódicos do log (0 = só após cada escrita)
+LOG_ALTERACOES = (BookChange, OutboxMensagem)  # Tabelas gravadas no shard e repassadas
+
+
+def caminho_shard(indice, diretorio=DIRETORIO):
+    return os.path.join(diretorio, f'biblioteca_shard{indice}.db')
+
+
+def shards_existentes(diretorio=DIRETORIO):
+    """Índices dos arquivos de shard presentes no diretório"""
+    indices = []
+    for caminho in glob.glob(os.path.join(diretorio, 'biblioteca_shard*.db')):
+        encontrado = re.search(r'biblioteca_shard(\d+)\.db$', caminho)
+        if encontrado:
+            indices.append(int(encontrado.group(1)))
+    return sorted(indices)
+
+
+def shard_do_id(book_id, total):
+    """Shard de um livro: hash multiplicativo (Knuth) do id, estável entre processos"""
+    return ((book_id * 2654435761) & 0xFFFFFFFF) % total
+
+
+def criar_engine(caminho):
+    """Engine de um arquivo de shard, com os mesmos PRAGMAs do banco principal, books e o log a repassar"""
+    engine = create_engine(f'sqlite:///{caminho}')
+    configurar_engine(engine)
+    for modelo in (Book, *LOG_ALTERACOES):
+        modelo.__table__.create(engine, checkfirst=True)
+    migrar_schema(engine)  # Colunas adicionadas depois da criação do shard
+    return engine
+
+
+def marcar_origem(sessao, contexto, instancias):
+    """before_flush dos shards: cada registro do log recebe a origem que o identifica no banco principal"""
+    for objeto in sessao.new:
+        if isinstance(objeto, LOG_ALTERACOES) and objeto.origem is None:
+            objeto.origem = uuid.uuid4().hex
+
+
+def repassar_alteracoes(sessao_shard, sessao_principal):
+    """
+    Copia para o banco principal o log de alterações gravado no shard e o
+    remove do shard, em lotes. Registros cuja origem já está no banco principal
+    (repasse interrompido antes da remoção) não são copiados de novo.
+    Devolve a quantidade de registros repassados.
+    """
+    repassados = 0
+    while True:
+        lotes = {
+            modelo: sessao_shard.execute(
+                select(modelo.__table__).order_by(modelo.id).limit(LOTE)
+            ).mappings().all()
+            for modelo in LOG_ALTERACOES
+        }
+        sessao_shard.commit()  # Encerra a leitura: a remoção abre a sua própria transação
+        if not any(lotes.values()):
+            return repassados
+
+        for modelo, linhas in lotes.items():
+            if not linhas:
+                continue
+            existentes = set(sessao_principal.scalars(
+                select(modelo.origem).where(modelo.origem.in_([linha['origem'] for linha in linhas]))
+            ))
+            for linha in linhas:
+                if linha['origem'] not in existentes:
+                    sessao_principal.add(modelo(**{coluna: valor for coluna, valor in linha.items() if coluna != 'id'}))
+        sessao_principal.commit()
+
+        for modelo, linhas in lotes.items():
+            if linhas:
+                tabela = modelo.__table__
+                sessao_shard.execute(delete(tabela).where(tabela.c.id.in_([linha['id'] for linha in linhas])))
+        sessao_shard.commit()
+        repassados += sum(len(linhas) for linhas in lotes.values())
+
+
+class GeradorIds:
+    """Ids de livros a partir da sequência global, reservando blocos para evitar um lock por inserção"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.atual = 0
+        self.limite = 0
+
+    def proximo(self, engine):
+        with self.lock:
+            if self.atual >= self.limite:
+                with engine.begin() as conexao:
+                    sequencias = Sequencia.__table__
+                    self.limite = conexao.execute(
+                        db.update(sequencias).where(sequencias.c.nome == 'books')
+                        .values(valor=sequencias.c.valor + BLOCO_IDS).returning(sequencias.c.valor)
+                    ).scalar_one()
+                self.atual = self.limite - BLOCO_IDS
+            self.atual += 1
+            return self.atual
+
+
+class Shards:
+    """Engines e sessões dos arquivos de shard do processo"""
+
+    def __init__(self):
+        self.app = None
+        self.engines = []
+        self.fabricas = []
+        self.executor = None
+        self.gerador_ids = GeradorIds()
+        self.locks_repasse = []
+        self.thread = None
+        self.parar = threading.Event()
+
+    @property
+    def ativo(self):
+        return bool(self.engines)
+
+    @property
+    def total(self):
+        return len(self.engines)
+
+    def init_app(self, app):
+        total = app.config.get('SHARDS', 0)
+        if not total:
+            return
+
+        if shards_existentes() != list(range(total)):
+            raise RuntimeError(
+                f"Os arquivos de shard não correspondem a SHARDS={total}: "
+                f"execute 'python sharding.py rebalancear {total}' com a API parada"
+            )
+
+        from consultas_lentas import consultas_lentas
+        self.engines = [criar_engine(caminho_shard(indice)) for indice in range(total)]
+        for engine in self.engines:
+            consultas_lentas.init_app(app, engine)
+        self.fabricas = [sessionmaker(bind=engine, expire_on_commit=False) for engine in self.engines]
+        for fabrica in self.fabricas:
+            event.listen(fabrica, 'before_flush', marcar_origem)
+        self.executor = ThreadPoolExecutor(max_workers=total, thread_name_prefix='shard')
+        self.locks_repasse = [threading.Lock() for _ in range(total)]
+        self.app = app
+        self.intervalo_repasse = app.config.get('SHARDS_REPASSE_INTERVALO', REPASSE_INTERVALO_PADRAO)
+        with app.app_context():
+            self.engine_principal = db.engine
+
+    def indice(self, book_id):
+        return shard_do_id(book_id, self.total)
+
+    def proximo_id(self):
+        return self.gerador_ids.proximo(self.engine_principal)
+
+    @contextmanager
+    def sessao(self, book_id):
+        """Sessão no shard do livro: commit ao final do bloco, rollback em caso de erro"""
+        sessao = self.fabricas[self.indice(book_id)]()
+        try:
+            yield sessao
+            sessao.commit()
+        except Exception:
+            sessao.rollback()
+            raise
+        finally:
+            sessao.close()
+
+    # ---- Repasse do log de alterações ----
+
+    def repassar(self, indices=None):
+        """Repassa ao banco principal o log pendente dos shards (requer app context)"""
+        repassados = 0
+        for indice in range(self.total) if indices is None else indices:
+            with self.locks_repasse[indice]:
+                sessao_shard = self.fabricas[indice]()
+                # Sessão própria: os listeners de db.session (SSE, outbox, caches) são acionados no commit
+                sessao = db.session.session_factory()
+                try:
+                    repassados += repassar_alteracoes(sessao_shard, sessao)
+                except IntegrityError:
+                    # Outro processo repassou os mesmos registros: ele também os remove do shard
+                    sessao.rollback()
+                finally:
+                    sessao.close()
+                    sessao_shard.close()
+        return repassados
+
+    def iniciar(self):
+        """Inicia a thread de repasse periódico (uma vez por processo; sem efeito fora do modo particionado)"""
+        if not self.ativo or self.intervalo_repasse <= 0 or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._loop, name='repasse-shards', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    total = self.repassar()
+                    if total:
+                        logger.info(f"Repasse: {total} registro(s) do log movidos dos shards")
+                except Exception as e:
+                    logger.warning(f"Repasse: falha ao repassar o log dos shards: {e}")
+                if self.parar.wait(self.intervalo_repasse):
+                    return
+
+    def em_paralelo(self, funcao, indices=None):
+        """Executa funcao(sessao, indice) nos shards em paralelo e devolve os resultados na ordem"""
+        def executar(indice):
+            sessao = self.fabricas[indice]()
+            try:
+                return funcao(sessao, indice)
+            finally:
+                sessao.close()
+        return list(self.executor.map(executar, range(self.total) if indices is None else indices))
+
+    # ---- Leituras ----
+
+    def obter(self, book_id):
+        sessao = self.fabricas[self.indice(book_id)]()
+        try:
+            return sessao.get(Book, book_id)
+        finally:
+            sessao.close()
+
+    def carregar(self, ids):
+        """Livros pelos ids, consultando apenas os shards envolvidos"""
+        por_shard = {}
+        for book_id in ids:
+            por_shard.setdefault(self.indice(book_id), []).append(book_id)
+        resultados = self.em_paralelo(
+            lambda sessao, indice: sessao.scalars(select(Book).where(Book.id.in_(por_shard[indice]))).all(),
+            list(por_shard)
+        )
+        return [livro for livros in resultados for livro in livros]
+
+    def listar(self, condicoes, pagina, por_pagina):
+        """
+        Scatter-gather paginado: cada shard devolve as primeiras pagina * por_pagina
+        linhas por (titulo, id) e a sua contagem; o merge das listas ordenadas dá a página.
+        A rota limita pagina * por_pagina a PROFUNDIDADE_MAXIMA.
+        """
+        limite = pagina * por_pagina
+
+        def consultar(sessao, indice):
+            livros = sessao.scalars(
+                select(Book).where(*condicoes).order_by(Book.titulo, Book.id).limit(limite)
+            ).all()
+            total = sessao.scalar(select(func.count()).select_from(Book).where(*condicoes))
+            return livros, total
+
+        resultados = self.em_paralelo(consultar)
+        ordenados = heapq.merge(*(livros for livros, _ in resultados), key=lambda livro: (livro.titulo, livro.id))
+        return list(itertools.islice(ordenados, limite - por_pagina, limite)), sum(total for _, total in resultados)
+
+    def buscar(self, condicoes):
+        """Todos os livros que atendem às condições, intercalados por título"""
+        resultados = self.em_paralelo(lambda sessao, indice: sessao.scalars(
+            select(Book).where(*condicoes).order_by(Book.titulo, Book.id)
+        ).all())
+        return list(heapq.merge(*resultados, key=lambda livro: (livro.titulo, livro.id)))
+
+    def linhas(self, *colunas):
+        """Colunas de todos os livros de todos os shards"""
+        return [linha for linhas in self.em_paralelo(
+            lambda sessao, indice: sessao.execute(select(*colunas)).all()
+        ) for linha in linhas]
+
+    def isbn_em_uso(self, isbn, exceto_id=None):
+        condicoes = [Book.isbn == isbn]
+        if exceto_id is not None:
+            condicoes.append(Book.id != exceto_id)
+        return any(self.em_paralelo(
+            lambda sessao, indice: sessao.scalar(select(Book.id).where(*condicoes).limit(1)) is not None
+        ))
+
+    def estatisticas(self):
+        """(total, disponíveis, {category_id: total}) somados entre os shards"""
+        def consultar(sessao, indice):
+            total = sessao.scalar(select(func.count()).select_from(Book))
+            disponiveis = sessao.scalar(select(func.count()).select_from(Book).where(Book.disponivel == db.true()))
+            por_categoria = sessao.execute(
+                select(Book.category_id, func.count()).where(Book.category_id.isnot(None)).group_by(Book.category_id)
+            ).all()
+            return total, disponiveis, por_categoria
+
+        total, disponiveis, por_categoria = 0, 0, {}
+        for parcial, disponiveis_parcial, categorias in self.em_paralelo(consultar):
+            total += parcial
+            disponiveis += disponiveis_parcial
+            for category_id, quantidade in categorias:
+                por_categoria[category_id] = por_categoria.get(category_id, 0) + quantidade
+        return total, disponiveis, por_categoria
+
+
+shards = Shards()
+
+
+def carregar_livros(ids):
+    """Livros pelos ids, no banco principal ou nos shards"""
+    if not ids:
+        return []
+    if shards.ativo:
+        return shards.carregar(ids)
+    return Book.query.filter(Book.id.in_(ids)).all()
+
+
+def linhas_livros(*colunas):
+    """Colunas de todos os livros, no banco principal ou nos shards"""
+    if shards.ativo:
+        return shards.linhas(*colunas)
+    return db.session.query(*colunas).all()
+
+
+# ==============================================
+# Rebalanceamento
+# ==============================================
+def rebalancear(total_novo, diretorio=DIRETORIO):
+    """
+    Redistribui os livros do banco principal e dos shards atuais em total_novo
+    shards (0 = todos no banco principal). Cada lote é gravado no destino antes
+    de ser removido da origem, então uma execução interrompida pode ser repetida.
+    O log de alterações ainda não repassado pelos shards atuais vai antes para
+    o banco principal.
+    """
+    atuais = shards_existentes(diretorio)
+    principal = criar_engine(DB_PATH)
+    engines = {indice: criar_engine(caminho_shard(indice, diretorio))
+               for indice in set(atuais) | set(range(total_novo))}
+
+    for indice in atuais:
+        with Session(engines[indice]) as sessao_shard, Session(principal) as sessao:
+            repassar_alteracoes(sessao_shard, sessao)
+
+    def destino(book_id):
+        return engines[shard_do_id(book_id, total_novo)] if total_novo else principal
+
+    livros = Book.__table__
+    movidos = 0
+    for origem in [principal] + [engines[indice] for indice in atuais]:
+        ultimo_id = 0
+        while True:
+            with origem.connect() as conexao:
+                linhas = conexao.execute(
+                    select(livros).where(livros.c.id > ultimo_id).order_by(livros.c.id).limit(LOTE)
+                ).mappings().all()
+            if not linhas:
+                break
+            ultimo_id = linhas[-1]['id']
+
+            por_destino = {}
+            for linha in linhas:
+                alvo = destino(linha['id'])
+                if alvo is not origem:
+                    por_destino.setdefault(alvo, []).append(dict(linha))
+
+            for alvo, lote in por_destino.items():
+                with alvo.begin() as conexao:
+                    conexao.execute(livros.insert().prefix_with('OR REPLACE'), lote)
+                with origem.begin() as conexao:
+                    conexao.execute(livros.delete().where(livros.c.id.in_([linha['id'] for linha in lote])))
+                movidos += len(lote)
+
+    # Shards que deixaram de existir já estão vazios
+    for indice in atuais:
+        if indice >= total_novo:
+            engines[indice].dispose()
+            for sufixo in ('', '-wal', '-shm'):
+                if os.path.exists(caminho_shard(indice, diretorio) + sufixo):
+                    os.remove(caminho_shard(indice, diretorio) + sufixo)
+
+    for engine in [principal, *engines.values()]:
+        engine.dispose()
+    return movidos
+
+
+def info(diretorio=DIRETORIO):
+    """Quantidade de livros no banco principal e em cada shard"""
+    contagens = {'principal': 0}
+    for nome, caminho in [('principal', DB_PATH)] + [
+        (f'shard{indice}', caminho_shard(indice, diretorio)) for indice in shards_existentes(diretorio)
+    ]:
+        engine = create_engine(f'sqlite:///{caminho}')
+        with engine.connect() as conexao:
+            contagens[nome] = conexao.execute(select(func.count()).select_from(Book.__table__)).scalar()
+        engine.dispose()
+    return contagens
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'rebalancear':
+        total = int(sys.argv[2])
+        print(f"🔀 {rebalancear(total)} livro(s) movidos; shards: {total or 'nenhum (banco principal)'}")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'info':
+        for nome, total in info().items():
+            print(f"   {nome}: {total} livro(s)")
+    else:
+        print("Uso: python sharding.py rebalancear N | info")
@@ -0,0 +1,168 @@
+"""
+Autocomplete de títulos e autores a partir de um índice de prefixos em memória.
+
+Cada processo mantém uma lista ordenada de chaves normalizadas (o texto
+inteiro e o texto a partir de cada palavra, para "code" achar "Clean Code");
+a busca é um bisect seguido de uma varredura curta, sem acessar o banco.
+
+As rotas de escrita agendam as alterações na sessão e elas são aplicadas no
+índice só depois do commit (descartadas no rollback). Alterações feitas por
+outros processos são lidas do log book_changes no máximo uma vez por
+intervalo.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+
+from sqlalchemy import event
+
+from models import db, Book, BookChange, normalizar_texto
+from sharding import carregar_livros, linhas_livros
+
+CAMPOS = ('titulo', 'autor')
+LIMITE_PADRAO = 10
+LIMITE_MAXIMO = 50
+VARREDURA_MAXIMA = 500     # Chaves examinadas por consulta (autores repetidos em muitos livros)
+INTERVALO_SINCRONIA = 1.0  # Segundos entre leituras do log de alterações
+MAX_ALTERACOES = 1000      # Acima disso o índice é reconstruído
+
+
+def chaves_do_texto(texto):
+    """Texto normalizado inteiro e a partir do início de cada palavra"""
+    normalizado = normalizar_texto(texto)
+    chaves = [normalizado] if normalizado else []
+    for i, caractere in enumerate(normalizado):
+        if caractere == ' ':
+            chaves.append(normalizado[i + 1:])
+    return chaves
+
+
+class IndiceSugestoes:
+    """Lista ordenada de (chave, campo, book_id) com os textos originais por livro"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chaves = []
+        self.livros = {}   # book_id -> {'titulo': ..., 'autor': ...}
+        self.seq = None    # Último id de book_changes refletido no índice
+        self.sincronizado_em = 0.0
+
+    def init_app(self, app):
+        self.intervalo = app.config.get('SUGESTOES_INTERVALO', INTERVALO_SINCRONIA)
+        event.listen(db.session, 'after_commit', self._aplicar_pendentes)
+        event.listen(db.session, 'after_rollback', lambda session: session.info.pop('sugestoes', None))
+
+    # ---- Atualização ----
+
+    def _inserir(self, book_id, titulo, autor):
+        self.livros[book_id] = {'titulo': titulo, 'autor': autor}
+        for campo, texto in (('titulo', titulo), ('autor', autor)):
+            for chave in chaves_do_texto(texto):
+                insort(self.chaves, (chave, campo, book_id))
+
+    def _remover(self, book_id):
+        textos = self.livros.pop(book_id, None)
+        if textos is None:
+            return
+        for campo in CAMPOS:
+            for chave in chaves_do_texto(textos[campo]):
+                posicao = bisect_left(self.chaves, (chave, campo, book_id))
+                if posicao < len(self.chaves) and self.chaves[posicao] == (chave, campo, book_id):
+                    del self.chaves[posicao]
+
+    def atualizar(self, book_id, titulo, autor):
+        with self.lock:
+            self._remover(book_id)
+            self._inserir(book_id, titulo, autor)
+
+    def remover(self, book_id):
+        with self.lock:
+            self._remover(book_id)
+
+    def agendar(self, livro, operacao, sessao=None):
+        """Chamado pelas rotas de escrita: aplica a alteração após o commit da sessão"""
+        pendentes = (db.session if sessao is None else sessao).info.setdefault('sugestoes', [])
+        pendentes.append((operacao, livro.id, livro.titulo, livro.autor))
+
+    def _aplicar_pendentes(self, session):
+        for operacao, book_id, titulo, autor in session.info.pop('sugestoes', []):
+            if operacao == 'delete':
+                self.remover(book_id)
+            else:
+                self.atualizar(book_id, titulo, autor)
+
+    # ---- Carga e sincronização ----
+
+    def construir(self):
+        """Carrega o catálogo inteiro (na inicialização do processo)"""
+        seq = db.session.query(db.func.max(BookChange.id)).scalar() or 0
+        linhas = linhas_livros(Book.id, Book.titulo, Book.autor)
+
+        chaves, livros = [], {}
+        for book_id, titulo, autor in linhas:
+            livros[book_id] = {'titulo': titulo, 'autor': autor}
+            for campo, texto in (('titulo', titulo), ('autor', autor)):
+                chaves.extend((chave, campo, book_id) for chave in chaves_do_texto(texto))
+        chaves.sort()
+
+        with self.lock:
+            self.chaves, self.livros, self.seq = chaves, livros, seq
+            self.sincronizado_em = time.monotonic()
+
+    def sincronizar(self):
+        """Aplica as alterações de outros processos registradas em book_changes"""
+        if self.seq is None:
+            self.construir()
+            return
+        if time.monotonic() - self.sincronizado_em < self.intervalo:
+            return
+        self.sincronizado_em = time.monotonic()
+
+        alteracoes = db.session.query(BookChange.id, BookChange.book_id, BookChange.operacao) \
+            .filter(BookChange.id > self.seq).order_by(BookChange.id).limit(MAX_ALTERACOES + 1).all()
+        if not alteracoes:
+            return
+        if len(alteracoes) > MAX_ALTERACOES:
+            self.construir()
+            return
+
+        ultimas = {book_id: operacao for _, book_id, operacao in alteracoes}
+        ids = [book_id for book_id, operacao in ultimas.items() if operacao not in BookChange.OPERACOES_REMOCAO]
+        textos = {livro.id: (livro.titulo, livro.autor) for livro in carregar_livros(ids)}
+
+        with self.lock:
+            for book_id in ultimas:
+                self._remover(book_id)
+                if book_id in textos:
+                    self._inserir(book_id, *textos[book_id])
+            self.seq = alteracoes[-1].id
+
+    # ---- Consulta ----
+
+    def sugerir(self, prefixo, limite=LIMITE_PADRAO, campos=CAMPOS):
+        """Até `limite` sugestões distintas cujo título ou autor começa (em alguma palavra) pelo prefixo"""
+        prefixo = normalizar_texto(prefixo)
+        if not prefixo:
+            return []
+
+        sugestoes, vistos = [], set()
+        with self.lock:
+            posicao = bisect_left(self.chaves, (prefixo,))
+            fim = min(len(self.chaves), posicao + VARREDURA_MAXIMA)
+            while posicao < fim and len(sugestoes) < limite:
+                chave, campo, book_id = self.chaves[posicao]
+                posicao += 1
+                if not chave.startswith(prefixo):
+                    break
+                texto = self.livros[book_id][campo]
+                if campo not in campos or (campo, texto) in vistos:
+                    continue
+                vistos.add((campo, texto))
+                sugestao = {'texto': texto, 'campo': campo}
+                if campo == 'titulo':
+                    sugestao['livro_id'] = book_id
+                sugestoes.append(sugestao)
+        return sugestoes
+
+
+indice_sugestoes = IndiceSugestoes()
@@ -0,0 +1,105 @@
+"""
+Serialização XML incremental para as representações da API.
+
+Gera o documento em pedaços a partir de um gerador, escapando texto e
+atributos, para que coleções grandes sejam enviadas em streaming sem
+montar o corpo inteiro em memória.
+"""
+import re
+from xml.sax.saxutils import escape, quoteattr
+
+# Nome do elemento usado para cada item de uma lista
+SINGULARES = {
+    'livros': 'livro',
+    'usuarios': 'usuario',
+    'categorias': 'categoria',
+}
+
+TAMANHO_BLOCO = 8192  # Bytes aproximados por pedaço enviado ao cliente
+
+_CARACTERE_INVALIDO = re.compile(r'[^A-Za-z0-9_.-]')
+# Caracteres de controle proibidos no XML 1.0 (nem escapados são aceitos)
+_CONTROLE_INVALIDO = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def nome_elemento(nome):
+    """Converte uma chave qualquer em um nome de elemento XML válido"""
+    nome = _CARACTERE_INVALIDO.sub('_', str(nome))
+    if not nome or not (nome[0].isalpha() or nome[0] == '_') or nome.lower().startswith('xml'):
+        nome = f'_{nome}'
+    return nome
+
+
+def singular(nome):
+    """Retorna o nome do elemento para os itens de uma lista"""
+    return SINGULARES.get(nome, 'item')
+
+
+def formatar(valor):
+    """
+    Formata um valor escalar como string (booleanos no estilo JSON), removendo
+    os caracteres de controle que deixariam o documento mal formado
+    """
+    if isinstance(valor, bool):
+        return 'true' if valor else 'false'
+    return _CONTROLE_INVALIDO.sub('', str(valor))
+
+
+def texto(valor):
+    """Formata um valor escalar como texto XML escapado"""
+    return escape(formatar(valor))
+
+
+def iter_links(links):
+    """Gera os links HAL como elementos <link rel="..." href="..."/>"""
+    yield '<_links>'
+    for rel, link in links.items():
+        atributos = [f'rel={quoteattr(formatar(rel))}']
+        for chave, valor in link.items():
+            atributos.append(f'{nome_elemento(chave)}={quoteattr(formatar(valor))}')
+        yield f'<link {" ".join(atributos)}/>'
+    yield '</_links>'
+
+
+def iter_elemento(nome, valor):
+    """Gera um elemento (e seus filhos) recursivamente"""
+    tag = nome_elemento(nome)
+
+    if valor is None:
+        yield f'<{tag}/>'
+    elif isinstance(valor, dict):
+        yield f'<{tag}>'
+        for chave, item in valor.items():
+            if chave == '_links':
+                yield from iter_links(item)
+            else:
+                yield from iter_elemento(chave, item)
+        yield f'</{tag}>'
+    elif isinstance(valor, (list, tuple)):
+        yield f'<{tag}>'
+        item_tag = singular(nome)
+        for item in valor:
+            yield from iter_elemento(item_tag, item)
+        yield f'</{tag}>'
+    else:
+        yield f'<{tag}>{texto(valor)}</{tag}>'
+
+
+def iter_xml(dados, raiz='resposta'):
+    """
+    Gera o documento XML completo em pedaços de até ~TAMANHO_BLOCO bytes.
+    O consumo de memória não depende do tamanho da coleção serializada.
+    """
+    buffer = ['<?xml version="1.0" encoding="UTF-8"?>']
+    tamanho = len(buffer[0])
+
+    for pedaco in iter_elemento(raiz, dados):
+        buffer.append(pedaco)
+        tamanho += len(pedaco)
+        if tamanho >= TAMANHO_BLOCO:
+            yield ''.join(buffer)
+            buffer = []
+            tamanho = 0
+
+    if buffer:
+        yield ''.join(buffer)
@@ -58,6 +58,11 @@ export const booksService = {
     return response.data;
   },
   
+  async suggestBooks(prefix, limit = 10) {
+    const response = await api.get(`/livros/sugerir?prefix=${encodeURIComponent(prefix)}&limite=${limit}`);
+    return response.data;
+  },
+  
   async createBook(bookData) {
     const response = await api.post('/livros', bookData);
     return response.data;
@@ -79,4 +84,13 @@ export const booksService = {
   }
 };
 
+// Serviço de batch (várias chamadas em uma única requisição)
+export const batchService = {
+  async execute(operations, transaction = false) {
+    const params = transaction ? { transacao: true } : {};
+    const response = await api.post('/batch', operations, { params });
+    return response.data.respostas;
+  }
+};
+
 export default api; 
\ No newline at end of file